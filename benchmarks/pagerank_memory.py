@@ -0,0 +1,79 @@
+"""
+Peak memory and time of a PageRank pass over a random link graph: through an igraph
+Graph built by `LinkGraph.to_igraph()`, or by `streamed_pagerank` reading the edge
+columns. Each one runs in its own process, memory is its peak RSS above the RSS once
+the graph is built (Linux).
+
+    python benchmarks/pagerank_memory.py --nodes 200000 --edges 4000000
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crowl'))
+
+import numpy as np
+from linkgraph import LinkGraph
+from pagerank import streamed_pagerank
+
+MODES = ('igraph', 'streamed')
+
+
+def random_graph(nodes, edges, seed):
+    """
+    Returns a `LinkGraph` of `nodes` URLs and `edges` random weighted links.
+    """
+    rng = np.random.default_rng(seed)
+    graph = LinkGraph()
+    graph.urls = ['http://localhost/page-{}.html'.format(c) for c in range(nodes)]
+    graph.ids = {url: node for node, url in enumerate(graph.urls)}
+    graph.sources = array('i', rng.integers(0, nodes, edges, dtype=np.int32).tobytes())
+    graph.targets = array('i', rng.integers(0, nodes, edges, dtype=np.int32).tobytes())
+    graph.weights = array('f', rng.random(edges, dtype=np.float32).tobytes())
+    return graph
+
+
+def rss(field):
+    """
+    Returns `VmRSS` or `VmHWM` (peak) of the process, in bytes.
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def run(mode, nodes, edges, seed):
+    graph = random_graph(nodes, edges, seed)
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')  # Resets the peak to the current RSS
+    before = rss('VmRSS')
+    start = time.perf_counter()
+    if mode == 'igraph':
+        g = graph.to_igraph()
+        scores = g.pagerank(weights="weight")
+    else:
+        scores = streamed_pagerank(graph)
+    elapsed = time.perf_counter() - start
+    print("{:<9} {:>8.0f} MB {:>7.2f}s  PageRank of the first page: {:.12g}".format(
+        mode, (rss('VmHWM') - before) / 1e6, elapsed, scores[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="PageRank memory usage")
+    parser.add_argument('--nodes', help="Number of URLs", default=200000, type=int)
+    parser.add_argument('--edges', help="Number of links", default=4000000, type=int)
+    parser.add_argument('--seed', help="Random seed", default=0, type=int)
+    parser.add_argument('--mode', help=argparse.SUPPRESS, choices=MODES)  # Run by the parent process
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.nodes, args.edges, args.seed)
+    else:
+        print("{} URLs, {} links, {:.0f} MB of edge columns".format(args.nodes, args.edges, args.edges * 12 / 1e6))
+        for mode in MODES:
+            subprocess.check_call([sys.executable, __file__, '--mode', mode, '--nodes', str(args.nodes),
+                                   '--edges', str(args.edges), '--seed', str(args.seed)])
@@ -0,0 +1,70 @@
+"""
+Throughput of the WARC writer thread, alone: synthetic HTML responses are queued
+as fast as the writer accepts them, the way CrowlWarcPipeline does.
+
+    python benchmarks/warc_writer.py --responses 3000 --size 40000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crowl'))
+
+from scrapy.http import Request, HtmlResponse
+from warc import WarcWriter
+
+WORDS = ['crawl', 'page', 'link', 'content', 'title', 'index', 'search', 'site', 'html', 'text']
+
+
+def page(size, rng):
+    """
+    Returns an HTML body of about `size` bytes.
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return '<html><body><p>{}</p></body></html>'.format(' '.join(words)).encode('utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="WARC writer throughput")
+    parser.add_argument('--responses', help="Number of responses", default=3000, type=int)
+    parser.add_argument('--size', help="Size of response bodies, in bytes", default=40000, type=int)
+    parser.add_argument('--seed', help="Random seed", default=0, type=int)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bodies = [page(args.size, rng) for _ in range(50)]
+    entries = list()
+    for c in range(args.responses):
+        url = 'http://localhost/page-{}.html'.format(c)
+        request = Request(url)
+        entries.append((request, HtmlResponse(url, body=bodies[c % len(bodies)], request=request,
+                                              headers={'Content-Type': 'text/html'})))
+    payload = sum(len(response.body) for _, response in entries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        drained = threading.Event()
+        writer = WarcWriter(directory, 'benchmark', on_drained=drained.set)
+        refused = 0
+        start = time.perf_counter()
+        for entry in entries:
+            while not writer.write(*entry):
+                refused += 1
+                drained.wait()
+                drained.clear()
+        writer.close()
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    print("{} responses, {:.1f} MB of bodies in {:.2f}s".format(args.responses, payload / 1e6, elapsed))
+    print("{:.0f} responses/s, {:.1f} MB/s".format(args.responses / elapsed, payload / 1e6 / elapsed))
+    print("{:.1f} MB of WARC files, {} writes refused while the queue was full".format(size / 1e6, refused))
+    print("{} records, {} errors".format(writer.records, writer.errors))
@@ -10,7 +10,8 @@ class cfgMaker:
         config['CRAWLER'] = {'USER_AGENT': 'Crowl (+https://www.crowl.tech/)',
                              'ROTATE_USER_AGENTS': False,
                              'DOWNLOAD_DELAY': 0.5,
-                             'CONCURRENT_REQUESTS': datas[1]}
+                             'CONCURRENT_REQUESTS': datas[1],
+                             'ADAPTIVE_THROTTLE': datas[5]}
         config['EXTRACTION'] = {'LINKS': True,
                                 'LINKS_UNIQUE': False,
                                 'CONTENT': True,
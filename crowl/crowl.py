@@ -1,3 +1,5 @@
+import os
+import math
 import argparse
 import configparser
 from scrapy.crawler import CrawlerProcess
@@ -5,6 +7,19 @@ from scrapy.settings import Settings
 import scrapy
 from utils import *
 from spiders import Crowler
+from xpaths import validate_extractors
+from offload import pool_size
+from lang import DETECTORS
+from robotstxt import CrowlRobotsMiddleware
+from recrawl import CrowlIncrementalMiddleware, load_previous_crawl
+from store import ResponseStore, CrowlResponseStoreExtension, CrowlReplayMiddleware
+from throttle import CrowlAdaptiveThrottle
+from sitemaps import CrowlSitemapMiddleware
+from dupefilter import DUPEFILTERS, CrowlDupeFilter, CrowlBloomDupeFilter
+from frontier import FRONTIERS, CrowlFrontierScheduler, CrowlHostPriorityQueue, CrowlDiskQueue
+from shards import CrowlShardMiddleware, run_workers, worker_name, merge_csv, merged_pagerank, FRONTIER_FILE
+from linkgraph import GRAPH_DIR
+from fingerprint import FINGERPRINTS_FILE
 from pipelines import *
 from ast import literal_eval
 
@@ -14,7 +29,17 @@ if __name__ == '__main__':
         required=True, type=str)
     parser.add_argument('-r','--resume',help="Output name (resume crawl)",
         default=None, type=str)
+    parser.add_argument('--replay',help="Response store of a previous crawl, extracts it again without network",
+        default=None, type=str)
+    parser.add_argument('--incremental-from',help="Output name of a previous crawl, unchanged pages are not re-extracted",
+        default=None, type=str)
+    parser.add_argument('--workers',help="Number of crawler processes, each one crawls a share of the URLs",
+        default=1, type=int)
+    parser.add_argument('--shard',help=argparse.SUPPRESS, default=None, type=int)  # Index of a worker process
     args = parser.parse_args()
+    if args.workers > 1 and args.replay:
+        print("--replay can't be used with --workers.")
+        exit(1)
 
     #######################
     # Parse the config file
@@ -22,17 +47,31 @@ if __name__ == '__main__':
     config.optionxform=str #Config Keys are case sensitive, this preserves case
     config.read(args.conf)
 
-    start_url = config.get('PROJECT','START_URL')
-    # Check if start URL is valid
-    if not validate_url(start_url):
-        print("Start URL not valid, please enter a valid HTTP or HTTPS URL.")
-        exit(1)
+    # Multi-site crawl: START_URLS lists one start URL per line, with an optional depth limit
+    if config.has_option('PROJECT','START_URLS'):
+        try:
+            seeds = parse_start_urls(config.get('PROJECT','START_URLS'))
+        except ValueError as e:
+            print("START_URLS not valid: {}".format(e))
+            exit(1)
+    else:
+        start_url = config.get('PROJECT','START_URL')
+        # Check if start URL is valid
+        if not validate_url(start_url):
+            print("Start URL not valid, please enter a valid HTTP or HTTPS URL.")
+            exit(1)
+        seeds = [(start_url, None)]
+    start_url = seeds[0][0]
+    sites = list(dict.fromkeys(urlparse(url).netloc for url, _ in seeds))
+    partitions = sites if len(sites) > 1 else [None]  # Output files of each site
     project_name = config.get('PROJECT','PROJECT_NAME')
 
     # Crawler conf
     settings = get_settings()
     settings.set('USER_AGENT', config.get('CRAWLER','USER_AGENT', fallback='Crowl (+https://www.crowl.tech/)'))
     settings.set('ROBOTSTXT_OBEY', config.getboolean('CRAWLER','ROBOTS_TXT_OBEY', fallback=True))
+    # A robots.txt answering 401 or 403 disallows everything, instead of allowing everything as Scrapy does
+    settings.set('ROBOTSTXT_STRICT', config.getboolean('CRAWLER','ROBOTS_TXT_STRICT', fallback=False))
     # Set headers
     headers = settings.get('DEFAULT_REQUEST_HEADERS')
     headers.update({
@@ -45,35 +84,86 @@ if __name__ == '__main__':
     settings.set('CONCURRENT_REQUESTS', int(config.get('CRAWLER','CONCURRENT_REQUESTS', fallback=5)))
     # Set referer setting
     settings.set('REFERER_ENABLED', config.getboolean('CRAWLER', 'REFERER_ENABLED', fallback=True))
-    # Set requests limit
-    settings.set('CLOSESPIDER_PAGECOUNT',int(config.get('EXTRACTION','MAX_REQUESTS',fallback=0)))
+    # Set requests limit, shared between workers
+    settings.set('CLOSESPIDER_PAGECOUNT',math.ceil(int(config.get('EXTRACTION','MAX_REQUESTS',fallback=0)) / args.workers))
 
     extractors = config.get('EXTRACTION','CUSTOM_EXTRACTORS',fallback=None)
     if extractors:
         extractors = literal_eval(extractors)
+        # Check custom extractors before crawling rather than failing on each page
+        try:
+            validate_extractors(extractors)
+        except ValueError as e:
+            print("Custom extractors not valid: {}".format(e))
+            exit(1)
 
     # Crawler conf
     conf = {
         'url': start_url, 
+        'seeds': seeds,
         'links': config.getboolean('EXTRACTION','LINKS',fallback=False),
         'links_unique': config.getboolean('EXTRACTION','LINKS_UNIQUE',fallback=True),
         'content': config.getboolean('EXTRACTION','CONTENT',fallback=False),
         'depth': int(config.get('EXTRACTION','DEPTH',fallback=5)),
         'exclusion_pattern': config.get('CRAWLER','EXCLUSION_PATTERN',fallback=None),
-        'surfer': config.get('EXTRACTION','SURFER',fallback=None),
+        'surfer': config.get('EXTRACTION','SURFER',fallback='basic'),
         'check_lang': config.getboolean('EXTRACTION','CHECK_LANG',fallback=False),
         'extractors': extractors,
         'store_request_headers': config.getboolean('EXTRACTION','STORE_REQUEST_HEADERS',fallback=False),
         'store_response_headers': config.getboolean('EXTRACTION','STORE_RESPONSE_HEADERS',fallback=False),
+        'microdata': config.getboolean('EXTRACTION','MICRODATA',fallback=True),
+        'lang_detector': config.get('EXTRACTION','LANG_DETECTOR',fallback='auto'),
+        'lang_model': config.get('EXTRACTION','LANG_MODEL',fallback=None),
+        'lang_sample_size': int(config.get('EXTRACTION','LANG_SAMPLE_SIZE',fallback=4096)),
+        'extraction_processes': pool_size(config.get('EXTRACTION','PROCESSES',fallback=0)),
         'http_user': config.get('AUTH','HTTP_USER',fallback=None),
         'http_pass': config.get('AUTH','HTTP_PASS',fallback=None),
+        'pagerank_mode': config.get('EXTRACTION','PAGERANK',fallback='incremental'),
+        'pagerank_interval_pages': int(config.get('EXTRACTION','PAGERANK_INTERVAL_PAGES',fallback=500)),
+        'pagerank_interval_seconds': float(config.get('EXTRACTION','PAGERANK_INTERVAL_SECONDS',fallback=30)),
+        'robots_ttl': float(config.get('CRAWLER','ROBOTS_TXT_TTL',fallback=86400)),
+        'robots_max_hosts': int(config.get('CRAWLER','ROBOTS_TXT_MAX_HOSTS',fallback=1000)),
+        'sitemaps': config.getboolean('CRAWLER','SITEMAPS',fallback=False),
+        'sitemap_priority': int(config.get('CRAWLER','SITEMAP_PRIORITY',fallback=-100)),
+        'frontier': config.get('CRAWLER','FRONTIER',fallback='breadth-first'),
+        'memory_budget': float(config.get('CRAWLER','MEMORY_BUDGET',fallback=0)),
+        'duplicates': config.getboolean('EXTRACTION','DUPLICATES',fallback=True),
+        'duplicates_cache': int(config.get('EXTRACTION','DUPLICATES_CACHE',fallback=1000)),
     }
 
+    if conf['lang_detector'] not in DETECTORS:
+        print("LANG_DETECTOR must be one of: {}".format(', '.join(DETECTORS)))
+        exit(1)
+
+    # Seen URLs: 64 bits fingerprints in a binary file of JOBDIR, or a Bloom filter
+    dupefilter = config.get('CRAWLER','DUPEFILTER',fallback='hash')
+    if dupefilter not in DUPEFILTERS:
+        print("DUPEFILTER must be one of: {}".format(', '.join(DUPEFILTERS)))
+        exit(1)
+    if DUPEFILTERS[dupefilter]:
+        settings.set('DUPEFILTER_CLASS', DUPEFILTERS[dupefilter])
+        settings.set('DUPEFILTER_ERROR_RATE', float(config.get('CRAWLER','DUPEFILTER_ERROR_RATE',fallback=0.001)))
+
+    # Best-first frontier: link weights decide the crawl order instead of depth
+    if conf['frontier'] not in FRONTIERS:
+        print("FRONTIER must be one of: {}".format(', '.join(FRONTIERS)))
+        exit(1)
+    settings.set('FRONTIER', conf['frontier'])
+    if conf['frontier'] == 'best-first':
+        settings.set('DEPTH_PRIORITY', 0)
+    # Workers don't crawl level by level either, queued URLs keep the shortest depth found
+    if conf['frontier'] == 'best-first' or args.workers > 1:
+        settings.set('SCHEDULER', 'crowl.CrowlFrontierScheduler')
+
     # Output pipelines
     pipelines = dict()
     for pipeline, priority in config['OUTPUT'].items():
         pipelines[pipeline] = int(priority)
 
+    # Extraction in worker processes, items are completed before output pipelines
+    if conf['extraction_processes']:
+        pipelines['crowl.CrowlExtractionPipeline'] = 0
+
     settings.set('ITEM_PIPELINES', pipelines)
     
     # if MySQL Pipeline, we need to add settings
@@ -83,6 +173,104 @@ if __name__ == '__main__':
         settings.set('MYSQL_USER',config['MYSQL']['MYSQL_USER'])
         settings.set('MYSQL_PASSWORD',config['MYSQL']['MYSQL_PASSWORD'])
 
+    # if WARC Pipeline, where and how big files are
+    if 'crowl.CrowlWarcPipeline' in pipelines.keys():
+        if config.has_option('WARC','WARC_DIRECTORY'):
+            settings.set('WARC_DIRECTORY',config['WARC']['WARC_DIRECTORY'])
+        settings.set('WARC_MAX_SIZE',int(config.get('WARC','WARC_MAX_SIZE',fallback=1000)) * 1024 * 1024)
+
+    # robots.txt is fetched once per host for both ROBOTSTXT_OBEY and disallow flags
+    middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
+    middlewares.update({
+        'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware': None,
+        'crowl.CrowlRobotsMiddleware': 100,
+    })
+    settings.set(
+        'DOWNLOADER_MIDDLEWARES',
+        middlewares
+    )
+
+    # Replay: responses come from a store, only extraction runs
+    if args.replay:
+        store_path = args.replay if os.path.isdir(args.replay) else '{}_responses'.format(args.replay)
+        if not os.path.isdir(store_path):
+            print("Response store not found: {}".format(store_path))
+            exit(1)
+        conf['replay'] = ResponseStore(store_path)
+        settings.set('CRAWLSPIDER_FOLLOW_LINKS', False)  # Every stored page is requested
+        settings.set('DOWNLOAD_DELAY', 0)
+        settings.set('CONCURRENT_REQUESTS', 64)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', 64)
+        middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
+        middlewares.update({
+            'crowl.CrowlReplayMiddleware': 950,
+        })
+        settings.set(
+            'DOWNLOADER_MIDDLEWARES',
+            middlewares
+        )
+
+    # Incremental crawl: conditional requests for pages of the previous crawl
+    elif args.incremental_from:
+        try:
+            conf['previous'] = load_previous_crawl(args.incremental_from, config, sites if len(sites) > 1 else None)
+        except (OSError, ValueError) as e:
+            print("Could not load previous crawl: {}".format(e))
+            exit(1)
+        print("Incremental crawl from {}: {} pages can be revalidated".format(
+            args.incremental_from, len(conf['previous'])))
+        middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
+        middlewares.update({
+            'crowl.CrowlIncrementalMiddleware': 590,
+        })
+        settings.set(
+            'DOWNLOADER_MIDDLEWARES',
+            middlewares
+        )
+
+    # Sitemap URLs are checked against the dupefilter when they are about to be crawled
+    if not args.replay and conf['sitemaps']:
+        middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
+        middlewares.update({
+            'crowl.CrowlSitemapMiddleware': 50,
+        })
+        settings.set(
+            'DOWNLOADER_MIDDLEWARES',
+            middlewares
+        )
+
+    # Adaptive throttle: per host concurrency and delay follow latency and errors,
+    # CONCURRENT_REQUESTS and DOWNLOAD_DELAY are the starting point
+    if not args.replay and config.getboolean('CRAWLER','ADAPTIVE_THROTTLE',fallback=False):
+        max_concurrency = int(config.get('CRAWLER','ADAPTIVE_MAX_CONCURRENCY',fallback=16))
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', settings.getint('CONCURRENT_REQUESTS'))
+        settings.set('CONCURRENT_REQUESTS', max(max_concurrency, settings.getint('CONCURRENT_REQUESTS')))
+        settings.set('ADAPTIVE_MIN_CONCURRENCY', int(config.get('CRAWLER','ADAPTIVE_MIN_CONCURRENCY',fallback=1)))
+        settings.set('ADAPTIVE_MAX_CONCURRENCY', max_concurrency)
+        settings.set('ADAPTIVE_MIN_DELAY', float(config.get('CRAWLER','ADAPTIVE_MIN_DELAY',fallback=0)))
+        settings.set('ADAPTIVE_MAX_DELAY', float(config.get('CRAWLER','ADAPTIVE_MAX_DELAY',fallback=10)))
+        settings.set('ADAPTIVE_WINDOW', int(config.get('CRAWLER','ADAPTIVE_WINDOW',fallback=20)))
+        settings.set('ADAPTIVE_LATENCY_FACTOR', float(config.get('CRAWLER','ADAPTIVE_LATENCY_FACTOR',fallback=2)))
+        settings.set('ADAPTIVE_MAX_ERROR_RATE', float(config.get('CRAWLER','ADAPTIVE_MAX_ERROR_RATE',fallback=0.1)))
+        middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
+        middlewares.update({
+            'crowl.CrowlAdaptiveThrottle': 990,
+        })
+        settings.set(
+            'DOWNLOADER_MIDDLEWARES',
+            middlewares
+        )
+
+    # Multi-site crawl: CONCURRENT_REQUESTS applies to each host, each one has its own
+    # download slot and DOWNLOAD_DELAY, the scheduler gives them requests in turns
+    if len(sites) > 1:
+        if not args.replay:
+            if not config.getboolean('CRAWLER','ADAPTIVE_THROTTLE',fallback=False):
+                settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', settings.getint('CONCURRENT_REQUESTS'))
+            settings.set('CONCURRENT_REQUESTS', settings.getint('CONCURRENT_REQUESTS') * len(sites))
+        settings.set('SCHEDULER_PRIORITY_QUEUE', 'crowl.CrowlHostPriorityQueue')
+        settings.set('OUTPUT_PER_SITE', True)
+
     if config.getboolean('CRAWLER','ROTATE_USER_AGENTS',fallback=False):
         middlewares = settings.get('DOWNLOADER_MIDDLEWARES')
         middlewares.update({
@@ -143,8 +331,86 @@ if __name__ == '__main__':
         output_name = args.resume
         settings.set('OUTPUT_NAME',output_name)
 
+    # Workers: the main process runs them, then merges their outputs
+    crawl_dir = 'crawls/{}'.format(output_name)
+    if args.workers > 1 and args.shard is None:
+        os.makedirs(crawl_dir, exist_ok=True)
+        argv = ['--conf', args.conf]
+        if args.incremental_from:
+            argv += ['--incremental-from', args.incremental_from]
+        print("Crawling {} with {} workers".format(output_name, args.workers))
+        failed = run_workers(argv, output_name, args.workers, os.path.join(crawl_dir, FRONTIER_FILE))
+
+        # PageRank over the links found by all workers
+        pagerank = merged_pagerank(output_name, args.workers, os.path.join(crawl_dir, GRAPH_DIR),
+                                   int(conf['memory_budget'] * 1024 * 1024) or None)
+        if 'crowl.CrowlCsvPipeline' in pipelines.keys():
+            for site in partitions:
+                for name in ('urls', 'links'):
+                    merge_csv(['{}_{}.csv'.format(partition_name(worker_name(output_name, shard), site), name)
+                               for shard in range(args.workers)],
+                              '{}_{}.csv'.format(partition_name(output_name, site), name))
+                rewrite_csv_column('{}_urls.csv'.format(partition_name(output_name, site)), 'pagerank',
+                                   lambda row: pagerank.get(row['url']))
+            if conf['sitemaps']:
+                decide_orphans(['{}_urls.csv'.format(partition_name(output_name, site)) for site in partitions],
+                               pagerank.graph)
+        if 'crowl.CrowlMySQLPipeline' in pipelines.keys():
+            store_pageranks(
+                output_name,
+                config['MYSQL']['MYSQL_HOST'],
+                config['MYSQL']['MYSQL_PORT'],
+                config['MYSQL']['MYSQL_USER'],
+                config['MYSQL']['MYSQL_PASSWORD'],
+                pagerank.items())
+            if conf['sitemaps']:
+                store_orphans(
+                    output_name,
+                    config['MYSQL']['MYSQL_HOST'],
+                    config['MYSQL']['MYSQL_PORT'],
+                    config['MYSQL']['MYSQL_USER'],
+                    config['MYSQL']['MYSQL_PASSWORD'],
+                    pagerank.graph)
+        print("Output: {} ({} urls, {} links)".format(output_name, pagerank.graph.node_count(), len(pagerank.graph)))
+        exit(1 if failed else 0)
+
+    # Worker: crawls the URLs of its shard, other URLs go through the shared frontier
+    if args.shard is not None:
+        output_name = worker_name(output_name, args.shard)
+        settings.set('OUTPUT_NAME',output_name)
+        settings.set('MYSQL_DATABASE',args.resume)  # One database for all workers
+        settings.set('SHARD_INDEX',args.shard)
+        settings.set('SHARD_COUNT',args.workers)
+        settings.set('SHARD_FRONTIER',os.path.join(crawl_dir, FRONTIER_FILE))
+        middlewares = settings.get('SPIDER_MIDDLEWARES')
+        middlewares.update({
+            'crowl.CrowlShardMiddleware': 50,
+        })
+        settings.set(
+            'SPIDER_MIDDLEWARES',
+            middlewares
+        )
+        conf['pagerank_mode'] = 'merged'
+
     # Set JOBDIR to pause/resume crawls 
     settings.set('JOBDIR','crawls/{}'.format(output_name))
+    # Link graph checkpoint, and edges spilled beyond MEMORY_BUDGET (MB)
+    # MEMORY_BUDGET only bounds the links of the graph: half of it for the latest links,
+    # half for a spilled segment read back by PageRank or a checkpoint. Per-URL state
+    # isn't counted: the graph's URL dict and list, PageRank scores and vectors (about
+    # 10 floats per URL while computing), the dupefilter, the scheduler queues and the
+    # duplicates index. The process memory is logged every minute.
+    # The URLs queued by the frontier (best-first, --workers) and their scores are in a
+    # SQLite table of JOBDIR, on disk like the queues themselves.
+    conf['graph_dir'] = os.path.join('crawls/{}'.format(output_name), GRAPH_DIR)
+    conf['checkpoint_interval'] = float(config.get('CRAWLER','GRAPH_CHECKPOINT_INTERVAL',fallback=300))
+    conf['fingerprints_path'] = os.path.join('crawls/{}'.format(output_name), FINGERPRINTS_FILE)
+
+    # Store responses, to extract them again later with --replay
+    if not args.replay and config.getboolean('CRAWLER','STORE_RESPONSES',fallback=False):
+        settings.set('STORE_PATH','{}_responses'.format(output_name))
+        settings.set('STORE_SEGMENT_SIZE',int(config.get('CRAWLER','STORE_SEGMENT_SIZE',fallback=256)) * 1024 * 1024)
+        settings.set('EXTENSIONS',{'crowl.CrowlResponseStoreExtension': 500})
 
     process = CrawlerProcess(settings)
     process.crawl(Crowler, **conf)
@@ -0,0 +1,126 @@
+import copy
+import w3lib.html
+import justext
+import extruct
+from lxml import etree
+from extruct.jsonld import JsonLdExtractor
+from extruct.w3cmicrodata import MicrodataExtractor
+try:
+    from extruct.uniform import _umicrodata_microformat  # Private, extruct is pinned in requirements.txt
+except ImportError:
+    _umicrodata_microformat = None
+
+from lang import text_sample, SAMPLE_SIZE
+
+
+class ParsedDocument:
+    """
+    Parsed view of a response, shared by every extraction stage.
+    The body is parsed once by Scrapy's selector; its lxml tree is reused for
+    link weighting, text extraction, content extraction and microdata.
+
+    Arguments:
+    - response: Scrapy `TextResponse`
+    """
+    def __init__(self, response):
+        self.response = response
+        self.selector = response.selector  # Also used by LinkExtractor and rules, parsed once
+        self.tree = self.selector.root
+        self._text = None
+        self._body_text = None
+        self._base_url = None
+        self._language = False  # None is a valid result
+
+    @property
+    def text(self):
+        """
+        Plain text of the whole document, text nodes separated by spaces.
+        """
+        if self._text is None:
+            self._text = ' '.join(self.tree.itertext())
+        return self._text
+
+    @property
+    def body_text(self):
+        """
+        Text of the `<body>`, without `<script>` and `<style>` contents.
+        """
+        if self._body_text is None:
+            body = next(self.tree.iter('body'), None)
+            self._body_text = ''.join(iter_text(body, skip=('script', 'style'))) if body is not None else ''
+        return self._body_text
+
+    @property
+    def base_url(self):
+        if self._base_url is None:
+            self._base_url = w3lib.html.get_base_url(self.response.text, self.response.url)
+        return self._base_url
+
+    def language(self, detector, sample_size=SAMPLE_SIZE):
+        """
+        Detects the language of the body text, once per document.
+        Returns an ISO 639-1 code, None if unknown.
+
+        Arguments:
+        - detector: detector from `lang.get_detector`
+        - sample_size: characters of text given to the detector
+        """
+        if self._language is False:
+            self._language = detector.detect(text_sample(self.body_text, sample_size))
+        return self._language
+
+    def xpath(self, query):
+        return self.selector.xpath(query)
+
+    def tree_copy(self):
+        """
+        Returns a copy of the tree, for tools modifying it in place.
+        """
+        return copy.deepcopy(self.tree)
+
+    def paragraphs(self, stoplist):
+        """
+        Splits the document into classified paragraphs, same as `justext.justext`.
+        """
+        dom = justext.core.preprocessor(self.tree)  # Works on a cleaned copy
+        paragraphs = justext.core.ParagraphMaker.make_paragraphs(dom)
+        justext.core.classify_paragraphs(paragraphs, stoplist)
+        justext.core.revise_paragraph_classification(paragraphs)
+        return paragraphs
+
+    def microdata(self):
+        """
+        Extracts microdata and JSON-LD, same output as `extruct.extract(..., uniform=True)`.
+        The parsed tree is reused through extruct's private uniform helper, other
+        extruct versions go through `extruct.extract`, which parses the body again.
+        """
+        if _umicrodata_microformat is None:
+            return extruct.extract(self.response.body, base_url=self.base_url, encoding=self.response.encoding,
+                                   syntaxes=['microdata', 'json-ld'], uniform=True)
+        data = dict()
+        data['microdata'] = _umicrodata_microformat(
+            list(MicrodataExtractor().extract_items(self.tree, base_url=self.base_url)),
+            schema_context='http://schema.org')
+        data['json-ld'] = list(JsonLdExtractor().extract_items(self.tree, base_url=self.base_url))
+        return data
+
+
+def iter_text(element, skip=()):
+    """
+    Iterates over text nodes of an element, ignoring the content of `skip` tags and comments.
+    """
+    skipping = 0
+    for event, node in etree.iterwalk(element, events=('start', 'end', 'comment', 'pi')):
+        if event in ('comment', 'pi'):
+            if not skipping and node.tail:
+                yield node.tail
+        elif event == 'start':
+            if node.tag in skip:
+                skipping += 1
+            elif not skipping and node.text:
+                yield node.text
+        else:
+            if node.tag in skip:
+                skipping -= 1
+            if node is not element and not skipping and node.tail:
+                yield node.tail
@@ -0,0 +1,334 @@
+import os
+import math
+import mmap
+import struct
+import logging
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.job import job_dir
+from scrapy.utils.request import request_fingerprint
+
+HEADER = struct.Struct('=8sQQQQ')  # magic, size (slots or bits), count, hash functions, capacity
+COUNT = struct.Struct('=Q')
+COUNT_OFFSET = 16  # After magic and size
+TABLE_MAGIC = b'CRWLFP64'
+BLOOM_MAGIC = b'CRWLBLM2'  # 2: prime sizes
+INITIAL_CAPACITY = 1 << 16
+MAX_LOAD = 0.7  # The table doubles above 70% of used slots
+ERROR_RATE = 0.001
+MIN_BITS = 1 << 16  # Smaller slices give too few distinct double hashing sequences
+GROWTH = 2  # Capacity ratio between Bloom filter slices
+TIGHTENING = 0.5  # Error rate ratio between Bloom filter slices
+
+# [CRAWLER] DUPEFILTER values
+DUPEFILTERS = {
+    'hash': 'crowl.CrowlDupeFilter',
+    'bloom': 'crowl.CrowlBloomDupeFilter',
+    'scrapy': None,  # Scrapy's set of hex fingerprints
+}
+
+
+def fingerprint64(request):
+    """
+    Returns the first 64 bits of Scrapy's request fingerprint, never 0 (empty slot).
+    """
+    return int(request_fingerprint(request)[:16], 16) or 1
+
+
+def map_file(path, size):
+    """
+    Memory-maps `size` bytes of a file, created or extended with zeros if needed.
+    Anonymous memory if `path` is None.
+    """
+    if path is None:
+        return mmap.mmap(-1, size)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+def next_prime(n):
+    """
+    Returns the smallest prime number greater than or equal to `n`.
+    """
+    n = max(n, 2)
+    while True:
+        if n == 2 or n % 2 and all(n % d for d in range(3, int(math.sqrt(n)) + 1, 2)):
+            return n
+        n += 1
+
+
+def stored_size(path, magic):
+    """
+    Returns the size field of an existing file, None if there is none.
+    """
+    if path is None or not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return None
+    with open(path, 'rb') as f:
+        header = HEADER.unpack(f.read(HEADER.size))
+    if header[0] != magic:
+        raise ValueError("Unexpected file format: {}".format(path))
+    return header[1]
+
+
+class FingerprintTable:
+    """
+    Set of 64 bits fingerprints: open addressing table in a memory-mapped file.
+    8 bytes per slot and at most 70% of slots used, instead of a 40 chars string
+    per fingerprint in a set. Resumed crawls map the file, nothing is read upfront.
+
+    Arguments:
+    - path: table file, None to keep it in memory
+    - capacity: initial number of slots, a power of 2
+    """
+    def __init__(self, path=None, capacity=INITIAL_CAPACITY):
+        self.path = path
+        capacity = 1 << max(int(capacity) - 1, 1).bit_length()
+        self.open(stored_size(path, TABLE_MAGIC) or capacity)
+
+    def open(self, capacity):
+        self.map = map_file(self.path, HEADER.size + capacity * 8)
+        magic, _, count, _, _ = HEADER.unpack_from(self.map)
+        if magic != TABLE_MAGIC:
+            HEADER.pack_into(self.map, 0, TABLE_MAGIC, capacity, 0, 1, capacity)
+            count = 0
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.count = count
+        self.slots = memoryview(self.map)[HEADER.size:].cast('Q')
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return len(self.map)
+
+    def add(self, fp):
+        """
+        Adds a fingerprint.
+        Returns True if it was already there.
+        """
+        slots, mask = self.slots, self.mask
+        i = fp & mask
+        while True:
+            value = slots[i]
+            if value == fp:
+                return True
+            if not value:
+                break
+            i = (i + 1) & mask
+        slots[i] = fp
+        self.count += 1
+        COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+        if self.count > self.capacity * MAX_LOAD:
+            self.grow()
+        return False
+
+    def grow(self):
+        """
+        Moves fingerprints to a table twice as large, in a new file replacing the current one.
+        """
+        path = self.path + '.tmp' if self.path is not None else None
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        table = FingerprintTable(path, self.capacity * 2)
+        for fp in self.slots:
+            if fp:
+                table.add(fp)
+        self.close()
+        if path is not None:
+            table.close()
+            os.replace(path, self.path)
+            self.open(table.capacity)
+        else:
+            self.map, self.slots = table.map, table.slots
+            self.capacity, self.mask, self.count = table.capacity, table.mask, table.count
+
+    def close(self):
+        self.slots.release()
+        self.map.flush()
+        self.map.close()
+
+
+class BloomSlice:
+    """
+    Bloom filter sized for `capacity` fingerprints at `error_rate`, in a memory-mapped file.
+    Its size is a prime number of bits, at least `MIN_BITS`: the double hashing steps
+    are then coprime with it, and each fingerprint sets `hashes` distinct bits.
+    """
+    def __init__(self, path, capacity, error_rate):
+        bits = stored_size(path, BLOOM_MAGIC)
+        if bits is None:
+            bits = int(math.ceil(capacity * -math.log(error_rate) / math.log(2) ** 2))
+            bits = next_prime(max(bits, MIN_BITS))
+        self.map = map_file(path, HEADER.size + (bits + 7) // 8)
+        magic, _, count, hashes, stored_capacity = HEADER.unpack_from(self.map)
+        if magic != BLOOM_MAGIC:
+            hashes = max(int(math.ceil(-math.log2(error_rate))), 1)
+            HEADER.pack_into(self.map, 0, BLOOM_MAGIC, bits, 0, hashes, capacity)
+            count, stored_capacity = 0, capacity
+        self.bits = bits
+        self.count = count
+        self.hashes = hashes
+        self.capacity = stored_capacity
+
+    def positions(self, fp):
+        # Double hashing: the two halves of the fingerprint give every position
+        bits = self.bits
+        h1, h2 = fp & 0xffffffff, 1 + (fp >> 32) % (bits - 1)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % bits
+
+    def __contains__(self, fp):
+        m, offset = self.map, HEADER.size
+        for position in self.positions(fp):  # Most absent fingerprints stop at the first bits
+            if not m[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, fp):
+        m, offset = self.map, HEADER.size
+        for position in self.positions(fp):
+            index = offset + (position >> 3)
+            m[index] = m[index] | (1 << (position & 7))
+        self.count += 1
+        COUNT.pack_into(m, COUNT_OFFSET, self.count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+class ScalableBloomFilter:
+    """
+    Set of 64 bits fingerprints with false positives, about 2 bytes per fingerprint at 0.1%.
+    A full slice is followed by one twice as large with half its error rate, so the
+    total error rate stays below `error_rate` however many URLs are crawled.
+    A false positive is a new URL taken for a seen one: it is not crawled.
+
+    Arguments:
+    - path: slices are stored in `<path>.0`, `<path>.1`..., None to keep them in memory
+    - capacity: fingerprints in the first slice
+    - error_rate: false positive rate
+    """
+    def __init__(self, path=None, capacity=INITIAL_CAPACITY, error_rate=ERROR_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.slices = list()
+        while path is not None and os.path.exists(self.slice_path(len(self.slices))):
+            self.add_slice()
+        if not self.slices:
+            self.add_slice()
+
+    def slice_path(self, index):
+        return '{}.{}'.format(self.path, index) if self.path is not None else None
+
+    def add_slice(self):
+        index = len(self.slices)
+        error_rate = self.error_rate * (1 - TIGHTENING) * TIGHTENING ** index
+        self.slices.append(BloomSlice(self.slice_path(index), self.capacity * GROWTH ** index, error_rate))
+        return self.slices[-1]
+
+    def __len__(self):
+        return sum(s.count for s in self.slices)
+
+    def nbytes(self):
+        return sum(len(s.map) for s in self.slices)
+
+    def add(self, fp):
+        """
+        Adds a fingerprint.
+        Returns True if it was (probably) already there.
+        """
+        for s in self.slices:
+            if fp in s:
+                return True
+        current = self.slices[-1]
+        if current.count >= current.capacity:
+            current = self.add_slice()
+        current.add(fp)
+        return False
+
+    def close(self):
+        for s in self.slices:
+            s.close()
+
+
+class CrowlDupeFilter(BaseDupeFilter):
+    """
+    Request fingerprints in a `FingerprintTable` ([CRAWLER] DUPEFILTER = hash),
+    persisted in JOBDIR as a binary file instead of Scrapy's `requests.seen`.
+    Crawls started with Scrapy's dupefilter import their `requests.seen` on resume.
+    """
+    filename = 'requests.fingerprints'
+
+    def __init__(self, path=None, debug=False, capacity=INITIAL_CAPACITY, error_rate=ERROR_RATE):
+        self.debug = debug
+        self.logdupes = True
+        self.logger = logging.getLogger(__name__)
+        self.file = os.path.join(path, self.filename) if path else None
+        self.fingerprints = self.open_set(capacity, error_rate)
+        if path:
+            self.import_seen(os.path.join(path, 'requests.seen'))
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(job_dir(settings), debug=settings.getbool('DUPEFILTER_DEBUG'),
+                   capacity=settings.getint('DUPEFILTER_CAPACITY', INITIAL_CAPACITY),
+                   error_rate=settings.getfloat('DUPEFILTER_ERROR_RATE', ERROR_RATE))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls.from_settings(crawler.settings)
+
+    def open_set(self, capacity, error_rate):
+        return FingerprintTable(self.file, capacity)
+
+    def import_seen(self, path):
+        if len(self.fingerprints) or not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    self.fingerprints.add(int(line[:16], 16) or 1)
+                except ValueError:
+                    self.logger.warning("Could not import %s: not a list of hex fingerprints", path)
+                    break
+        self.logger.info("Imported %d fingerprints from %s", len(self.fingerprints), path)
+
+    def request_seen(self, request):
+        return self.fingerprints.add(fingerprint64(request))
+
+    def close(self, reason):
+        self.logger.info("%d request fingerprints, %.1f MB", len(self.fingerprints),
+                         self.fingerprints.nbytes() / 1024 / 1024)
+        self.fingerprints.close()
+
+    def log(self, request, spider):
+        if self.debug:
+            msg = "Filtered duplicate request: %(request)s"
+            self.logger.debug(msg, {'request': request}, extra={'spider': spider})
+        elif self.logdupes:
+            msg = ("Filtered duplicate request: %(request)s"
+                   " - no more duplicates will be shown"
+                   " (see DUPEFILTER_DEBUG to show all duplicates)")
+            self.logger.debug(msg, {'request': request}, extra={'spider': spider})
+            self.logdupes = False
+        spider.crawler.stats.inc_value('dupefilter/filtered', spider=spider)
+
+
+class CrowlBloomDupeFilter(CrowlDupeFilter):
+    """
+    Request fingerprints in a `ScalableBloomFilter` ([CRAWLER] DUPEFILTER = bloom),
+    with a [CRAWLER] DUPEFILTER_ERROR_RATE chance of skipping a new URL.
+    """
+    filename = 'requests.bloom'
+
+    def open_set(self, capacity, error_rate):
+        return ScalableBloomFilter(self.file, capacity, error_rate)
@@ -0,0 +1,199 @@
+import re
+import json
+from scrapy.linkextractors import LinkExtractor
+from trafilatura import extract
+
+from document import ParsedDocument
+from xpaths import XPathRegistry
+import surfer
+import lang
+
+
+class PageExtractor:
+    """
+    Extracts data from a 200 OK HTML response.
+    It holds no crawl state (robots.txt, link graph, PageRank), so it runs either in
+    the spider or in a worker process, see `offload.py`.
+
+    Arguments:
+    - plan: `ExtractionPlan` of the crawl
+    - extractors: custom extractors from the config file
+    - surfer: surfer model, `basic` or `advanced`
+    - links_unique: store only unique links ?
+    - lang_detector: language detector, `auto`, `fasttext` or `langdetect`
+    - lang_model: fastText model file
+    - lang_sample_size: characters of text used for language detection
+    """
+    def __init__(self, plan, extractors=None, surfer="basic", links_unique=True, lang_detector="auto",
+                 lang_model=None, lang_sample_size=lang.SAMPLE_SIZE):
+        self.plan = plan
+        self.surfer = surfer
+        self.links_unique = links_unique
+        self.lang_detector = lang_detector
+        self.lang_model = lang_model
+        self.lang_sample_size = lang_sample_size
+        # XPath expressions are compiled once, invalid custom extractors fail here
+        self.xpaths = XPathRegistry(extractors)
+
+    @property
+    def detector(self):
+        # Loaded on first use, once per process
+        return lang.get_detector(self.lang_detector, self.lang_model)
+
+    def process_links(self, doc, language):
+        """
+        Computes reasonable surfer weights for the links of a page.
+        """
+        stoplist = lang.stoplist(language)  # Cached per language, empty if justext has none
+        paragraphs = doc.paragraphs(stoplist)
+        return surfer.link_weights(doc.tree, paragraphs, stoplist)
+
+    def outlinks(self, response, link_weights, meta_nofollow):
+        """
+        Returns the outlinks of a page, resolved against its URL.
+
+        Arguments:
+        - response: the page
+        - link_weights: href -> reasonable surfer weight
+        - meta_nofollow: does the page have a meta robots nofollow ?
+        """
+        outlinks = list()
+        links = LinkExtractor(unique=self.links_unique).extract_links(response)
+        # Page level nofollow, from meta robots or X-Robots-Tag
+        page_nofollow = 'nofollow' in response.headers.getlist('X-Robots-Tag') or meta_nofollow
+        c = 0
+        max_links = len(links)
+        for link in links:
+            lien = dict()
+            # Check if X-Robots-Tag or meta robots nofollow
+            if page_nofollow:
+                lien['nofollow'] = True
+            # Check if link nofollow
+            if link.nofollow:
+                lien['nofollow'] = True
+
+            if self.surfer == 'advanced':
+                lien['text'] = str.strip(link.text)
+                lien['source'] = response.url
+                lien['target'] = link.url
+                weight = link_weights.get(link.url, 1 - c / max_links)
+                lien['weight'] = max(weight, 0)
+
+            elif self.surfer == 'basic':
+                lien['text'] = str.strip(link.text)
+                lien['source'] = response.url
+                lien['target'] = link.url
+                weight = 1 - c / max_links
+                lien['weight'] = max(weight, 0)
+
+            c = c + 1
+            outlinks.append(lien)
+        return outlinks
+
+    def microdata(self, doc):
+        """
+        Returns the microdata and JSON-LD of a page as JSON, None if it has none.
+        URLs are resolved against the page's base URL.
+        """
+        try:
+            data = doc.microdata()
+        except Exception:
+            return None
+        data = {key: value for key, value in data.items() if len(value) > 0}
+        if data:
+            return json.dumps(data, ensure_ascii=False)
+        return None
+
+    def relocate(self, response, fields):
+        """
+        Returns the fields extracted from the same body at another URL, with the fields
+        depending on the URL extracted for `response`: outlinks and microdata.
+        Other fields keep attribute values as written in the page.
+        """
+        if fields.get('link_context') is not None:
+            fields['outlinks'] = self.outlinks(response, *fields['link_context'])
+        if 'microdata' in fields:  # A page without microdata has none at any URL
+            microdata = self.microdata(ParsedDocument(response))
+            if microdata is not None:
+                fields['microdata'] = microdata
+            else:
+                del fields['microdata']
+        return fields
+
+    def extract(self, response):
+        """
+        Returns a dict of item fields.
+        `outlinks` don't have the `disallow` flag, robots.txt is checked by the spider.
+        With links, `link_context` holds the arguments of `outlinks()` but the response,
+        it isn't an item field.
+        """
+        i = dict()
+        doc = ParsedDocument(response)  # Parsed once, shared by all extractors
+        # Precompiled expressions, `first()` returns 'None' if empty, prevents errors
+        xp = self.xpaths
+        tree = doc.tree
+        i['nb_title'] = xp.count('title', tree)
+        i['title'] = xp.first('title_text', tree)
+        i['meta_description'] = xp.first('meta_description', tree)
+        i['meta_viewport'] = xp.first('meta_viewport', tree)
+        i['meta_keywords'] = xp.first('meta_keywords', tree)
+        i['nb_meta_robots'] = xp.count('meta_robots_tags', tree)
+        i['meta_robots'] = xp.first('meta_robots', tree)
+        i['nb_h1'] = xp.count('h1', tree)
+        h1 = ''.join(xp.all('h1_text', tree))
+        if len(h1) > 0:
+            i['h1'] = h1
+        else:
+            i['h1'] = 'None'
+
+        i['nb_h2'] = xp.count('h2', tree)
+        i['canonical'] = xp.first('canonical', tree)
+        i['prev'] = xp.first('prev', tree)
+        i['next'] = xp.first('next', tree)
+        i['html_lang'] = xp.first('html_lang', tree)
+        hreflangs = xp.all('hreflangs', tree)
+        if hreflangs:
+            res = list()
+            for index, hreflang in enumerate(hreflangs):
+                res.append({
+                    'lang': hreflang.get('hreflang', 'None').strip(),
+                    'rel': hreflang.get('rel', 'None').strip(),
+                    'href': hreflang.get('href', 'None').strip(),
+                })
+            i['hreflangs'] = json.dumps(res)
+        else:
+            i['hreflangs'] = 'None'
+
+        # Word Count
+        content_text = doc.body_text
+        i['wordcount'] = len(re.split('[\s\t\n, ]+', content_text, flags=re.UNICODE))
+
+        # Detected once on a sample of the body text, shared by check-lang and the surfer
+        language = None
+        if self.plan.language:
+            language = doc.language(self.detector, self.lang_sample_size)
+        if self.plan.check_lang:  # Should we check content language ?
+            i['content_lang'] = language or "unknown"
+
+        if self.plan.content:  # Should we store content ?
+            # trafilatura may modify the tree it gets
+            i['content'] = extract(doc.tree_copy(), 'no_fallback=True', 'include_comments=False',
+                                   'include_tables=False', 'favor_precision=True')
+        if self.plan.links:  # Should we store links ?
+            # Reasonable surfer weights, only needed by the advanced surfer
+            link_weights = self.process_links(doc, language) if self.plan.link_weights else dict()
+            meta_nofollow = bool(xp.all('meta_robots_nofollow', tree))
+            # Weights are per href, a copy of the page at another URL reuses them
+            i['link_context'] = (link_weights, meta_nofollow)
+            i['outlinks'] = self.outlinks(response, link_weights, meta_nofollow)
+
+        if self.plan.microdata:  # Microdata
+            microdata = self.microdata(doc)
+            if microdata is not None:
+                i["microdata"] = microdata
+
+        if self.plan.extractors:
+            extracted = xp.extract(tree)
+            i["extractors"] = json.dumps(extracted, ensure_ascii=False)
+
+        return i
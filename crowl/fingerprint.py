@@ -0,0 +1,137 @@
+import os
+import re
+import pickle
+import hashlib
+from collections import Counter, OrderedDict
+import numpy as np
+
+SHINGLE_SIZE = 3  # Words per SimHash feature
+BLOCKS = 4  # SimHash blocks indexed, near duplicates share at least one
+MAX_DISTANCE = BLOCKS - 1  # Differing bits between near duplicates
+FINGERPRINTS_FILE = 'fingerprints.pickle'
+
+SKIPPED_ELEMENTS = re.compile(r'<(script|style|noscript)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAGS = re.compile(r'<[^>]*>')
+WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+def content_hash(body):
+    """
+    Returns the exact fingerprint of a response body, 8 bytes.
+    """
+    return hashlib.blake2b(body, digest_size=8).digest()
+
+
+def simhash(html):
+    """
+    Returns the 64 bits SimHash of the text of an HTML page, None if it has no text.
+    Features are word shingles weighted by their count, markup is stripped with regular
+    expressions: the page isn't parsed, pages sharing a template still differ.
+
+    Arguments:
+    - html: decoded body
+    """
+    words = WORDS.findall(TAGS.sub(' ', SKIPPED_ELEMENTS.sub(' ', html)).lower())
+    if not words:
+        return None
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = Counter(' '.join(words[c:c + size]) for c in range(len(words) - size + 1))
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    votes = np.array(list(shingles.values())) @ (bits.astype(np.int64) * 2 - 1)
+    return int.from_bytes(np.packbits(votes > 0, bitorder='little').tobytes(), 'little')
+
+
+def blocks(value):
+    """
+    Returns the `(index, bits)` blocks of a SimHash.
+    """
+    width = 64 // BLOCKS
+    return [(c, (value >> (c * width)) & ((1 << width) - 1)) for c in range(BLOCKS)]
+
+
+class ContentFingerprints:
+    """
+    Duplicate pages of a crawl, from the fingerprints of their bodies: a content hash
+    for exact duplicates, a SimHash for near duplicates (at most `MAX_DISTANCE`
+    differing bits). Duplicates refer to the first copy crawled, only first copies are
+    indexed.
+    SimHashes are indexed by blocks: near duplicates share at least one block, only
+    the pages sharing one are compared.
+    Extracted fields of the pages last crawled are kept in a bounded LRU cache, exact
+    duplicates reuse them but the fields depending on the URL, see `PageExtractor.relocate`.
+
+    Arguments:
+    - cache_size: number of pages whose extracted fields are kept in memory
+    """
+    def __init__(self, cache_size=1000):
+        self.cache_size = cache_size
+        self.exact = dict()  # content hash -> URL of the first copy
+        self.near = dict()  # (block index, block bits) -> [(SimHash, URL)] of first copies
+        self.cache = OrderedDict()  # content hash -> extracted fields
+
+    def __len__(self):
+        return len(self.exact)
+
+    def add(self, url, digest, html):
+        """
+        Registers a page. Returns `(url, exact)`: the URL of the page it duplicates and
+        whether it is an exact duplicate, `(None, False)` for a first copy.
+
+        Arguments:
+        - url: URL of the page
+        - digest: `content_hash` of its body
+        - html: decoded body, its SimHash is only computed if it isn't an exact duplicate
+        """
+        original = self.exact.get(digest)
+        if original is not None:
+            return original, True
+        self.exact[digest] = url
+        value = simhash(html)
+        if value is None:
+            return None, False
+        for key in blocks(value):
+            for other, other_url in self.near.get(key, ()):
+                if bin(value ^ other).count('1') <= MAX_DISTANCE:
+                    return other_url, False
+        for key in blocks(value):
+            self.near.setdefault(key, list()).append((value, url))
+        return None, False
+
+    def fields(self, digest):
+        """
+        Returns the extracted fields of the first copy of a page, None if not cached.
+        """
+        fields = self.cache.get(digest)
+        if fields is None:
+            return None
+        self.cache.move_to_end(digest)
+        return dict(fields)
+
+    def store(self, digest, fields):
+        """
+        Caches the extracted fields of a page, but its outlinks.
+        """
+        self.cache[digest] = {k: v for k, v in fields.items() if k != 'outlinks'}
+        self.cache.move_to_end(digest)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def save(self, path):
+        """
+        Saves fingerprints to disk, extracted fields aren't.
+        """
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((self.exact, self.near), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, cache_size=1000):
+        """
+        Returns the fingerprints saved in `path`, none if it is None or doesn't exist.
+        """
+        fingerprints = cls(cache_size)
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                fingerprints.exact, fingerprints.near = pickle.load(f)
+        return fingerprints
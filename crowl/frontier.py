@@ -0,0 +1,458 @@
+import os
+import re
+import glob
+import json
+import math
+import pickle
+import sqlite3
+import struct
+from collections import deque
+from queuelib import PriorityQueue, FifoDiskQueue
+from scrapy.core.scheduler import Scheduler
+
+from utils import url_origin
+
+PRIORITY_RESOLUTION = 20  # Priorities per unit of log(1 + score)
+PENDING_FILE = 'frontier.sqlite'
+
+# [CRAWLER] FRONTIER values
+FRONTIERS = ('breadth-first', 'best-first')
+
+# Disk queue records: priority, depth, rule, flags, link weight,
+# then the lengths of the URL, referer, callback, errback and extra fields
+RECORD = struct.Struct('=iihBdIIHHI')
+DONT_FILTER, WEIGHTED, REQUEUED, SITEMAP, SITEMAP_FILE = 1, 2, 4, 8, 16
+META_FLAGS = (('requeued', REQUEUED), ('sitemap', SITEMAP), ('sitemap_file', SITEMAP_FILE))
+# Request dict values, as built by `request_to_dict`, not written to records
+REQUEST_DEFAULTS = {'method': 'GET', 'body': b'', 'cookies': {}, '_encoding': 'utf-8', 'flags': []}
+QUEUE_STATE = 'queue.json'
+CHUNK_PREFIX = 'chunk.'  # Chunk files are numbered: chunk.00000, chunk.00001...
+CHUNK_SIZE = 1 << 24  # Bytes, a chunk is removed once read
+SYNC_INTERVAL = 1000  # Records written between two fsyncs
+
+
+def score_priority(score):
+    """
+    Returns the Scrapy priority of a frontier score.
+    Priorities grow with the log of the score: a few hundred distinct values at most,
+    each of them is a queue (a directory with JOBDIR).
+    """
+    return int(math.log1p(max(score, 0)) * PRIORITY_RESOLUTION)
+
+
+def position_weights(urls):
+    """
+    Returns a dict of URL -> weight from the position of the first link to each URL,
+    as the basic surfer does.
+
+    Arguments:
+    - urls: link targets, in page order
+    """
+    weights = dict()
+    count = len(urls)
+    for c, url in enumerate(urls):
+        weights.setdefault(url, 1 - c / count)
+    return weights
+
+
+class PendingTable:
+    """
+    Queued URLs of the frontier in a SQLite table, the scheduler's dict when it has a
+    JOBDIR: like the disk queues, a backlog of millions of URLs stays on disk.
+    Entries are `[score, priority, copies, depth]` lists, changes are written back by
+    assigning them. They are committed every `SYNC_INTERVAL` writes and when closed.
+
+    Arguments:
+    - path: database file
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pending (url TEXT PRIMARY KEY, score REAL NOT NULL, "
+                        "priority INTEGER, copies INTEGER NOT NULL, depth INTEGER NOT NULL) WITHOUT ROWID")
+        self.writes = 0
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def get(self, url):
+        row = self.db.execute("SELECT score, priority, copies, depth FROM pending WHERE url = ?", (url,)).fetchone()
+        return None if row is None else list(row)
+
+    def __setitem__(self, url, entry):
+        self.db.execute("INSERT OR REPLACE INTO pending (url, score, priority, copies, depth) VALUES (?, ?, ?, ?, ?)",
+                        (url, *entry))
+        self.written()
+
+    def __delitem__(self, url):
+        self.db.execute("DELETE FROM pending WHERE url = ?", (url,))
+        self.written()
+
+    def written(self):
+        self.writes += 1
+        if self.writes >= SYNC_INTERVAL:
+            self.db.commit()
+            self.writes = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class CrowlFrontierScheduler(Scheduler):
+    """
+    Frontier of followed links: a URL queued again while it waits, found at a lower depth,
+    is queued again with that depth, the copy left behind is dropped when it comes out.
+    The depth limit then applies to the shortest path found, even when pages are not
+    crawled level by level (best-first, `--workers`).
+    Best-first ([CRAWLER] FRONTIER = best-first): URLs are scored with the `link_weight`
+    of every link found to them while they wait, the highest score is crawled first,
+    and a URL whose score reaches a higher priority is queued again too.
+    With a JOBDIR, queued URLs are kept in a `PendingTable` there, not in memory.
+    """
+    best_first = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        scheduler.best_first = crawler.settings.get('FRONTIER') == 'best-first'
+        return scheduler
+
+    def open(self, spider):
+        self.pending = dict()  # Queued URL -> [score, priority, copies, depth], priority is None once crawled
+        if self.dqdir:
+            self.pending = PendingTable(os.path.join(self.dqdir, PENDING_FILE))
+        return super().open(spider)
+
+    def close(self, reason):
+        if self.dqdir:
+            self.pending.close()
+        return super().close(reason)
+
+    @staticmethod
+    def followed(request):
+        # Requests built by the spider's rules and their copies, sitemap URLs skip the dupefilter
+        return 'rule' in request.meta and (not request.dont_filter or request.meta.get('requeued', False))
+
+    def enqueue_request(self, request):
+        if not self.followed(request):
+            return super().enqueue_request(request)
+        weight = request.meta.get('link_weight', 0)
+        depth = request.meta.get('depth', 0)
+        entry = self.pending.get(request.url)
+        if entry is None:  # New URL, or crawled before the current session
+            if self.best_first:
+                request.priority = score_priority(weight)
+            if not super().enqueue_request(request):
+                return False
+            self.pending[request.url] = [weight, request.priority, 1, depth]
+            return True
+        if entry[1] is None:  # Crawled, other copies still queued
+            self.df.log(request, self.spider)
+            return False
+        entry[0] += weight
+        priority = score_priority(entry[0]) if self.best_first else max(request.priority, entry[1])
+        if priority <= entry[1] and depth >= entry[3]:
+            self.pending[request.url] = entry
+            self.df.log(request, self.spider)
+            return False
+        # Queued with a lower priority, or deeper: the depth limit applies to the shortest path found
+        entry[1] = priority
+        entry[2] += 1
+        entry[3] = min(depth, entry[3])
+        self.pending[request.url] = entry
+        self.stats.inc_value('frontier/requeued', spider=self.spider)
+        request.meta['depth'] = entry[3]
+        request.meta['requeued'] = True
+        return super().enqueue_request(request.replace(priority=priority, dont_filter=True))
+
+    def next_request(self):
+        while True:
+            request = super().next_request()
+            if request is None or not self.followed(request):
+                return request
+            entry = self.pending.get(request.url)
+            if entry is None:  # Queued before the frontier was saved
+                return request
+            entry[2] -= 1
+            # A copy found at a lower depth is still queued, it comes out next at the latest
+            deeper = entry[2] > 0 and request.meta.get('depth', 0) > entry[3]
+            crawled = entry[1] is None  # Copy of a crawled URL
+            if not deeper:
+                entry[1] = None
+            if entry[2] <= 0:
+                del self.pending[request.url]
+            else:
+                self.pending[request.url] = entry
+            if deeper or crawled:
+                self.stats.inc_value('frontier/skipped', spider=self.spider)
+                continue
+            if self.best_first:
+                self.stats.max_value('frontier/max_score', round(entry[0], 4), spider=self.spider)
+            return request
+
+
+def pop_int(meta, key, high):
+    """
+    Removes a meta value that fits in a record field, returns it or -1.
+    """
+    value = meta.get(key)
+    if type(value) is not int or not 0 <= value < high:
+        return -1
+    del meta[key]
+    return value
+
+
+def encode_request(d):
+    """
+    Returns the disk queue record of a request dict (`request_to_dict`).
+    The URL, depth, referer, priority and the meta values set by the spider and
+    the frontier have fields of their own, anything else is pickled as `extra`.
+    The link text set by CrawlSpider rules is dropped, it isn't used once the link
+    is extracted.
+    """
+    d = dict(d)
+    meta = dict(d.pop('meta', None) or {})
+    headers = dict(d.pop('headers', None) or {})
+    flags = DONT_FILTER if d.pop('dont_filter', False) else 0
+    for key, flag in META_FLAGS:
+        if meta.get(key) is True:
+            del meta[key]
+            flags |= flag
+    weight = meta.get('link_weight')
+    if type(weight) in (int, float):
+        del meta['link_weight']
+        flags |= WEIGHTED
+    depth = pop_int(meta, 'depth', 2 ** 31)
+    rule = pop_int(meta, 'rule', 2 ** 15)
+    meta.pop('link_text', None)
+    referer = b''
+    if len(headers.get(b'Referer') or ()) == 1:
+        referer = headers.pop(b'Referer')[0]
+    url = d.pop('url').encode('utf-8')
+    callback = (d.pop('callback', None) or '').encode('utf-8')
+    errback = (d.pop('errback', None) or '').encode('utf-8')
+    priority = d.pop('priority', 0)
+    extra = dict()
+    for key, value in d.items():
+        if key in REQUEST_DEFAULTS and value == REQUEST_DEFAULTS[key] or key not in REQUEST_DEFAULTS and not value:
+            continue
+        extra[key] = value
+    if meta:
+        extra['meta'] = meta
+    if headers:
+        extra['headers'] = headers
+    extra = pickle.dumps(extra, protocol=pickle.HIGHEST_PROTOCOL) if extra else b''
+    return RECORD.pack(priority, depth, rule, flags, weight if flags & WEIGHTED else 0, len(url), len(referer),
+                       len(callback), len(errback), len(extra)) + url + referer + callback + errback + extra
+
+
+def decode_request(fields, data):
+    """
+    Returns the request dict of a disk queue record.
+
+    Arguments:
+    - fields: unpacked `RECORD` header
+    - data: the variable-length fields following it
+    """
+    priority, depth, rule, flags, weight = fields[:5]
+    values = list()
+    offset = 0
+    for length in fields[5:]:
+        values.append(data[offset:offset + length])
+        offset += length
+    url, referer, callback, errback, extra = values
+    meta = dict()
+    if depth >= 0:
+        meta['depth'] = depth
+    if rule >= 0:
+        meta['rule'] = rule
+    if flags & WEIGHTED:
+        meta['link_weight'] = weight
+    for key, flag in META_FLAGS:
+        if flags & flag:
+            meta[key] = True
+    d = {'url': url.decode('utf-8'), 'callback': callback.decode('utf-8') or None,
+         'errback': errback.decode('utf-8') or None, 'method': 'GET', 'headers': dict(), 'body': b'',
+         'cookies': dict(), 'meta': meta, '_encoding': 'utf-8', 'priority': priority,
+         'dont_filter': bool(flags & DONT_FILTER), 'flags': list()}
+    if extra:
+        extra = pickle.loads(extra)
+        meta.update(extra.pop('meta', {}))
+        d['headers'].update(extra.pop('headers', {}))
+        d.update(extra)
+    if referer:
+        d['headers'][b'Referer'] = [referer]
+    return d
+
+
+class CrowlDiskQueue:
+    """
+    FIFO disk queue of requests (`SCHEDULER_DISK_QUEUE`), one per priority in JOBDIR.
+    Requests are written as compact binary records (see `encode_request`) instead of
+    pickled request dicts, to chunk files which are removed once read.
+    Writes are flushed to disk every `SYNC_INTERVAL` records, with the read and write
+    positions, and when the queue is closed.
+    Queues left by a crawl paused with `PickleFifoDiskQueue` are read first.
+
+    Arguments:
+    - path: queue directory
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        state = dict(size=0, head=[0, 0], tail=0)
+        if os.path.exists(self.state_path()):
+            with open(self.state_path()) as f:
+                state = json.load(f)
+        self.size = state['size']
+        self.head_chunk, offset = state['head']
+        self.tail_chunk = state['tail']
+        self.tail = open(self.chunk_path(self.tail_chunk), 'ab')
+        self.head = open(self.chunk_path(self.head_chunk), 'rb')
+        self.head.seek(offset)
+        self.unsynced = 0
+        self.legacy = None
+        if os.path.exists(os.path.join(path, 'info.json')):  # Paused with PickleFifoDiskQueue
+            self.legacy = FifoDiskQueue(path)
+
+    def state_path(self):
+        return os.path.join(self.path, QUEUE_STATE)
+
+    def chunk_path(self, chunk):
+        return os.path.join(self.path, '{}{:05d}'.format(CHUNK_PREFIX, chunk))
+
+    def push(self, d):
+        self.tail.write(encode_request(d))
+        self.size += 1
+        self.unsynced += 1
+        if self.tail.tell() >= CHUNK_SIZE:
+            self.sync()
+            self.tail.close()
+            self.tail_chunk += 1
+            self.tail = open(self.chunk_path(self.tail_chunk), 'ab')
+        elif self.unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def pop(self):
+        if self.legacy is not None:
+            data = self.legacy.pop()
+            if data is not None:
+                return pickle.loads(data)
+            self.legacy.close()  # Removes its files
+            self.legacy = None
+        if not self.size:
+            return None
+        while True:
+            if self.head_chunk == self.tail_chunk:
+                self.tail.flush()
+            header = self.head.read(RECORD.size)
+            if header:
+                break
+            # End of a chunk, the next one holds the following records
+            self.head.close()
+            os.remove(self.chunk_path(self.head_chunk))
+            self.head_chunk += 1
+            self.head = open(self.chunk_path(self.head_chunk), 'rb')
+        fields = RECORD.unpack(header)
+        self.size -= 1
+        return decode_request(fields, self.head.read(sum(fields[5:])))
+
+    def sync(self):
+        """
+        Writes the queue to disk: records, then its state.
+        """
+        self.tail.flush()
+        os.fsync(self.tail.fileno())
+        with open(self.state_path() + '.tmp', 'w') as f:
+            json.dump(dict(size=self.size, head=[self.head_chunk, self.head.tell()], tail=self.tail_chunk), f)
+        os.replace(self.state_path() + '.tmp', self.state_path())
+        self.unsynced = 0
+
+    def close(self):
+        if self.legacy is not None:
+            self.legacy.close()
+        self.sync()
+        self.head.close()
+        self.tail.close()
+        if not self.size:
+            for path in glob.glob(os.path.join(self.path, CHUNK_PREFIX + '*')) + [self.state_path()]:
+                os.remove(path)
+            if not os.listdir(self.path):
+                os.rmdir(self.path)
+
+    def __len__(self):
+        return self.size + (len(self.legacy) if self.legacy is not None else 0)
+
+
+def host_key(url):
+    """
+    Returns the host of a URL as used in queue directory names.
+    """
+    return re.sub(r'[^\w.-]', '_', url_origin(url)[1])
+
+
+class CrowlHostPriorityQueue:
+    """
+    Scheduler priority queue of a multi-site crawl (`SCHEDULER_PRIORITY_QUEUE`): one
+    priority queue per host, hosts take turns. With a single queue, the links of a
+    page fill the downloader with requests to one host, they wait for its
+    DOWNLOAD_DELAY while other hosts have nothing to download.
+    Queues left by a paused crawl are listed per host in `active.json`.
+
+    Arguments:
+    - qfactory: Scrapy's memory or disk queue factory, called with a queue key
+    - startprios: host -> priorities of the queues left by a paused crawl
+    """
+    def __init__(self, qfactory, startprios=()):
+        self.qfactory = qfactory
+        self.queues = dict()  # Host -> PriorityQueue
+        self.hosts = deque()  # Hosts with queued requests, in turn order
+        if isinstance(startprios, dict):
+            startprios = startprios.items()
+        else:  # Paused with a single priority queue, its queues keep their names
+            startprios = [('', startprios)] if startprios else []
+        for host, prios in startprios:
+            self.queues[host] = PriorityQueue(self.host_factory(host), startprios=prios)
+            self.hosts.append(host)
+
+    def host_factory(self, host):
+        if not host:
+            return self.qfactory
+        return lambda priority: self.qfactory('{}-{}'.format(priority, host))
+
+    def push(self, obj, priority=0):
+        url = obj['url'] if isinstance(obj, dict) else obj.url  # Requests are dicts in disk queues
+        host = host_key(url)
+        q = self.queues.get(host)
+        if q is None:
+            q = self.queues[host] = PriorityQueue(self.host_factory(host))
+        empty = not len(q)
+        q.push(obj, priority)
+        if empty:
+            self.hosts.append(host)
+
+    def pop(self):
+        while self.hosts:
+            host = self.hosts.popleft()
+            q = self.queues[host]
+            obj = q.pop()
+            if len(q):
+                self.hosts.append(host)
+            else:
+                del self.queues[host]
+            if obj is not None:
+                return obj
+        return None
+
+    def close(self):
+        active = dict()
+        for host, q in self.queues.items():
+            prios = q.close()
+            if prios:
+                active[host] = prios
+        return active
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
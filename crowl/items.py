@@ -42,3 +42,7 @@ class CrowlItem(scrapy.Item):
     response_headers = scrapy.Field()
     redirect = scrapy.Field()
     pagerank = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+    orphan = scrapy.Field()
+    duplicate_of = scrapy.Field()
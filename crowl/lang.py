@@ -0,0 +1,140 @@
+import functools
+import unicodedata
+import justext
+import pycountry
+
+
+@functools.lru_cache(maxsize=256)
+def language_name(iso_code):
+    """
+    Returns the English name of a language from its ISO 639-1 code, None if unknown.
+    Results are cached for the whole process.
+
+    Arguments:
+    - iso_code: ISO 639-1 code, region suffixes (`zh-cn`) are ignored
+    """
+    if not iso_code:
+        return None
+    try:
+        language = pycountry.languages.get(alpha_2=iso_code.split('-')[0].lower())
+    except KeyError:  # Older pycountry versions raise instead of returning None
+        language = None
+    if language:
+        return language.name
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def available_stoplists():
+    return frozenset(justext.get_stoplists())
+
+
+def stoplist_name(name):
+    """
+    Maps a pycountry language name to a justext stoplist name, None if justext has none.
+    `Modern Greek (1453-)` -> `Greek`, `Norwegian Bokmål` -> `Norwegian_Bokmal`
+    """
+    if not name:
+        return None
+    name = name.split(' (')[0]
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    available = available_stoplists()
+    for candidate in (name, name.replace(' ', '_'), name.split(' ')[-1]):
+        if candidate in available:
+            return candidate
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def stoplist(iso_code):
+    """
+    Returns the justext stoplist of a language from its ISO 639-1 code.
+    Stoplists are loaded once per process, an empty stoplist is returned for languages
+    justext doesn't know.
+    """
+    name = stoplist_name(language_name(iso_code))
+    if name is None:
+        return frozenset()
+    return justext.get_stoplist(name)
+
+
+DETECTORS = ('auto', 'fasttext', 'langdetect')
+
+# Characters of text given to language detectors, the start of a page is enough
+SAMPLE_SIZE = 4096
+
+
+def text_sample(text, size=SAMPLE_SIZE):
+    """
+    Returns at most `size` characters of a text, on one line and without repeated spaces.
+    Detection time and results no longer depend on the page length.
+    """
+    sample = ' '.join(text[:size * 2].split())  # Whitespace doesn't count
+    return sample[:size]
+
+
+class LangDetectDetector:
+    """
+    Language detection with langdetect, seeded so a page always gets the same result.
+    """
+    name = 'langdetect'
+
+    def __init__(self):
+        from langdetect import DetectorFactory
+        DetectorFactory.seed = 0
+
+    def detect(self, text):
+        from langdetect import detect
+        from langdetect.lang_detect_exception import LangDetectException
+        try:
+            return detect(text)
+        except LangDetectException:  # No features in text
+            return None
+
+
+class FastTextDetector:
+    """
+    Language detection with a fastText language identification model (`lid.176.ftz` or `lid.176.bin`).
+
+    Arguments:
+    - model_path: path of the model file
+    - threshold: minimum confidence, below it the language is unknown
+    """
+    name = 'fasttext'
+
+    def __init__(self, model_path, threshold=0.0):
+        import fasttext
+        self.model = fasttext.load_model(model_path)
+        self.threshold = threshold
+
+    def detect(self, text):
+        if not text:
+            return None
+        labels, scores = self.model.predict(text, k=1)  # fastText predicts on a single line
+        if not labels or scores[0] < self.threshold:
+            return None
+        return labels[0].replace('__label__', '')
+
+
+@functools.lru_cache(maxsize=4)
+def get_detector(backend='auto', model_path=None):
+    """
+    Returns a language detector, created once per process (the fastText model is big).
+    `auto` uses fastText if a model is configured and the package is installed,
+    langdetect otherwise.
+
+    Arguments:
+    - backend: `auto`, `fasttext` or `langdetect`
+    - model_path: fastText model file
+    """
+    if backend not in DETECTORS:
+        raise ValueError("Unknown language detector '{}'.".format(backend))
+    if backend == 'fasttext' and not model_path:
+        raise ValueError("The fasttext language detector needs a model, see LANG_MODEL.")
+    if backend in ('auto', 'fasttext') and model_path:
+        try:
+            return FastTextDetector(model_path)
+        except ImportError:
+            if backend == 'fasttext':
+                raise
+    return LangDetectDetector()
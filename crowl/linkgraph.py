@@ -0,0 +1,223 @@
+import os
+import glob
+import json
+import struct
+from array import array
+import numpy as np
+from igraph import Graph
+
+EDGE_BYTES = 12  # Source id, target id, weight
+SEGMENT_PREFIX = 'edges.'  # Segment files are numbered: edges.000000, edges.000001...
+GRAPH_DIR = 'graph'  # Checkpoint and segments directory, in JOBDIR
+CHECKPOINT_FILE = 'checkpoint.json'
+URLS_FILE = 'checkpoint.urls'
+EDGES_FILE = 'checkpoint.edges'
+CHUNK = struct.Struct('=Q')  # Edge count of a chunk of the edges file
+
+
+class LinkGraph:
+    """
+    Compact store for the crawl link graph.
+    Each URL is interned once and gets an int32 id, edges are kept in three
+    typed columns (source id, target id, weight), i.e. 12 bytes per edge
+    instead of a tuple holding two URL strings.
+    With `max_bytes`, edges beyond half that size are moved to segment files in
+    `spill_dir`, only the latest ones stay in memory: the other half is for a segment
+    read back, by PageRank or a checkpoint. URLs aren't counted, see `MEMORY_BUDGET`.
+    URLs and edges are only ever appended: a checkpoint writes what was added
+    since the previous one.
+
+    Arguments:
+    - spill_dir: directory of edge segments, its previous segments are removed
+    - max_bytes: size of the edges in memory, read back included, None for no limit
+    """
+    def __init__(self, spill_dir=None, max_bytes=None):
+        self.ids = dict()  # URL -> id
+        self.urls = list()  # id -> URL
+        self.sources = array('i')
+        self.targets = array('i')
+        self.weights = array('f')
+        self.spill_dir = spill_dir
+        self.max_edges = max(max_bytes // (2 * EDGE_BYTES), 1) if spill_dir and max_bytes else None
+        self.segments = list()  # (path, edge count) of spilled edges
+        self.spilled = 0
+        self.saved = None  # Checkpoint written or restored last
+        if self.max_edges is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(spill_dir, SEGMENT_PREFIX + '*')):
+                os.remove(path)
+
+    def __len__(self):
+        """
+        Returns the number of edges.
+        """
+        return self.spilled + len(self.sources)
+
+    def node_count(self):
+        return len(self.urls)
+
+    def nbytes(self):
+        """
+        Returns the size of the edges kept in memory.
+        """
+        return len(self.sources) * EDGE_BYTES
+
+    def intern(self, url):
+        """
+        Returns the id of an URL, registering it if needed.
+        """
+        node = self.ids.get(url)
+        if node is None:
+            node = len(self.urls)
+            self.ids[url] = node
+            self.urls.append(url)
+        return node
+
+    def get_id(self, url):
+        """
+        Returns the id of an URL, or None if it isn't in the graph.
+        """
+        return self.ids.get(url)
+
+    def add_edge(self, source, target, weight):
+        self.sources.append(self.intern(source))
+        self.targets.append(self.intern(target))
+        self.weights.append(weight)
+        if self.max_edges is not None and len(self.sources) >= self.max_edges:
+            self.spill()
+
+    def spill(self):
+        """
+        Moves the edges kept in memory to a new segment file.
+        """
+        if not self.sources:
+            return
+        path = os.path.join(self.spill_dir, '{}{:06d}'.format(SEGMENT_PREFIX, len(self.segments)))
+        with open(path, 'wb') as f:
+            for column in (self.sources, self.targets, self.weights):
+                column.tofile(f)
+        self.segments.append((path, len(self.sources)))
+        self.spilled += len(self.sources)
+        self.sources, self.targets, self.weights = array('i'), array('i'), array('f')
+
+    def columns(self, start=0):
+        """
+        Iterates over edges as `(sources, targets, weights)` arrays, one segment at a time.
+
+        Arguments:
+        - start: index of the first edge, segments before it are not read
+        """
+        offset = 0
+        for path, count in self.segments:
+            if offset + count > start:
+                sources, targets, weights = array('i'), array('i'), array('f')
+                with open(path, 'rb') as f:
+                    for column in (sources, targets, weights):
+                        column.fromfile(f, count)
+                skip = max(start - offset, 0)
+                yield sources[skip:], targets[skip:], weights[skip:]
+            offset += count
+        skip = max(start - offset, 0)
+        if len(self.sources) > skip:
+            if skip:
+                yield self.sources[skip:], self.targets[skip:], self.weights[skip:]
+            else:
+                yield self.sources, self.targets, self.weights
+
+    def edges(self):
+        """
+        Iterates over edges as `(source_url, target_url, weight)` tuples.
+        """
+        urls = self.urls
+        for sources, targets, weights in self.columns():
+            for source, target, weight in zip(sources, targets, weights):
+                yield urls[source], urls[target], weight
+
+    def extend(self, sources, targets, weights):
+        """
+        Adds edge columns whose ids are already ids of this graph.
+        """
+        self.sources.extend(sources)
+        self.targets.extend(targets)
+        self.weights.extend(weights)
+        if self.max_edges is not None and len(self.sources) >= self.max_edges:
+            self.spill()
+
+    def merge(self, other):
+        """
+        Adds the edges of another graph, its URLs get ids of this one.
+        """
+        ids = array('i', (self.intern(url) for url in other.urls))
+        for sources, targets, weights in other.columns():
+            self.extend(array('i', (ids[source] for source in sources)),
+                        array('i', (ids[target] for target in targets)), weights)
+
+    def checkpoint(self, path, **state):
+        """
+        Saves the graph in `path`: URLs and edges added since the last checkpoint are
+        appended to the URLs and edges files, then their sizes are recorded, with
+        `state`, in `checkpoint.json`. The files are cut back to the recorded sizes
+        before writing, a crash leaves the previous checkpoint usable.
+        """
+        os.makedirs(path, exist_ok=True)
+        saved = self.saved or dict(urls=0, urls_bytes=0, edges=0, edges_bytes=0)
+        with open(os.path.join(path, URLS_FILE), 'ab') as f:
+            f.truncate(saved['urls_bytes'])
+            f.write(''.join(url + '\n' for url in self.urls[saved['urls']:]).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            urls_bytes = os.fstat(f.fileno()).st_size
+        with open(os.path.join(path, EDGES_FILE), 'ab') as f:
+            f.truncate(saved['edges_bytes'])
+            for columns in self.columns(saved['edges']):  # Chunks are at most a segment
+                f.write(CHUNK.pack(len(columns[0])))
+                for column in columns:
+                    column.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+            edges_bytes = os.fstat(f.fileno()).st_size
+        self.saved = dict(state, urls=len(self.urls), urls_bytes=urls_bytes, edges=len(self), edges_bytes=edges_bytes)
+        checkpoint_path = os.path.join(path, CHECKPOINT_FILE)
+        with open(checkpoint_path + '.tmp', 'w') as f:
+            json.dump(self.saved, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    @classmethod
+    def restore(cls, path, spill_dir=None, max_bytes=None):
+        """
+        Returns the graph saved by `checkpoint()` in `path` and the state saved with it,
+        `(None, None)` if there is no checkpoint. Edges are spilled as they are read.
+        """
+        checkpoint_path = os.path.join(path, CHECKPOINT_FILE)
+        if not os.path.exists(checkpoint_path):
+            return None, None
+        with open(checkpoint_path) as f:
+            saved = json.load(f)
+        graph = cls(spill_dir, max_bytes)
+        with open(os.path.join(path, URLS_FILE), 'rb') as f:
+            graph.urls = f.read(saved['urls_bytes']).decode('utf-8').split('\n')[:saved['urls']]
+        graph.ids = {url: node for node, url in enumerate(graph.urls)}
+        with open(os.path.join(path, EDGES_FILE), 'rb') as f:
+            while len(graph) < saved['edges']:
+                count, = CHUNK.unpack(f.read(CHUNK.size))
+                columns = array('i'), array('i'), array('f')
+                for column in columns:
+                    column.fromfile(f, count)
+                graph.extend(*columns)
+        graph.saved = saved
+        return graph, saved
+
+    def to_igraph(self):
+        """
+        Builds a directed, weighted igraph Graph. Vertex ids are the URL ids.
+        Columns are read as numpy arrays, but igraph still converts every edge and
+        weight: PageRank doesn't go through igraph, see `streamed_pagerank`.
+        """
+        chunks = list(self.columns()) or [(array('i'), array('i'), array('f'))]
+        sources, targets, weights = (np.concatenate([np.frombuffer(chunk[c], dtype=dtype) for chunk in chunks])
+                                     for c, dtype in enumerate((np.int32, np.int32, np.float32)))
+        g = Graph(n=len(self.urls), edges=np.column_stack((sources, targets)), directed=True)
+        g.es["weight"] = weights.astype(np.float64)  # igraph misreads np.float32 weights
+        return g
@@ -0,0 +1,81 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import defer
+
+from extraction import PageExtractor
+
+_extractor = None  # `PageExtractor` of a worker process
+
+
+def available_cores():
+    """
+    Returns the number of cores this process may run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS / Windows
+        return os.cpu_count() or 1
+
+
+def pool_size(processes):
+    """
+    Parses the PROCESSES setting: `auto` keeps one core for the reactor.
+    Returns 0 if extraction should stay in the spider.
+    """
+    if str(processes).lower() == 'auto':
+        return max(available_cores() - 1, 1)
+    return max(int(processes or 0), 0)
+
+
+def _init_worker(plan, options):
+    global _extractor
+    _extractor = PageExtractor(plan, **options)
+
+
+def _extract(payload):
+    response_class, url, status, headers, body, encoding = payload
+    response = response_class(url=url, status=status, headers=headers, body=body, encoding=encoding)
+    return _extractor.extract(response)
+
+
+class ExtractionPool:
+    """
+    Runs `PageExtractor.extract` in worker processes so CPU-heavy extraction
+    (trafilatura, justext, extruct, langdetect) doesn't block the Twisted reactor.
+
+    Arguments:
+    - processes: number of worker processes
+    - plan, options: arguments of `PageExtractor`
+    """
+    def __init__(self, processes, plan, **options):
+        self.processes = processes
+        # Workers are spawned, forking a process running the reactor and its threads isn't safe
+        self.executor = ProcessPoolExecutor(max_workers=processes,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(plan, options))
+
+    def submit(self, response):
+        """
+        Sends a response to a worker.
+        Returns a Deferred firing with the extracted fields, in the reactor thread.
+        """
+        from twisted.internet import reactor  # Installed by Scrapy, don't import it before
+        payload = (response.__class__, response.url, response.status, list(response.headers.items()),
+                   response.body, response.encoding)
+        d = defer.Deferred()
+        future = self.executor.submit(_extract, payload)
+        future.add_done_callback(lambda f: reactor.callFromThread(self._done, d, f))
+        return d
+
+    @staticmethod
+    def _done(d, future):
+        error = future.exception()
+        if error is not None:
+            d.errback(error)
+        else:
+            d.callback(future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,179 @@
+import os
+import time
+from array import array
+import numpy as np
+
+from linkgraph import LinkGraph
+
+DAMPING = 0.85
+TOLERANCE = 1e-10  # L1 change between two iterations
+MAX_ITERATIONS = 200
+RANKS_FILE = 'ranks.f8'
+RANKS_CHECKPOINT = 'checkpoint.ranks'
+SLICE_EDGES = 1 << 18  # Minimum edges per numpy operation
+
+
+def edge_slices(graph, size):
+    """
+    Iterates over the edges of a graph as `(sources, targets, weights)` numpy views, at
+    most `size` at a time: float64 temporaries follow the slices, not the segments.
+    """
+    for sources, targets, weights in graph.columns():
+        sources = np.frombuffer(sources, dtype=np.int32)
+        targets = np.frombuffer(targets, dtype=np.int32)
+        weights = np.frombuffer(weights, dtype=np.float32)
+        for start in range(0, len(sources), size):
+            yield sources[start:start + size], targets[start:start + size], weights[start:start + size]
+
+
+def streamed_pagerank(graph, start=None, damping=DAMPING, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """
+    Returns the weighted PageRank of a graph, as a numpy array indexed by URL id.
+    Power iterations read the edge columns in place, one segment at a time, instead
+    of converting every edge to an igraph Graph. Dangling pages spread their rank over
+    all pages as igraph does. Besides the edges, it takes about 10 float64 per URL:
+    edges are taken in slices of as many edges as URLs, at least `SLICE_EDGES`.
+
+    Arguments:
+    - graph: `LinkGraph`, its edges may be spilled to segments
+    - start: previous scores, the iterations start from them
+    """
+    n = graph.node_count()
+    if not n:
+        return np.zeros(0)
+    size = max(n, SLICE_EDGES)  # Each slice makes an array of `n` scores
+    out = np.zeros(n)  # Weighted out-degree
+    for sources, targets, weights in edge_slices(graph, size):
+        out += np.bincount(sources, weights=weights, minlength=n)
+    dangling = out == 0
+    out[dangling] = 1
+    rank = np.full(n, 1 / n)
+    if start is not None and len(start) and np.sum(start) > 0:
+        rank[:len(start)] = start
+        rank /= rank.sum()
+    for _ in range(max_iterations):
+        share = rank / out
+        new = np.zeros(n)
+        for sources, targets, weights in edge_slices(graph, size):
+            new += np.bincount(targets, weights=share[sources] * weights, minlength=n)
+        new = damping * new + (damping * rank[dangling].sum() + 1 - damping) / n
+        new /= new.sum()
+        change = np.abs(new - rank).sum()
+        rank = new
+        if change < tolerance:
+            break
+    return rank
+
+
+class IncrementalPageRank:
+    """
+    Keeps a running PageRank estimate over the crawl graph.
+    Rebuilding the graph for every crawled page makes the crawl quadratic, so the
+    estimate is only refreshed every `interval_pages` pages or `interval_seconds`
+    seconds, whichever comes first. `compute()` forces an exact pass.
+    Scores are computed by `streamed_pagerank`, starting from the previous estimate.
+    Once the graph has spilled edges to disk, they are kept in a memory-mapped file
+    next to the segments.
+    `checkpoint()` saves scores with the graph, a resumed crawl `restore()`s them.
+
+    Arguments:
+    - graph: `LinkGraph` shared with the spider
+    - interval_pages: number of pages between two refreshes
+    - interval_seconds: maximum number of seconds between two refreshes
+    """
+    def __init__(self, graph, interval_pages=500, interval_seconds=30):
+        self.graph = graph
+        self.scores = array('d')  # Indexed by URL id
+        self.interval_pages = interval_pages
+        self.interval_seconds = interval_seconds
+        self.pending_pages = 0
+        self.last_update = time.time()
+        self.computed_edges = 0  # Number of edges used by the current estimate
+
+    def page_added(self):
+        """
+        Registers a new crawled page and refreshes the estimate if needed.
+        """
+        self.pending_pages += 1
+        if self.pending_pages >= self.interval_pages \
+                or time.time() - self.last_update >= self.interval_seconds:
+            self.compute()
+
+    def compute(self):
+        """
+        Runs a full PageRank over the current graph.
+        Returns the scores array, indexed by URL id.
+        """
+        self.pending_pages = 0
+        self.last_update = time.time()
+        if len(self.graph) == self.computed_edges:  # Nothing new since last pass
+            return self.scores
+        scores = streamed_pagerank(self.graph, start=self.scores)
+        self.scores = self.store_scores(scores) if self.graph.segments else scores
+        self.computed_edges = len(self.graph)
+        return self.scores
+
+    def checkpoint(self, path):
+        """
+        Saves the current scores and the graph in `path`, see `LinkGraph.checkpoint`.
+        """
+        os.makedirs(path, exist_ok=True)
+        ranks_path = os.path.join(path, RANKS_CHECKPOINT)
+        with open(ranks_path + '.tmp', 'wb') as f:
+            self.scores.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ranks_path + '.tmp', ranks_path)
+        self.graph.checkpoint(path, ranks=len(self.scores), ranked_edges=self.computed_edges)
+
+    @classmethod
+    def restore(cls, path, spill_dir=None, max_bytes=None, **kwargs):
+        """
+        Returns the estimate saved by `checkpoint()` in `path`, over the saved graph.
+        None if there is no checkpoint.
+
+        Arguments:
+        - path: checkpoint directory
+        - spill_dir, max_bytes: see `LinkGraph`
+        - kwargs: refresh intervals
+        """
+        graph, saved = LinkGraph.restore(path, spill_dir, max_bytes)
+        if graph is None:
+            return None
+        pagerank = cls(graph, **kwargs)
+        scores = array('d')
+        with open(os.path.join(path, RANKS_CHECKPOINT), 'rb') as f:
+            scores.fromfile(f, saved['ranks'])
+        pagerank.scores = pagerank.store_scores(scores) if graph.segments else scores
+        pagerank.computed_edges = saved['ranked_edges']
+        return pagerank
+
+    def store_scores(self, scores):
+        """
+        Writes scores to a memory-mapped file, returns the mapped array.
+        """
+        if not len(scores):
+            return array('d')
+        path = os.path.join(self.graph.spill_dir, RANKS_FILE)
+        stored = np.memmap(path + '.tmp', dtype=np.float64, mode='w+', shape=len(scores))
+        stored[:] = scores
+        stored.flush()
+        del stored
+        os.replace(path + '.tmp', path)
+        return np.memmap(path, dtype=np.float64, mode='r')
+
+    def get(self, url, default=0):
+        """
+        Returns current PageRank estimate for an URL.
+        """
+        node = self.graph.get_id(url)
+        if node is None or node >= len(self.scores):
+            return default
+        return float(self.scores[node])
+
+    def items(self):
+        """
+        Iterates over `(url, pagerank)` pairs of the current estimate.
+        """
+        for url, score in zip(self.graph.urls, self.scores):
+            yield url, float(score)
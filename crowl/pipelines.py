@@ -1,11 +1,29 @@
 from pymysql.cursors import DictCursor
 from pymysql import OperationalError
 from pymysql.constants.CR import CR_SERVER_GONE_ERROR,  CR_SERVER_LOST, CR_CONNECTION_ERROR
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from twisted.enterprise import adbapi
+from scrapy import signals
 from scrapy.exporters import CsvItemExporter
+from collections import deque
 import copy
+import csv
 import logging
+import os
+
+from warc import WarcWriter, MAX_SIZE as WARC_MAX_SIZE
+from utils import update_pageranks, update_orphans, partition_name
+from sitemaps import inlinks, linked_levels
+
+class CrowlExtractionPipeline:
+    """
+    Completes items extracted in worker processes (`[EXTRACTION] PROCESSES`).
+    Runs before output pipelines. While an item waits for its worker, its
+    response counts in Scrapy's scraper slot, which throttles the scheduler.
+    """
+    def process_item(self, item, spider):
+        return spider.complete_item(item)
+
 
 class CrowlMySQLPipeline:
     """
@@ -25,7 +43,7 @@ class CrowlMySQLPipeline:
             'port': int(self.settings.get('MYSQL_PORT', 3306)),
             'user': self.settings.get('MYSQL_USER', None),
             'password': self.settings.get('MYSQL_PASSWORD', ''),
-            'db': self.settings.get('OUTPUT_NAME', None),
+            'db': self.settings.get('MYSQL_DATABASE', self.settings.get('OUTPUT_NAME', None)),
             'charset': 'utf8',
             'cursorclass': DictCursor,
             'cp_reconnect': True,
@@ -37,9 +55,29 @@ class CrowlMySQLPipeline:
         self.links_table = self.settings.get('MYSQL_LINKS_TABLE', 'links')
         self.db = adbapi.ConnectionPool('pymysql', **db_args)
 
+    @defer.inlineCallbacks
     def close_spider(self, spider):
+        if getattr(spider, 'pagerank_mode', None) == 'final':
+            # Crawl is over, patch rows with the exact PageRank
+            spider.pagerank.compute()
+            try:
+                yield self.db.runInteraction(self._update_pageranks, spider.pagerank.items())
+            except Exception as e:
+                self.logger.error("PageRank update failed: %s", e)
+        if getattr(spider, 'sitemaps', False) and spider.pagerank_mode != 'merged':
+            # Workers only have their own links, the main process decides orphans
+            try:
+                yield self.db.runInteraction(self._update_orphans, spider.graph)
+            except Exception as e:
+                self.logger.error("Orphans update failed: %s", e)
         self.db.close()
 
+    def _update_pageranks(self, tx, pageranks):
+        update_pageranks(tx, self.urls_table, pageranks)
+
+    def _update_orphans(self, tx, graph):
+        update_orphans(tx, self.urls_table, graph)
+
     @staticmethod
     def preprocess_item(item):
         """Can be useful with extremly straight-line spiders design without item loaders or items at all
@@ -109,8 +147,8 @@ class CrowlMySQLPipeline:
             )
 
     def _process_item(self, tx, row):
-        # Prevents crushing data before yielding item
-        tmprow = copy.deepcopy(row) 
+        # Prevents crushing data before yielding item, outlinks are only read
+        tmprow = copy.copy(row)
         # First we insert the links  
         if tmprow.get('outlinks'):
             links = tmprow['outlinks']
@@ -135,6 +173,8 @@ class CrowlMySQLPipeline:
 class CrowlCsvPipeline:
     """
     Writes data to CSV files.
+    Multi-site crawls (OUTPUT_PER_SITE) write the files of each site apart,
+    `<OUTPUT_NAME>_<site>_urls.csv`, opened with the first page of the site.
     """
     @classmethod
     def from_crawler(cls, crawler):
@@ -144,11 +184,22 @@ class CrowlCsvPipeline:
         self.logger = logging.getLogger(__name__)
         self.stats = crawler.stats
         self.settings = crawler.settings
+        self.output_name = self.settings.get('OUTPUT_NAME', 'output')
+        self.per_site = self.settings.getbool('OUTPUT_PER_SITE')
+        self.outputs = dict()  # Site -> (urls path, files, urls exporter, links exporter)
+        if not self.per_site:
+            self.open_output(None)
 
-        self.urls_file = open('{}_urls.csv'.format(self.settings.get('OUTPUT_NAME', 'output')), 'ab')
-        self.urls_exporter   = CsvItemExporter(self.urls_file, include_headers_line=True)
+    def open_output(self, site):
+        """
+        Opens the CSV files of a site, or of the crawl if `site` is None.
+        """
+        name = partition_name(self.output_name, site)
+        urls_path = '{}_urls.csv'.format(name)
+        urls_file = open(urls_path, 'ab')
+        urls_exporter   = CsvItemExporter(urls_file, include_headers_line=True)
         # Listing the fields ensures their order stays the same. Be sure to update the list if you add more fields!
-        self.urls_exporter.fields_to_export = [
+        urls_exporter.fields_to_export = [
             'url',
             'response_code',
             'content_type',
@@ -183,39 +234,185 @@ class CrowlCsvPipeline:
             'request_headers',
             'response_headers',
             'redirect',
-            'pagerank'
+            'pagerank',
+            'etag',
+            'last_modified',
+            'orphan',
+            'duplicate_of'
         ]
-        self.urls_exporter.start_exporting()
+        urls_exporter.start_exporting()
 
-        self.links_file = open('{}_links.csv'.format(self.settings.get('OUTPUT_NAME', 'output')), 'ab')
-        self.links_exporter   = CsvItemExporter(self.links_file, include_headers_line=True)
-        self.links_exporter.fields_to_export = [
+        links_file = open('{}_links.csv'.format(name), 'ab')
+        links_exporter   = CsvItemExporter(links_file, include_headers_line=True)
+        links_exporter.fields_to_export = [
             'source',
             'target',
             'text',
             'nofollow',
             'disallow',
+            'weight',
         ]
-        self.links_exporter.start_exporting()
+        links_exporter.start_exporting()
+        self.outputs[site] = (urls_path, (urls_file, links_file), urls_exporter, links_exporter)
+        return self.outputs[site]
 
     def close_spider(self, spider):
-        self.urls_exporter.finish_exporting()
-        self.links_exporter.finish_exporting()
-        self.urls_file.close()
-        self.links_file.close()
+        for _, files, urls_exporter, links_exporter in self.outputs.values():
+            urls_exporter.finish_exporting()
+            links_exporter.finish_exporting()
+            for f in files:
+                f.close()
+        urls_paths = [urls_path for urls_path, _, _, _ in self.outputs.values()]
+        if getattr(spider, 'pagerank_mode', None) == 'final':
+            # Crawl is over, patch rows with the exact PageRank
+            spider.pagerank.compute()
+            for urls_path in urls_paths:
+                rewrite_csv_column(urls_path, 'pagerank', lambda row: spider.pagerank.get(row['url']))
+        if getattr(spider, 'sitemaps', False) and spider.pagerank_mode != 'merged':
+            # Workers only have their own links, the main process decides orphans
+            decide_orphans(urls_paths, spider.graph)
 
     @defer.inlineCallbacks
     def process_item(self, item, spider):
-        # Prevents crushing data before yielding item
-        tmprow = copy.deepcopy(item) 
+        site = spider.site_of(item['url']) if self.per_site else None
+        output = self.outputs.get(site) or self.open_output(site)
+        _, _, urls_exporter, links_exporter = output
+        # Prevents crushing data before yielding item, outlinks are only read
+        tmprow = copy.copy(item)
         # First we insert the links  
         if tmprow.get('outlinks'):
             links = tmprow['outlinks']
             for link in links:
-                self.links_exporter.export_item(link)
+                links_exporter.export_item(link)
 
             # Replace outlinks dict with count of outlinks before inserting url data
             tmprow['outlinks'] = len(links)
-        self.urls_exporter.export_item(tmprow)
+        urls_exporter.export_item(tmprow)
 
         yield item
+
+
+class CrowlWarcPipeline:
+    """
+    Archives requests and responses as gzipped WARC files.
+    Responses are written as they are received, from a background thread; items
+    go through unchanged.
+    When the writer falls behind, the engine is paused instead of blocking the reactor:
+    responses still arriving wait in `backlog` until the writer has drained its queue.
+    """
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def __init__(self, crawler):
+        from twisted.internet import reactor  # Installed by Scrapy, don't import it before
+        self.logger = logging.getLogger(__name__)
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.settings = crawler.settings
+        output_name = self.settings.get('OUTPUT_NAME', 'output')
+        self.backlog = deque()  # (request, response) refused by the writer, in order
+        self.paused = False
+        self.writer = WarcWriter(
+            self.settings.get('WARC_DIRECTORY', '{}_warc'.format(output_name)),
+            os.path.basename(output_name),
+            max_size=self.settings.getint('WARC_MAX_SIZE', WARC_MAX_SIZE),
+            on_drained=lambda: reactor.callFromThread(self.drained))
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+
+    def response_received(self, response, request, spider):
+        if self.backlog or not self.writer.write(request, response):
+            self.backlog.append((request, response))
+            if not self.paused:
+                self.paused = True
+                self.crawler.engine.pause()
+                self.stats.inc_value('warc/pauses')
+
+    def drained(self):
+        """
+        Queues the backlog, resumes the engine once it is empty.
+        """
+        while self.backlog and self.writer.write(*self.backlog[0]):
+            self.backlog.popleft()
+        if not self.backlog and self.paused:
+            self.paused = False
+            self.crawler.engine.unpause()
+            self.crawler.engine.slot.nextcall.schedule()  # Don't wait for the engine heartbeat
+
+    def process_item(self, item, spider):
+        return item
+
+    def close_spider(self, spider):
+        # Waits for queued records without blocking the reactor
+        d = threads.deferToThread(self.writer.close, list(self.backlog))
+        self.backlog.clear()
+        d.addCallback(lambda _: self._record_stats())
+        return d
+
+    def _record_stats(self):
+        self.stats.set_value('warc/records', self.writer.records)
+        self.stats.set_value('warc/bytes', self.writer.bytes)
+        self.stats.set_value('warc/files', self.writer.files)
+        if self.writer.errors:
+            self.stats.set_value('warc/errors', self.writer.errors)
+
+
+def csv_rows(path):
+    """
+    Iterates over the rows of a CSV export as dicts.
+    """
+    csv.field_size_limit(2 ** 31 - 1)  # `content` can be large
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        for row in reader:
+            if row != header:  # Resumed crawls repeat the header line
+                yield dict(zip(header, row))
+
+
+def rewrite_csv_column(path, column, value):
+    """
+    Rewrites one column of a CSV export in a streaming pass.
+
+    Arguments:
+    - path: CSV file written by `CsvItemExporter`
+    - column: name of the column to rewrite
+    - value: function returning the new value from a row dict
+    """
+    csv.field_size_limit(2 ** 31 - 1)  # `content` can be large
+    with open(path, 'r', newline='', encoding='utf-8') as src:
+        header = next(csv.reader(src), None)
+    if header is None or column not in header:
+        return
+    index = header.index(column)
+    tmp_path = path + '.tmp'
+    with open(path, 'r', newline='', encoding='utf-8') as src, \
+            open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        for row in reader:
+            if row != header:  # Resumed crawls repeat the header line
+                row[index] = value(dict(zip(header, row)))
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+
+
+def decide_orphans(paths, graph):
+    """
+    Decides orphans once the crawl is over: pages crawled from sitemaps stay orphans if
+    no crawled page links to them, the others get the level of their links.
+
+    Arguments:
+    - paths: urls CSV exports of the crawl
+    - graph: `LinkGraph` of the crawl
+    """
+    pages = {row['url'] for path in paths for row in csv_rows(path) if row.get('orphan') == 'True'}
+    linked = inlinks(graph, pages)
+    if not linked:
+        return
+    sources = set().union(*linked.values())
+    levels = linked_levels(linked, {row['url']: int(row['level']) for path in paths
+                                    for row in csv_rows(path) if row['url'] in sources})
+    for path in paths:
+        rewrite_csv_column(path, 'orphan', lambda row: '' if row['url'] in levels else row['orphan'])
+        rewrite_csv_column(path, 'level', lambda row: levels.get(row['url'], row['level']))
@@ -0,0 +1,27 @@
+class ExtractionPlan:
+    """
+    Extraction stages to run on each page, compiled once from the crawl config.
+    A stage only runs if its output is stored, e.g. a basic surfer crawl never
+    pays for language detection and justext segmentation.
+    """
+    def __init__(self, links=False, surfer="basic", content=False, check_lang=False, microdata=True,
+                 extractors=None, store_request_headers=False, store_response_headers=False):
+        self.links = bool(links)  # Outlinks and link graph
+        self.link_weights = self.links and surfer == 'advanced'  # Reasonable surfer weights
+        self.pagerank = self.links  # No graph without links
+        self.content = bool(content)  # Main content extraction
+        self.check_lang = bool(check_lang)  # Content language
+        self.language = self.check_lang or self.link_weights  # Detected once, shared by both
+        self.microdata = bool(microdata)  # Microdata and JSON-LD
+        self.extractors = bool(extractors)  # Custom extractors
+        self.request_headers = bool(store_request_headers)
+        self.response_headers = bool(store_response_headers)
+
+    def stages(self):
+        """
+        Returns the names of enabled stages.
+        """
+        return [name for name, enabled in vars(self).items() if enabled]
+
+    def __repr__(self):
+        return "ExtractionPlan({})".format(', '.join(self.stages()))
@@ -0,0 +1,186 @@
+import os
+import csv
+import pymysql.cursors
+
+from utils import partition_name
+
+# Fields describing the current fetch, never carried forward from a previous crawl
+FRESH_FIELDS = ('url', 'level', 'referer', 'latency', 'crawled_at', 'http_date', 'x_cache', 'request_headers',
+                'response_headers', 'outlinks', 'pagerank', 'orphan', 'duplicate_of')
+
+
+class PreviousCrawl:
+    """
+    Pages of a previous crawl that can be revalidated: those with an `ETag` or a `Last-Modified`.
+    Keeps their output row and outlinks, carried forward when the server answers 304 Not Modified.
+    """
+    def __init__(self):
+        self.rows = dict()  # url -> row, without empty values
+        self.links = dict()  # source url -> list of outlinks
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, url):
+        return url in self.rows
+
+    def add_row(self, row):
+        row = {k: v for k, v in row.items() if v not in ('', None)}
+        if row.get('etag') or row.get('last_modified'):
+            self.rows[row['url']] = row
+            self.links[row['url']] = list()
+
+    def add_link(self, link):
+        outlinks = self.links.get(link['source'])
+        if outlinks is not None:  # Only pages which can be revalidated
+            outlinks.append(link)
+
+    def conditional_headers(self, url):
+        """
+        Returns `If-None-Match` / `If-Modified-Since` headers for a URL.
+        """
+        row = self.rows.get(url)
+        headers = dict()
+        if row is None:
+            return headers
+        if row.get('etag'):
+            headers['If-None-Match'] = row['etag']
+        if row.get('last_modified'):
+            headers['If-Modified-Since'] = row['last_modified']
+        return headers
+
+    def fields(self, url):
+        """
+        Returns the previous extracted fields of a URL, with its outlinks.
+        """
+        fields = {k: v for k, v in self.rows[url].items() if k not in FRESH_FIELDS}
+        outlinks = list()
+        count = len(self.links[url])
+        for c, link in enumerate(self.links[url]):
+            lien = {'source': url, 'target': link['target'], 'text': link.get('text', '')}
+            if link.get('nofollow') in (True, 1, '1', 'True'):
+                lien['nofollow'] = True
+            weight = link.get('weight')
+            # Outputs written before the weight column: basic surfer weight
+            lien['weight'] = to_number(weight) if weight not in (None, '') else max(1 - c / count, 0)
+            outlinks.append(lien)
+        fields['outlinks'] = outlinks
+        return fields
+
+    @classmethod
+    def from_csv(cls, *names):
+        """
+        Loads `<name>_urls.csv` and `<name>_links.csv` written by `CrowlCsvPipeline`,
+        for each output name (the sites of a multi-site crawl).
+        """
+        previous = cls()
+        csv.field_size_limit(2 ** 31 - 1)  # `content` can be large
+        for name in names:
+            urls_path = '{}_urls.csv'.format(name)
+            if not os.path.exists(urls_path):  # Site without any page crawled
+                continue
+            for row in read_csv_rows(urls_path):
+                previous.add_row(row)
+            links_path = '{}_links.csv'.format(name)
+            if os.path.exists(links_path):
+                for link in read_csv_rows(links_path):
+                    previous.add_link(link)
+        return previous
+
+    @classmethod
+    def from_mysql(cls, name, host, port, user, password):
+        """
+        Loads the `urls` and `links` tables written by `CrowlMySQLPipeline`.
+        """
+        previous = cls()
+        connection = pymysql.connect(host=host,
+            port=int(port),
+            db=name,
+            user=user,
+            password=password,
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.SSDictCursor)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT * FROM `urls` WHERE `etag` IS NOT NULL OR `last_modified` IS NOT NULL")
+                for row in cursor:
+                    row.pop('id', None)
+                    previous.add_row(row)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT `source`, `target`, `text`, `weight`, `nofollow` FROM `links` ORDER BY `id`")
+                for link in cursor:
+                    previous.add_link(link)
+        finally:
+            connection.close()
+        return previous
+
+
+def to_number(value):
+    """
+    Parses a number read from a CSV file, keeping integers as they were written.
+    """
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    return value
+
+
+def read_csv_rows(path):
+    """
+    Yields rows of a CSV export as dicts, skipping header lines repeated by resumed crawls.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        for row in reader:
+            if row != header:
+                yield dict(zip(header, row))
+
+
+def load_previous_crawl(name, config, sites=None):
+    """
+    Loads a previous crawl from its CSV files, or from its MySQL database.
+    Returns a `PreviousCrawl`.
+
+    Arguments:
+    - name: output name of the previous crawl
+    - config: crawl config, for MySQL credentials
+    - sites: sites of a multi-site crawl, their CSV files are apart
+    """
+    names = [partition_name(name, site) for site in sites] if sites else [name]
+    if any(os.path.exists('{}_urls.csv'.format(n)) for n in names):
+        return PreviousCrawl.from_csv(*names)
+    if config.has_section('MYSQL'):
+        return PreviousCrawl.from_mysql(
+            name,
+            config['MYSQL']['MYSQL_HOST'],
+            config['MYSQL']['MYSQL_PORT'],
+            config['MYSQL']['MYSQL_USER'],
+            config['MYSQL']['MYSQL_PASSWORD'])
+    raise ValueError("No output found for previous crawl '{}'.".format(name))
+
+
+class CrowlIncrementalMiddleware:
+    """
+    Sends conditional requests for pages of the previous crawl (`--incremental-from`).
+    Unchanged pages answer 304 Not Modified, the spider carries their previous row forward.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_request(self, request, spider):
+        previous = getattr(spider, 'previous', None)
+        if previous is None:
+            return None
+        headers = previous.conditional_headers(request.url)
+        if headers:
+            for key, value in headers.items():
+                request.headers.setdefault(key, value)
+            self.stats.inc_value('incremental/conditional_requests')
+        return None
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from reppy.robots import Robots
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request
+from twisted.internet import defer
+from w3lib.url import safe_url_string
+
+from utils import url_origin
+
+ALLOW_ALL = ''
+DISALLOW_ALL = 'User-agent: *\nDisallow: /'
+ERROR_TTL = 600  # Unreachable robots.txt are retried after 10 minutes
+MAX_SIZE = 500 * 1024  # Rules after 500 KiB are ignored, as search engines do
+MAX_REDIRECTS = 5  # Redirects followed to reach a robots.txt, same
+
+
+def robots_origin(url):
+    """
+    Returns the origin (`scheme://netloc`) a robots.txt applies to.
+    """
+    return '{}://{}'.format(*url_origin(url))
+
+
+class RobotsCache:
+    """
+    Parsed robots.txt rules per host, shared by the spider and `CrowlRobotsMiddleware`.
+    Entries expire after `ttl` seconds, least recently used hosts are evicted above `max_hosts`.
+
+    Verdicts per URL are kept in a bounded LRU cache too, the same targets are linked
+    from thousands of pages. It is cleared whenever a robots.txt is stored.
+
+    Arguments:
+    - ttl: lifetime of a robots.txt, in seconds
+    - max_hosts: number of hosts kept in memory
+    - max_verdicts: number of URL verdicts kept in memory
+    """
+    def __init__(self, ttl=86400, max_hosts=1000, max_verdicts=50000):
+        self.ttl = ttl
+        self.max_hosts = max_hosts
+        self.max_verdicts = max_verdicts
+        self.entries = OrderedDict()  # origin -> (expires_at, content, parsed robots)
+        self.verdicts = OrderedDict()  # (url, agent) -> allowed ?
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, origin):
+        """
+        Returns the parsed robots.txt of an origin, None if unknown or expired.
+        """
+        entry = self.entries.get(origin)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self.entries[origin]
+            return None
+        self.entries.move_to_end(origin)
+        return entry[2]
+
+    def put(self, origin, content, ttl=None, expires_at=None):
+        """
+        Parses and stores the robots.txt of an origin.
+        Returns the parsed robots.txt.
+        """
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        robots = Robots.parse(origin + '/robots.txt', content)
+        self.entries[origin] = (expires_at, content, robots)
+        self.entries.move_to_end(origin)
+        while len(self.entries) > self.max_hosts:
+            self.entries.popitem(last=False)
+        self.verdicts.clear()
+        return robots
+
+    def sitemaps(self, origin):
+        """
+        Returns the sitemap URLs listed in the robots.txt of an origin.
+        """
+        robots = self.get(origin)
+        if robots is None:
+            return []
+        return list(robots.sitemaps)
+
+    def allowed(self, url, agent='*'):
+        """
+        Checks a URL against the robots.txt of its host.
+        Returns None if this robots.txt isn't known yet.
+        """
+        key = (url, agent)
+        verdict = self.verdicts.get(key)
+        if verdict is not None:
+            self.hits += 1
+            self.verdicts.move_to_end(key)
+            return verdict
+        self.misses += 1
+        robots = self.get(robots_origin(url))
+        if robots is None:
+            return None
+        verdict = robots.allowed(url, agent)
+        self.verdicts[key] = verdict
+        if len(self.verdicts) > self.max_verdicts:
+            self.verdicts.popitem(last=False)
+        return verdict
+
+    def save(self, path):
+        """
+        Writes unexpired entries to a JSON file.
+        """
+        now = time.time()
+        entries = [[origin, expires_at, content] for origin, (expires_at, content, _) in self.entries.items()
+                   if expires_at >= now]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        """
+        Reads entries saved by `save()`, expired ones are skipped.
+        Returns the number of entries loaded.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        now = time.time()
+        for origin, expires_at, content in entries:
+            if expires_at >= now:
+                self.put(origin, content, expires_at=expires_at)
+        return len(self.entries)
+
+
+class CrowlRobotsMiddleware:
+    """
+    Fetches robots.txt once per host through the Scrapy downloader, requests to a host
+    wait for it without blocking the crawl.
+    Rules are stored in the spider's `RobotsCache` and persisted in JOBDIR, resumed
+    crawls don't fetch them again.
+    Replaces Scrapy's `RobotsTxtMiddleware`: requests are dropped if ROBOTSTXT_OBEY is set.
+    A robots.txt answering 401 or 403 allows everything, as with Scrapy, or nothing
+    with ROBOTSTXT_STRICT.
+    """
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.obey = crawler.settings.getbool('ROBOTSTXT_OBEY')
+        self.strict = crawler.settings.getbool('ROBOTSTXT_STRICT')
+        self.user_agent = crawler.settings.get('USER_AGENT')
+        self.jobdir = crawler.settings.get('JOBDIR')
+        self.waiting = dict()  # origin -> Deferreds of requests waiting for its robots.txt
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def cache_path(self):
+        if self.jobdir:
+            return os.path.join(self.jobdir, 'robots.json')
+        return None
+
+    def spider_opened(self, spider):
+        path = self.cache_path()
+        if path:
+            loaded = spider.robots.load(path)
+            if loaded:
+                spider.logger.info("Loaded robots.txt of {} hosts from {}".format(loaded, path))
+
+    def spider_closed(self, spider):
+        path = self.cache_path()
+        if path:
+            spider.robots.save(path)
+
+    def process_request(self, request, spider):
+        if request.meta.get('dont_obey_robotstxt'):  # robots.txt requests themselves
+            return None
+        origin = robots_origin(request.url)
+        robots = spider.robots.get(origin)
+        if robots is not None:
+            return self.check(robots, request, spider)
+
+        d = defer.Deferred()
+        d.addCallback(self.check, request, spider)
+        if origin in self.waiting:
+            self.waiting[origin].append(d)
+        else:
+            self.waiting[origin] = [d]
+            self.fetch(origin, spider)
+        return d
+
+    def check(self, robots, request, spider):
+        if self.obey and not robots.allowed(request.url, self.user_agent):
+            self.crawler.stats.inc_value('robotstxt/forbidden')
+            spider.logger.debug("Forbidden by robots.txt: {}".format(request.url))
+            raise IgnoreRequest("Forbidden by robots.txt")
+        return None
+
+    def fetch(self, origin, spider, url=None, redirects=0):
+        """
+        Downloads the robots.txt of an origin, from `url` when it was redirected there.
+        """
+        request = Request(url or origin + '/robots.txt', meta={'dont_obey_robotstxt': True})
+        self.crawler.stats.inc_value('robotstxt/request_count')
+        d = self.crawler.engine.download(request, spider)
+        d.addCallbacks(self.fetched, self.failed, callbackArgs=(origin, spider, redirects),
+                       errbackArgs=(origin, spider))
+
+    def fetched(self, response, origin, spider, redirects=0):
+        self.crawler.stats.inc_value('robotstxt/response_count')
+        self.crawler.stats.inc_value('robotstxt/response_status_count/{}'.format(response.status))
+        location = response.headers.get('Location')
+        if 300 <= response.status < 400 and location and redirects < MAX_REDIRECTS:
+            # The spider handles 301/302 itself, `RedirectMiddleware` leaves them to it.
+            # Rules found at the end of the redirects (HTTPS, www...) apply to `origin`
+            self.crawler.stats.inc_value('robotstxt/redirect_count')
+            self.fetch(origin, spider, response.urljoin(safe_url_string(location)), redirects + 1)
+            return
+        ttl = None
+        if 200 <= response.status < 300:
+            content = response.body[:MAX_SIZE].decode('utf-8', 'replace')
+        elif response.status in (401, 403):  # Access restricted
+            content = DISALLOW_ALL if self.strict else ALLOW_ALL
+        elif response.status < 500:  # Not found or too many redirects: everything is allowed
+            content = ALLOW_ALL
+        else:  # Server error, retried later
+            content = ALLOW_ALL
+            ttl = ERROR_TTL
+        self.release(origin, spider.robots.put(origin, content, ttl=ttl))
+
+    def failed(self, failure, origin, spider):
+        self.crawler.stats.inc_value('robotstxt/exception_count/{}'.format(failure.type.__name__))
+        spider.logger.warning("Could not fetch robots.txt of {}: {}".format(origin, failure.value))
+        self.release(origin, spider.robots.put(origin, ALLOW_ALL, ttl=ERROR_TTL))
+
+    def release(self, origin, robots):
+        for d in self.waiting.pop(origin, []):
+            d.callback(robots)
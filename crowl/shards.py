@@ -0,0 +1,309 @@
+import os
+import sys
+import csv
+import time
+import zlib
+import pickle
+import sqlite3
+import logging
+import subprocess
+from twisted.internet import task
+from scrapy import signals
+from scrapy.http import Request
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+from w3lib.url import canonicalize_url
+
+from linkgraph import LinkGraph, GRAPH_DIR
+from pagerank import IncrementalPageRank
+
+POLL_INTERVAL = 1  # Seconds between two checks for URLs sent by other workers
+BATCH_SIZE = 1000  # URLs taken from the shared frontier at once
+FRONTIER_FILE = 'frontier.sqlite'
+SENT_FILE = 'shard_sent.pickle'  # Depths of the URLs sent to other workers, in JOBDIR
+
+# Worker states in the shared frontier
+BUSY, IDLE, CLOSED = 0, 1, 2
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(url, workers):
+    """
+    Returns the index of the worker crawling an URL, stable across processes and runs.
+    URLs the dupefilter takes for the same one (fragment, query order) get the same worker.
+    """
+    return zlib.crc32(canonicalize_url(url).encode('utf-8')) % workers
+
+
+def worker_name(output_name, shard):
+    """
+    Returns the output name of a worker, its files and JOBDIR are named after it.
+    """
+    return '{}_{}'.format(output_name, shard)
+
+
+class SharedFrontier:
+    """
+    URLs found by a worker and crawled by another one, in a SQLite database in WAL mode.
+    A URL has one row, claimed by the worker of its shard. Sent again at a lower depth,
+    the row takes that depth and is claimed again: the worker's `CrowlFrontierScheduler`
+    requeues the URL at the lower depth if it is still waiting. A URL already crawled
+    keeps its level, so levels can be deeper than in a single process crawl when the
+    shorter path is found after the URL was crawled.
+    Workers record whether they are busy: the crawl is over when none is, and no URL
+    is waiting for a worker still running.
+
+    Arguments:
+    - path: database file, shared by all workers
+    - shard: index of this worker
+    """
+    def __init__(self, path, shard=None):
+        self.shard = shard
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    @classmethod
+    def create(cls, path, workers):
+        """
+        Creates the database, or resets worker states to resume a crawl.
+        """
+        frontier = cls(path)
+        db = frontier.db
+        # Sitemap URLs skip the dupefilter (`dont_filter`), they are sent apart from links to the same URLs
+        db.execute("CREATE TABLE IF NOT EXISTS requests ("
+                   "url TEXT NOT NULL, dont_filter INTEGER NOT NULL, shard INTEGER NOT NULL, depth INTEGER NOT NULL, "
+                   "claimed INTEGER NOT NULL DEFAULT 0, request BLOB NOT NULL, PRIMARY KEY (url, dont_filter))")
+        db.execute("CREATE INDEX IF NOT EXISTS requests_waiting ON requests (shard, claimed)")
+        db.execute("CREATE TABLE IF NOT EXISTS workers (shard INTEGER PRIMARY KEY, state INTEGER NOT NULL)")
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM workers")
+        db.executemany("INSERT INTO workers (shard, state) VALUES (?, ?)", [(i, BUSY) for i in range(workers)])
+        db.execute("COMMIT")
+        return frontier
+
+    def send(self, rows):
+        """
+        Queues `(url, dont_filter, shard, depth, request)` rows for other workers.
+        URLs already sent are ignored, unless they are found at a lower depth.
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.executemany("INSERT OR IGNORE INTO requests (url, dont_filter, shard, depth, request) "
+                            "VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.executemany("UPDATE requests SET depth = ?, request = ?, claimed = 0 "
+                            "WHERE url = ? AND dont_filter = ? AND depth > ?",
+                            [(depth, request, url, dont_filter, depth) for url, dont_filter, _, depth, request in rows])
+        self.db.execute("COMMIT")
+
+    def claim(self, idle=False, limit=BATCH_SIZE):
+        """
+        Takes the URLs waiting for this worker.
+        Returns `(requests, finished)`: `finished` is True when the whole crawl is over.
+
+        Arguments:
+        - idle: True if the worker has nothing left to crawl
+        - limit: maximum number of URLs taken
+        """
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute("SELECT rowid, request FROM requests WHERE shard = ? AND claimed = 0 LIMIT ?",
+                              (self.shard, limit)).fetchall()
+            if rows:
+                db.executemany("UPDATE requests SET claimed = 1 WHERE rowid = ?", [(row,) for row, _ in rows])
+            # Claimed URLs make a worker busy, only the worker itself tells it is idle
+            if rows or idle:
+                state = BUSY if rows else IDLE
+                db.execute("UPDATE workers SET state = ? WHERE shard = ? AND state != ?",
+                           (state, self.shard, CLOSED))
+            finished = False
+            if idle and not rows:
+                busy = db.execute("SELECT COUNT(*) FROM workers WHERE state = ?", (BUSY,)).fetchone()[0]
+                waiting = db.execute(
+                    "SELECT COUNT(*) FROM requests r JOIN workers w ON r.shard = w.shard "
+                    "WHERE r.claimed = 0 AND w.state != ?", (CLOSED,)).fetchone()[0]
+                finished = not busy and not waiting
+        finally:
+            db.execute("COMMIT")
+        return [pickle.loads(request) for _, request in rows], finished
+
+    def set_state(self, shard, state):
+        self.db.execute("UPDATE workers SET state = ? WHERE shard = ?", (state, shard))
+
+    def close(self):
+        self.db.close()
+
+
+class CrowlShardMiddleware:
+    """
+    Spider middleware of a worker (`--workers`): requests for URLs of another shard
+    are sent through the `SharedFrontier` instead of being scheduled, URLs sent by
+    other workers are scheduled every `POLL_INTERVAL` seconds.
+    A URL is sent once per depth it is found at, lower than the ones already sent.
+    An idle worker waits until every worker is idle.
+    """
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        settings = crawler.settings
+        self.shard = settings.getint('SHARD_INDEX')
+        self.workers = settings.getint('SHARD_COUNT')
+        self.frontier = SharedFrontier(settings.get('SHARD_FRONTIER'), self.shard)
+        self.jobdir = settings.get('JOBDIR')
+        self.sent = dict()  # URL sent to another worker -> lowest depth sent
+        if self.jobdir and os.path.exists(os.path.join(self.jobdir, SENT_FILE)):
+            with open(os.path.join(self.jobdir, SENT_FILE), 'rb') as f:
+                self.sent = pickle.load(f)
+        self.poll = task.LoopingCall(self.receive)
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.poll.start(POLL_INTERVAL, now=False)
+
+    def spider_closed(self, spider):
+        if self.poll.running:
+            self.poll.stop()
+        self.frontier.set_state(self.shard, CLOSED)
+        self.frontier.close()
+        if self.jobdir:
+            with open(os.path.join(self.jobdir, SENT_FILE), 'wb') as f:
+                pickle.dump(self.sent, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def spider_idle(self, spider):
+        if self.receive(idle=True):
+            return
+        raise DontCloseSpider
+
+    def receive(self, idle=False):
+        """
+        Schedules the URLs sent by other workers.
+        Returns True when the crawl is over.
+        """
+        requests, finished = self.frontier.claim(idle)
+        for d in requests:
+            self.crawler.engine.crawl(request_from_dict(d, self.spider), self.spider)
+        if requests:
+            self.stats.inc_value('shard/received', len(requests))
+        return finished
+
+    def owned(self, request):
+        return shard_of(request.url, self.workers) == self.shard
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            if self.owned(request):
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        rows = list()
+        resent = 0
+        for r in result:
+            if not isinstance(r, Request) or self.owned(r):
+                yield r
+                continue
+            depth = r.meta.get('depth', 0)
+            if not r.dont_filter:
+                sent = self.sent.get(r.url)
+                if sent is not None and sent <= depth:
+                    continue
+                if sent is not None:  # Shorter path, the other worker may still lower its depth
+                    resent += 1
+                self.sent[r.url] = depth
+            rows.append((r.url, r.dont_filter, shard_of(r.url, self.workers), depth,
+                         pickle.dumps(request_to_dict(r, spider), protocol=pickle.HIGHEST_PROTOCOL)))
+        if rows:
+            self.frontier.send(rows)
+            self.stats.inc_value('shard/sent', len(rows))
+        if resent:
+            self.stats.inc_value('shard/resent', resent)
+
+
+def run_workers(argv, output_name, workers, frontier_path):
+    """
+    Runs `workers` crawler processes, each one being this script with `--shard`.
+    Returns the number of workers which failed.
+
+    Arguments:
+    - argv: command line arguments of the workers
+    - output_name: output name of the crawl
+    - workers: number of worker processes
+    - frontier_path: `SharedFrontier` database
+    """
+    frontier = SharedFrontier.create(frontier_path, workers)
+    processes = list()
+    for shard in range(workers):
+        processes.append(subprocess.Popen([sys.executable, sys.argv[0]] + argv +
+                                          ['--resume', output_name, '--workers', str(workers),
+                                           '--shard', str(shard)]))
+    failed = 0
+    running = dict(enumerate(processes))
+    while running:
+        time.sleep(POLL_INTERVAL)
+        for shard, process in list(running.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del running[shard]
+            if code:
+                failed += 1
+                logger.error("Worker %d exited with code %d", shard, code)
+            # A worker stopped without closing its spider must not keep the others waiting
+            frontier.set_state(shard, CLOSED)
+    frontier.close()
+    return failed
+
+
+def merge_csv(paths, path):
+    """
+    Concatenates CSV exports into one file with a single header line.
+    """
+    csv.field_size_limit(2 ** 31 - 1)  # `content` can be large
+    header = None
+    with open(path, 'w', newline='', encoding='utf-8') as dst:
+        writer = csv.writer(dst)
+        for src_path in paths:
+            if not os.path.exists(src_path):
+                continue
+            with open(src_path, 'r', newline='', encoding='utf-8') as src:
+                reader = csv.reader(src)
+                first = next(reader, None)
+                if first is None:
+                    continue
+                if header is None:
+                    header = first
+                    writer.writerow(header)
+                for row in reader:
+                    if row != header:  # Resumed crawls repeat the header line
+                        writer.writerow(row)
+
+
+def merge_graphs(paths, spill_dir=None, max_bytes=None):
+    """
+    Returns the link graph of the crawl from the graph checkpoints of the workers.
+    With `max_bytes`, worker graphs are read in chunks and edges spilled to `spill_dir`.
+    """
+    graph = LinkGraph(spill_dir, max_bytes)
+    for path in paths:
+        worker_graph, _ = LinkGraph.restore(path, spill_dir and os.path.join(spill_dir, 'load'), max_bytes)
+        if worker_graph is not None:
+            graph.merge(worker_graph)
+    return graph
+
+
+def merged_pagerank(output_name, workers, spill_dir=None, max_bytes=None):
+    """
+    Returns the PageRank of the whole crawl, over the merged graphs of the workers.
+    """
+    graph = merge_graphs((os.path.join('crawls', worker_name(output_name, shard), GRAPH_DIR)
+                          for shard in range(workers)), spill_dir, max_bytes)
+    pagerank = IncrementalPageRank(graph)
+    pagerank.compute()
+    return pagerank
@@ -0,0 +1,175 @@
+import io
+import gzip
+import logging
+from xml.etree.ElementTree import iterparse, ParseError
+import numpy as np
+from scrapy.exceptions import IgnoreRequest
+
+from pagerank import edge_slices, SLICE_EDGES
+
+MAX_URLS = 50000  # Entries read per sitemap file, the sitemaps.org limit
+MAX_SIZE = 50 * 1024 * 1024  # Uncompressed bytes read per sitemap file, same
+GZIP_MAGIC = b'\x1f\x8b'
+SITEMAP_NAMESPACES = ('http://www.sitemaps.org/schemas/sitemap/0.9', '')  # Some sitemaps have none
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedReader:
+    """
+    File-like object stopping after `limit` bytes, gzipped sitemaps are decompressed as they are parsed.
+    """
+    def __init__(self, f, limit):
+        self.f = f
+        self.remaining = limit
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def split_tag(tag):
+    """
+    Returns the namespace and the local name of an ElementTree tag.
+    """
+    if tag.startswith('{'):
+        namespace, name = tag[1:].split('}', 1)
+        return namespace, name
+    return '', tag
+
+
+def iter_sitemap(body, max_urls=MAX_URLS, max_size=MAX_SIZE):
+    """
+    Parses a sitemap or a sitemap index, gzipped or not, without building the document tree.
+    Yields `(kind, url)` tuples, `kind` is `url` for pages and `sitemap` for child sitemaps.
+    Plain text sitemaps (one URL per line) are supported too.
+    Only `<loc>` children of `<url>` and `<sitemap>` entries count, in the sitemaps.org
+    namespace: extensions have their own (`<image:loc>`...).
+
+    Arguments:
+    - body: sitemap file content, bytes
+    - max_urls: number of entries read
+    - max_size: number of uncompressed bytes read
+    """
+    if body[:2] == GZIP_MAGIC:
+        f = gzip.GzipFile(fileobj=io.BytesIO(body))
+    else:
+        f = io.BufferedReader(io.BytesIO(body))
+    count = 0
+    try:
+        head = f.peek(512)[:512]
+        f = BoundedReader(f, max_size)
+        if not head.lstrip().startswith(b'<'):
+            for line in f.read().decode('utf-8', 'replace').splitlines():
+                line = line.strip()
+                if line:
+                    yield 'url', line
+                    count += 1
+                    if count >= max_urls:
+                        return
+            return
+
+        root = None
+        kind = None
+        loc = None
+        depth = 0  # Open elements around the current one
+        for event, elem in iterparse(f, events=('start', 'end')):
+            namespace, name = split_tag(elem.tag)
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif depth == 1 and namespace in SITEMAP_NAMESPACES and name in ('url', 'sitemap'):
+                    kind, loc = name, None
+                depth += 1
+                continue
+            depth -= 1
+            if namespace not in SITEMAP_NAMESPACES or kind is None:
+                continue
+            if name == 'loc' and depth == 2:
+                loc = (elem.text or '').strip()
+            elif name == kind and depth == 1:
+                if loc:
+                    yield kind, loc
+                    count += 1
+                    if count >= max_urls:
+                        return
+                kind = None
+                root.clear()  # Entries already read are dropped
+    except (ParseError, EOFError, OSError) as e:
+        logger.warning("Sitemap parsing stopped after %d entries: %s", count, e)
+
+
+def inlinks(graph, pages):
+    """
+    Returns the URLs linking to each of `pages` in a link graph, as a dict of sets.
+    Links from a page to itself don't count, pages nothing links to are left out.
+
+    Arguments:
+    - graph: `LinkGraph` of the crawl
+    - pages: URLs crawled from sitemaps
+    """
+    ids = {graph.get_id(url): url for url in pages}
+    ids.pop(None, None)
+    found = dict()
+    if not ids:
+        return found
+    wanted = np.fromiter(ids, dtype=np.int32, count=len(ids))
+    for sources, targets, _ in edge_slices(graph, SLICE_EDGES):
+        mask = np.isin(targets, wanted) & (sources != targets)
+        for source, target in zip(sources[mask].tolist(), targets[mask].tolist()):
+            found.setdefault(ids[target], set()).add(graph.urls[source])
+    return found
+
+
+def linked_levels(linked, levels):
+    """
+    Returns the level of pages crawled from sitemaps and linked from crawled pages: one
+    more than the lowest level of the pages linking to them, -1 if only orphans link to them.
+
+    Arguments:
+    - linked: `inlinks()` of the pages
+    - levels: level of the pages linking to them, pages crawled from sitemaps are -1
+    """
+    result = dict.fromkeys(linked, -1)
+    changed = True
+    while changed:  # Sitemap pages linking to each other
+        changed = False
+        for url, sources in linked.items():
+            found = [result.get(source, levels.get(source, -1)) for source in sources]
+            level = min((l + 1 for l in found if l >= 0), default=-1)
+            if level >= 0 and (result[url] < 0 or level < result[url]):
+                result[url] = level
+                changed = True
+    return result
+
+
+class CrowlSitemapMiddleware:
+    """
+    Checks URLs found in sitemaps ([CRAWLER] SITEMAPS) when they leave the scheduler,
+    rather than when they are found: pages linked in the meantime keep the request
+    (and depth) of the link, the others are crawled as orphans.
+    Sitemap URLs are scheduled with `dont_filter`, this registers them in the dupefilter.
+    Orphans are only provisional: a link to them can be found after they were crawled,
+    output pipelines decide them once the crawl is over, from the link graph.
+    """
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if not request.meta.get('sitemap'):
+            return None
+        if self.crawler.engine.slot.scheduler.df.request_seen(request):
+            self.stats.inc_value('sitemap/linked')
+            raise IgnoreRequest("Already found through links: {}".format(request.url))
+        self.stats.inc_value('sitemap/orphans')
+        return None
@@ -1,52 +1,67 @@
+import time
 import datetime
-from reppy.robots import Robots
 from scrapy.settings import Settings
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
+from scrapy.link import Link
 import scrapy
-import w3lib
-import re
+from scrapy.http import TextResponse
 import json
-import extruct
-from trafilatura import extract
-from lxml import html
-import lxml.html
 
 from utils import *
 from pipelines import *
 from items import CrowlItem
-from igraph import Graph
-from langdetect import detect
-from bs4 import BeautifulSoup
-import pycountry
-import justext
+from plan import ExtractionPlan
+from extraction import PageExtractor
+from offload import ExtractionPool
+from linkgraph import LinkGraph
+from pagerank import IncrementalPageRank
+from robotstxt import RobotsCache, robots_origin
+from sitemaps import iter_sitemap
+from frontier import position_weights
+from fingerprint import ContentFingerprints, content_hash
+
+MEMORY_STATS_INTERVAL = 60  # Seconds between two records of the process memory in stats and log
 
 
 class Crowler(CrawlSpider):
     name = 'Crowl'
-    handle_httpstatus_list = [301, 302, 403, 404, 410, 500, 502, 503, 504]
+    handle_httpstatus_list = [301, 302, 304, 403, 404, 410, 500, 502, 503, 504]
     http_user = ''
     http_pass = ''
-    graph_edges = []
-    pageranks = {}
 
     def __init__(self, url, links=False, links_unique=True, content=False, depth=5, exclusion_pattern=None,
                  check_lang=False, surfer="basic", extractors=None, store_request_headers=False,
-                 store_response_headers=False,
-                 http_user=None, http_pass=None, *args, **kwargs):
-        domain = urlparse(url).netloc
+                 store_response_headers=False, microdata=True, extraction_processes=0, lang_detector="auto",
+                 lang_model=None, lang_sample_size=4096,
+                 http_user=None, http_pass=None, pagerank_mode="incremental", pagerank_interval_pages=500,
+                 pagerank_interval_seconds=30, robots_ttl=86400, robots_max_hosts=1000, previous=None,
+                 replay=None, sitemaps=False, sitemap_priority=-100, frontier="breadth-first", seeds=None,
+                 memory_budget=0, graph_dir=None, checkpoint_interval=300, duplicates=True,
+                 duplicates_cache=1000, fingerprints_path=None, *args, **kwargs):
+        # Multi-site crawl: `(url, depth)` seeds, each site is crawled on its own with its depth limit
+        seeds = seeds or [(url, None)]
+        self.sites = list()  # Domain of each site, subdomains included
+        self.site_depths = dict()  # Domain -> depth limit
+        for seed, seed_depth in seeds:
+            domain = urlparse(seed).netloc
+            if domain not in self.site_depths:
+                self.sites.append(domain)
+                self.site_depths[domain] = depth if seed_depth is None else seed_depth
+        self.site_cache = dict()  # Netloc -> site
+        allow = ['.*' + domain + '/.*' for domain in self.sites]
         # Setup the rules for link extraction
         if exclusion_pattern:
             self._rules = [
-                Rule(LinkExtractor(allow='.*' + domain + '/.*', deny=exclusion_pattern), callback=self.parse_url,
+                Rule(LinkExtractor(allow=allow, deny=exclusion_pattern), callback=self.parse_url,
                      follow=True)
             ]
         else:
             self._rules = [
-                Rule(LinkExtractor(allow='.*' + domain + '/.*'), callback=self.parse_url, follow=True)
+                Rule(LinkExtractor(allow=allow), callback=self.parse_url, follow=True)
             ]
-        self.allowed_domains = [domain]
-        self.start_urls = [url]
+        self.allowed_domains = list(self.sites)
+        self.start_urls = [seed for seed, _ in seeds]
         self.links = links  # Should we store links ?
         self.links_unique = links_unique  # Should we store only unique links ?
         self.content = content  # Should we store content ?
@@ -56,178 +71,229 @@ class Crowler(CrawlSpider):
         self.store_request_headers = store_request_headers
         self.store_response_headers = store_response_headers
         self.surfer = surfer
+        # Stages to run on each page, only those whose output is stored
+        self.plan = ExtractionPlan(links=links, surfer=surfer, content=content, check_lang=check_lang,
+                                   microdata=microdata, extractors=extractors,
+                                   store_request_headers=store_request_headers,
+                                   store_response_headers=store_response_headers)
+        # Per page extraction, in the spider or in worker processes
+        extraction_options = dict(extractors=extractors, surfer=surfer, links_unique=links_unique,
+                                  lang_detector=lang_detector, lang_model=lang_model,
+                                  lang_sample_size=lang_sample_size)
+        self.extractor = PageExtractor(self.plan, **extraction_options)
+        self.extraction_pool = None
+        self.pending_items = dict()  # id(item) -> Deferred of extracted fields
+        # Exact and near duplicate pages, exact duplicates reuse the fields extracted from the first copy
+        self.fingerprints = None
+        self.fingerprints_path = fingerprints_path  # Saved there when the spider closes
+        if duplicates:
+            self.fingerprints = ContentFingerprints.load(fingerprints_path, duplicates_cache)
+        if extraction_processes:
+            self.extraction_pool = ExtractionPool(extraction_processes, self.plan, **extraction_options)
+
+        # PageRank is refreshed periodically, not on every page
+        # In `final` mode it is only computed once the crawl is over, and pipelines patch their rows
+        # In `merged` mode (`--workers`) it is computed over the merged graphs of all workers
+        self.pagerank_mode = pagerank_mode
+        pagerank_options = dict(interval_pages=pagerank_interval_pages, interval_seconds=pagerank_interval_seconds)
+        # Link graph, URLs are interned and edges stored in typed arrays
+        # Beyond `memory_budget` MB, edges are spilled to segments in `graph_dir`, see `LinkGraph`
+        # The graph and PageRank are saved in `graph_dir` every `checkpoint_interval` seconds
+        # and when the spider closes, a resumed crawl restores them
+        max_bytes = int(memory_budget * 1024 * 1024) or None
+        self.graph_dir = graph_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        self.pagerank = None
+        if graph_dir is not None:
+            self.pagerank = IncrementalPageRank.restore(graph_dir, graph_dir, max_bytes, **pagerank_options)
+        if self.pagerank is not None:
+            self.logger.info("Link graph restored: {} urls, {} links".format(
+                self.pagerank.graph.node_count(), len(self.pagerank.graph)))
+        else:
+            self.pagerank = IncrementalPageRank(LinkGraph(graph_dir, max_bytes), **pagerank_options)
+        self.graph = self.pagerank.graph
+        self.spilled_segments = 0  # Segments already reported in stats
+        self.last_memory_stats = time.time()
 
         # HTTP Auth
         if http_user and http_pass:
             self.http_user = http_user
             self.http_pass = http_pass
 
-        # robots.txt enhanced
-        self.robots = Robots.fetch(urlparse(url).scheme + '://' + domain + '/robots.txt')
+        # Incremental crawl: pages of the previous crawl, see `CrowlIncrementalMiddleware`
+        self.previous = previous
+        # Replay: URLs of a response store, served by `CrowlReplayMiddleware`
+        self.replay = replay
+
+        # robots.txt of each host, fetched by `CrowlRobotsMiddleware` before its first request
+        self.robots = RobotsCache(ttl=robots_ttl, max_hosts=robots_max_hosts)
+
+        # Sitemaps: found URLs are scheduled with `sitemap_priority`, see `CrowlSitemapMiddleware`
+        self.sitemaps = sitemaps
+        self.sitemap_priority = sitemap_priority
+
+        # Best-first frontier: followed links carry a weight, see `CrowlFrontierScheduler`
+        self.frontier = frontier
 
     def start_requests(self):
+        if self.replay is not None:
+            return self.replay_requests()
         headers = self.settings.get("DEFAULT_REQUEST_HEADERS")
         requests = []
         for item in self.start_urls:
             requests.append(scrapy.Request(url=item, headers=headers))
         return requests
 
+    def replay_requests(self):
+        """
+        Requests every page of the response store, no link is followed.
+        """
+        self.logger.info("Replaying {} stored responses".format(len(self.replay)))
+        for url in self.replay.urls():
+            yield scrapy.Request(url=url, callback=self.parse_replay, dont_filter=True)
+
+    def parse_replay(self, response):
+        if response.meta.get('sitemap_file'):
+            return
+        # Depth of the original crawl, restored by `CrowlReplayMiddleware`
+        if response.meta.get('sitemap') or response.meta.get('depth', 0) < (self.depth_limit(response.url) + 1):
+            yield self.parse_item(response)
+
+    def site_of(self, url):
+        """
+        Returns the site of a URL: the domain of the start URL it belongs to, subdomains
+        included, the longest domain when several match. None for other URLs.
+        """
+        netloc = url_origin(url)[1]
+        if netloc not in self.site_cache:
+            site = None
+            for domain in self.sites:
+                if (netloc == domain or netloc.endswith('.' + domain)) and len(domain) > len(site or ''):
+                    site = domain
+            self.site_cache[netloc] = site
+        return self.site_cache[netloc]
+
+    def same_site(self, url, page_url):
+        """
+        Checks if a link stays on the site of its page. Links between the sites of a
+        multi-site crawl are not followed, each site is crawled as if on its own.
+        """
+        return len(self.sites) == 1 or self.site_of(url) == self.site_of(page_url)
+
+    def depth_limit(self, url):
+        """
+        Returns the depth limit of the site of a URL.
+        """
+        return self.site_depths.get(self.site_of(url), self.depth)
+
     def parse_start_url(self, response):
         """
         Scrapy doesn't parse start URL by default, but this does the trick.  
         """
         self.logger.info("Crawl started with url: {} ({})".format(response.url, response.status))
         self.logger.info("Output: {}".format(self.settings.get('OUTPUT_NAME')))
+        self.logger.info("Extraction: {}".format(self.plan))
         yield self.parse_item(response)  # Simply yield the response to our main function
+        yield from self.follow_previous_links(response)
+        if self.sitemaps:
+            yield from self.sitemap_requests(response)
 
     def parse_url(self, response):
         """
         Re-writed to add a few controls.
         """
-        # Prevents from re-crawling start URL (ugly but works ...)
-        if response.url != self.start_urls[0]:
+        # Prevents from re-crawling start URLs (ugly but works ...)
+        if response.url not in self.start_urls:
             # Respect max depth setting, as Scrapy internal setting doesn't seem to work
-            if response.meta.get('depth', 0) < (self.depth + 1):
+            # Pages only found in sitemaps have no depth
+            if response.meta.get('sitemap') or response.meta.get('depth', 0) < (self.depth_limit(response.url) + 1):
                 yield self.parse_item(response)
+        yield from self.follow_previous_links(response)
 
-    def process_links(self, response):
-        content = response.body
-        page_url = response.url
-
-        tree = lxml.html.fromstring(content)
-
-        def search_count(search_list, dom_html):
-            return sum(1 for search in search_list if search.dom_path.replace('.', '/') == dom_html)
-
-        def links_density_real(text, chars_count):
-            text_length = len(text)
-            if text_length == 0:
-                return 0
-            return chars_count / text_length
-
-        def clean_text(array):
-            clean_arr = []
-            regex = r"[^a-zA-Z0-9'?! ]+"
-            subst = ""
-            for string in array:
-                string = string.replace('\t', '').replace('\r', '').replace('\n', '')
-                result = re.sub(regex, subst, string, 0, re.MULTILINE)
-                if result:
-                    clean_arr.append(result)
-            return clean_arr
-
-        def extract_text_from_html(html):
-            soup = BeautifulSoup(html, 'lxml')
-            text = soup.get_text(separator=' ')
-            return text
-
-        def detect_language(text):
-            return detect(text)
-
-        def iso_639_1_to_language_name(iso_code):
-            language = pycountry.languages.get(alpha_2=iso_code)
-            if language:
-                return language.name
-            else:
-                return None
-
-        text = extract_text_from_html(content)
-
-        language = detect_language(text)
-        language_name = iso_639_1_to_language_name(language)
-
-        paragraphs = justext.justext(content, justext.get_stoplist(language_name))
-        links_info = []
-        dom_arr = []
-        links_url = []
-        max = len(paragraphs)
-        c = 0
-
-        all_hrefs = []
-        for href in tree.xpath("//a/@href"):
-            all_hrefs.append(href)
-        all_hrefs = list(set(all_hrefs))
-
-        for paragraph in paragraphs:
-            c += 1
-            dom = paragraph.dom_path.replace('.', '/')
-            text1 = tree.xpath("//" + dom + "/a")
-            if len(text1) > 0:
-                density = paragraph.links_density()
-
-                def link_chars():
-                    return paragraph.chars_count_in_links
-
-                stopwords_density = paragraph.stopwords_density(justext.get_stoplist(language_name))
-                weight_pos = 1 - c / max
-
-                dom = paragraph.dom_path.replace('.', '/')
-                count = dom_arr.count(dom)
-                dom_arr.append(dom)
-                url = tree.xpath("//" + dom + "/a/@href")
-
-                url_text = tree.xpath("//" + dom + "/a//text()")
-                len_links = 9999999999
-
-                weight = (density - stopwords_density) - weight_pos
-                if weight == 1.0 and count < len(url_text):
-                    len_links = len(url_text[count])
-
-                if count < len(url):
-                    count_real = search_count(paragraphs, dom)
-                    count_url = links_url.count(url[count])
-
-                    if count_url == 0:
-                        links_info.append([weight, url[count], len_links])
-                    elif count_real < len(url) and count_real < len(clean_text(url_text)):
-                        len_links_real = len(clean_text(url_text)[count_real])
-                        weight_real = links_density_real(paragraph.text,
-                                                         link_chars()) - stopwords_density - weight_pos
-                        links_info.append([weight_real, url[count_real], 9999999999])
-                    links_url.append(url[count])
-
-                else:
-                    if count < len(url):
-                        count_real = search_count(paragraphs, dom)
-                        count_url = links_url.count(url[count])
-
-                        if count_url == 0:
-                            links_info.append([weight, url[count], len_links])
-                        elif count_real < len(url) and count_real < len(clean_text(url_text)):
-                            # len_links_real = len(clean_text(url_text)[count_real])
-                            weight_real = links_density_real(paragraph.text,
-                                                             link_chars()) - stopwords_density - weight_pos
-                            links_info.append([weight_real, url[count_real], 9999999999])
-                        links_url.append(url[count])
-
-        missing_links = [href for href in all_hrefs if href not in [info[1] for info in links_info]]
-
-        for link in missing_links:
-            c += 1
-            weight_pos = 1 - c / max
-            links_info.append([weight_pos, link, 9999999999])
-
-        links_sorted = sorted(links_info, key=lambda d: d[0], reverse=False)
-        links_len_sorted = sorted(links_sorted, key=lambda d: d[2], reverse=True)
-
-        link_weights = {}
-        c = 0
-        for reason in links_len_sorted:
-            link_weights[reason[1]] = 1 - c / max
-            c += 1
-
-        return link_weights
+    def sitemap_requests(self, response):
+        """
+        Requests the sitemaps listed in robots.txt, `/sitemap.xml` if there is none.
+        The robots.txt of the start URL is known once it is crawled.
+        """
+        origin = robots_origin(response.url)
+        urls = self.robots.sitemaps(origin) or [origin + '/sitemap.xml']
+        for url in urls:
+            yield scrapy.Request(url, callback=self.parse_sitemap, priority=self.sitemap_priority,
+                                     meta={'sitemap_file': True})
+
+    def parse_sitemap(self, response):
+        """
+        Streams a sitemap or sitemap index: child sitemaps are requested, pages are
+        scheduled like links, without going through the dupefilter yet.
+        """
+        if response.status != 200:
+            self.logger.info("Sitemap not available: {} ({})".format(response.url, response.status))
+            return
+        self.crawler.stats.inc_value('sitemap/sitemaps')
+        rule = self._rules[0]
+        for kind, url in iter_sitemap(response.body):
+            if kind == 'sitemap':
+                yield scrapy.Request(url, callback=self.parse_sitemap, priority=self.sitemap_priority,
+                                     meta={'sitemap_file': True})
+            elif rule.link_extractor.matches(url) and self.same_site(url, response.url):
+                self.crawler.stats.inc_value('sitemap/urls')
+                request = self._build_request(0, Link(url))
+                request.meta['sitemap'] = True
+                yield request.replace(priority=self.sitemap_priority, dont_filter=True)
+
+    def not_modified(self, response):
+        return response.status == 304 and self.previous is not None and response.url in self.previous
+
+    def follow_previous_links(self, response):
+        """
+        A 304 Not Modified response has no body for the rules to extract links from,
+        follows the page's links from the previous crawl instead.
+        """
+        if not self.not_modified(response):
+            return
+        rule = self._rules[0]
+        for link in self.previous.fields(response.url)['outlinks']:
+            if rule.link_extractor.matches(link['target']) and self.same_site(link['target'], response.url):
+                request = self._build_request(0, Link(link['target'], text=link['text']))
+                if self.frontier == 'best-first':
+                    request.meta['link_weight'] = link.get('weight', 0)
+                yield request
+
+    def _requests_to_follow(self, response):
+        """
+        Drops links to the other sites of a multi-site crawl.
+        Best-first frontier: adds the weight of each followed link to its request,
+        from the reasonable surfer when the page's links were just extracted,
+        from the link position otherwise.
+        """
+        requests = super()._requests_to_follow(response)
+        if len(self.sites) > 1:
+            site = self.site_of(response.url)
+            requests = (r for r in requests if r is None or self.site_of(r.url) == site)
+        if self.frontier != 'best-first':
+            yield from requests
+            return
+        weights = response.meta.pop('page_link_weights', None)  # Set by `complete_page`
+        requests = [r for r in requests if r is not None]  # Dropped by the rule's `process_request`
+        if weights is None:
+            weights = position_weights([r.url for r in requests])
+        for request in requests:
+            request.meta['link_weight'] = weights.get(request.url, 0)
+            yield request
 
     def parse_item(self, response):
         """
         Main function, parses response and extracts data.  
         """
         self.logger.info("{} ({})".format(response.url, response.status))
-        link_weights = self.process_links(response)
         i = CrowlItem()
         i['url'] = response.url
         i['response_code'] = response.status
         i['level'] = response.meta.get('depth', 0)
+        if response.meta.get('sitemap'):  # In a sitemap, not linked from crawled pages yet, see `decide_orphans`
+            i['orphan'] = True
+            i['level'] = -1
         i['latency'] = response.meta.get('download_latency')
         i['crawled_at'] = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%z')
         i['size'] = len(response.body)
@@ -244,148 +310,52 @@ class Crowler(CrawlSpider):
         dat = response.headers.get('date', None)
         if dat:  # date from HTTP headers
             i['http_date'] = dat.decode('utf-8')
+        etag = response.headers.get('ETag', None)
+        if etag:  # Validators, for incremental crawls
+            i['etag'] = etag.decode('utf-8')
+        modified = response.headers.get('Last-Modified', None)
+        if modified:
+            i['last_modified'] = modified.decode('utf-8')
         cach = response.headers.get('x-cache', None)
         if cach:  # x-cache header
             i['x_cache'] = cach.decode('utf-8')
-        if self.store_request_headers:
+        if self.plan.request_headers:
             i['request_headers'] = json.dumps(response.request.headers.to_unicode_dict())
-        if self.store_response_headers:
+        if self.plan.response_headers:
             i['response_headers'] = json.dumps(response.headers.to_unicode_dict())
 
-        if response.status == 200:  # Data only available for 200 OK urls
-            # `extract_first(default='None')` returns 'None' if empty, prevents errors
-            i['nb_title'] = len(response.xpath('//title').extract())
-            i['title'] = response.xpath('//title/text()').extract_first(default='None').strip()
-            i['meta_description'] = response.xpath('//meta[@name=\'description\']/@content').extract_first(
-                default='None').strip()
-            i['meta_viewport'] = response.xpath('//meta[@name=\'viewport\']/@content').extract_first(
-                default='None').strip()
-            i['meta_keywords'] = response.xpath('//meta[@name=\'keywords\']/@content').extract_first(
-                default='None').strip()
-            i['nb_meta_robots'] = len(response.xpath('//meta[@name=\'robots\']').extract())
-            i['meta_robots'] = response.xpath('//meta[@name=\'robots\']/@content').extract_first(default='None').strip()
-            i['nb_h1'] = len(response.xpath('//h1').extract())
-            h1 = ''.join(response.xpath('//h1[1]//text()').extract())
-            if len(h1) > 0:
-                i['h1'] = h1
+        if response.status == 200 and isinstance(response, TextResponse):  # Data only available for 200 OK urls
+            digest = None
+            fields = None
+            if self.fingerprints is not None:
+                digest = content_hash(response.body)
+                duplicate_of, exact = self.fingerprints.add(response.url, digest, response.text)
+                if duplicate_of is not None:
+                    i['duplicate_of'] = duplicate_of
+                    self.crawler.stats.inc_value('duplicates/exact' if exact else 'duplicates/near')
+                if exact:
+                    fields = self.fingerprints.fields(digest)
+            if fields is not None:
+                # Same body as a page already extracted, URL dependent fields are extracted again
+                self.crawler.stats.inc_value('duplicates/reused')
+                self.complete_page(i, self.extractor.relocate(response, fields), response.meta)
+            elif self.extraction_pool is not None:
+                # Extracted in a worker process, `CrowlExtractionPipeline` completes the item
+                d = self.extraction_pool.submit(response)
+                if digest is not None:
+                    d.addCallback(self.store_fields, digest)
+                self.pending_items[id(i)] = d
             else:
-                i['h1'] = 'None'
-
-            i['nb_h2'] = len(response.xpath('//h2').extract())
-            i['canonical'] = response.xpath('//link[@rel=\'canonical\']/@href').extract_first(default='None').strip()
-            i['prev'] = response.xpath('//link[@rel="prev"]/@href').extract_first(default='None').strip()
-            i['next'] = response.xpath('//link[@rel="next"]/@href').extract_first(default='None').strip()
-            i['html_lang'] = response.xpath('//html/@lang').extract_first(default='None').strip()
-            hreflangs = response.xpath('//link[@hreflang]')
-            if hreflangs:
-                res = list()
-                for index, hreflang in enumerate(hreflangs):
-                    res.append({
-                        'lang': hreflang.xpath('@hreflang').extract_first(default='None').strip(),
-                        'rel': hreflang.xpath('@rel').extract_first(default='None').strip(),
-                        'href': hreflang.xpath('@href').extract_first(default='None').strip(),
-                    })
-                i['hreflangs'] = json.dumps(res)
-            else:
-                i['hreflangs'] = 'None'
-
-            # Word Count
-            try:
-                body_content = response.xpath('//body').extract()[0]
-            except IndexError as e:
-                body_content = ""
-
-            content_text = w3lib.html.remove_tags_with_content(body_content, which_ones=('style', 'script'))
-            content_text = w3lib.html.remove_tags(content_text)
-            i['wordcount'] = len(re.split('[\s\t\n, ]+', content_text, flags=re.UNICODE))
-
-            if self.check_lang:  # Should we check content language ?
-                content_text = content_text.replace('\n', '')
-                content_text = content_text.replace('\r', '')
-                try:
-                    detected_lang = detect(content_text)
-                    i['content_lang'] = detected_lang
-                except:
-                    i['content_lang'] = "unknown"
-
-            if self.content:  # Should we store content ?
-                my_tree = html.fromstring(response.body.decode(response.encoding))
-                i['content'] = extract(my_tree, 'no_fallback=True', 'include_comments=False', 'include_tables=False',
-                                       'favor_precision=True')
-            if self.links:  # Should we store links ?
-                outlinks = list()
-                links = LinkExtractor(unique=self.links_unique).extract_links(response)
-                missing_links = [link.url for link in links if link.url not in link_weights]
-                c = 0
-                max_links = len(links)
-                for link in links:
-                    lien = dict()
-                    # Check if target is forbidden by robots.txt
-                    if not self.robots.allowed(link.url, "*") and is_internal(link.url, response.url):
-                        lien['disallow'] = True
-                    # Check if X-Robots-Tag nofollow
-                    if 'nofollow' in response.headers.getlist('X-Robots-Tag'):
-                        lien['nofollow'] = True
-                        # Check if meta robots nofollow
-                    if response.xpath('//meta[@name="robots"]/@content[contains(text(),"nofollow")]'):
-                        lien['nofollow'] = True
-                    # Check if link nofollow
-                    if link.nofollow:
-                        lien['nofollow'] = True
-
-                    if self.surfer == 'advanced':
-                        lien['text'] = str.strip(link.text)
-                        lien['source'] = response.url
-                        lien['target'] = link.url
-                        weight = link_weights.get(link.url, 1 - c / max_links)
-                        lien['weight'] = max(weight, 0)
-
-                    elif self.surfer == 'basic':
-                        lien['text'] = str.strip(link.text)
-                        lien['source'] = response.url
-                        lien['target'] = link.url
-                        weight = 1 - c / max_links
-                        lien['weight'] = max(weight, 0)
-
-                    self.graph_edges.append((response.url, link.url, lien['weight']))
-
-                    c = c + 1
-                    outlinks.append(lien)
-
-                i['outlinks'] = outlinks
-
-            self.calculate_page_rank()
-            i['pagerank'] = self.pageranks.get(response.url, 0)
-
-            # Microdata
-            base_url = w3lib.html.get_base_url(response.text, response.url)
-            data = []
-            try:
-                data = extruct.extract(response.text, base_url=base_url, syntaxes=['microdata', 'json-ld'],
-                                       uniform=True)
-                for key in list(data):
-                    if len(data[key]) == 0:
-                        data.pop(key, None)
-            except Exception as e:
-                pass
-            if len(data) > 0:
-                i["microdata"] = json.dumps(data, ensure_ascii=False)
-
-            if self.extractors:
-                extracted = list()
-                for ext in self.extractors:
-                    if ext["type"] == "xpath":
-                        extracted.append({
-                            'name': ext["name"],
-                            'data': response.xpath(ext["pattern"]).extract_first(default='None').strip()
-                        })
-                    else:
-                        extracted.append({
-                            'name': ext["name"],
-                            'data': "Error: extractor type '{}' not supported.".format(ext["type"])
-                        })
-
-                i["extractors"] = json.dumps(extracted, ensure_ascii=False)
+                self.complete_page(i, self.store_fields(self.extractor.extract(response), digest), response.meta)
+
+        elif self.not_modified(response):
+            # Unchanged since the previous crawl, its extracted data is carried forward
+            self.crawler.stats.inc_value('incremental/not_modified')
+            fields = self.previous.fields(response.url)
+            for key in ('etag', 'last_modified'):  # Validators may be refreshed by a 304
+                if key in i:
+                    fields.pop(key, None)
+            self.complete_page(i, fields)
 
         elif 300 < response.status < 400:
             loc = response.headers.get('location', None)
@@ -394,14 +364,133 @@ class Crowler(CrawlSpider):
 
         return i
 
+    def store_fields(self, fields, digest):
+        """
+        Caches the fields extracted from a page for its exact duplicates.
+        Returns the fields.
+        """
+        if digest is not None:
+            self.fingerprints.store(digest, fields)
+        return fields
+
+    def complete_page(self, i, fields, meta=None):
+        """
+        Adds extracted fields to an item, then updates crawl state: robots.txt
+        flags, link graph and PageRank.
+
+        Arguments:
+        - i: item of the page
+        - fields: fields extracted from the page
+        - meta: meta of the response, surfer weights of the links are kept there for
+          `_requests_to_follow`. None when extracted in a worker process: links are
+          followed before the page is extracted
+        """
+        outlinks = fields.pop('outlinks', None)
+        fields.pop('link_context', None)
+        i.update(fields)
+        if outlinks is not None:
+            source = i['url']
+            if meta is not None and self.frontier == 'best-first' and self.plan.link_weights:
+                weights = dict()
+                for lien in outlinks:
+                    weights[lien['target']] = max(lien['weight'], weights.get(lien['target'], 0))
+                meta['page_link_weights'] = weights
+            origin = url_origin(source)  # Page level, computed once
+            for lien in outlinks:
+                target = lien['target']
+                # Check if target is forbidden by robots.txt, internal targets share the page's robots.txt
+                if url_origin(target) == origin and self.robots.allowed(target, "*") is False:
+                    lien['disallow'] = True
+                self.graph.add_edge(source, target, lien['weight'])
+            i['outlinks'] = outlinks
+            if time.time() - self.last_memory_stats >= MEMORY_STATS_INTERVAL:
+                self.record_memory_stats(log=True)
+            elif len(self.graph.segments) != self.spilled_segments:
+                self.record_memory_stats()
+            if self.graph_dir is not None and self.checkpoint_interval \
+                    and time.time() - self.last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+
+        if self.pagerank_mode not in ('final', 'merged'):
+            if self.plan.pagerank:
+                self.pagerank.page_added()
+            i['pagerank'] = self.pagerank.get(i['url'])
+        return i
+
+    def complete_item(self, item):
+        """
+        Waits for the worker process extracting an item, see `CrowlExtractionPipeline`.
+        Returns the item, or a Deferred firing with it.
+        """
+        d = self.pending_items.pop(id(item), None)
+        if d is None:
+            return item
+
+        def failed(failure):
+            self.logger.error("Extraction failed for {}: {}".format(item['url'], failure.value))
+            self.crawler.stats.inc_value('extraction/errors')
+            return item
+
+        d.addCallbacks(lambda fields: self.complete_page(item, fields), failed)
+        return d
+
+    def record_cache_stats(self):
+        """
+        Adds robots.txt verdict and URL parsing cache hit rates to Scrapy stats.
+        """
+        stats = self.crawler.stats
+        origins = url_origin.cache_info()
+        for name, hits, misses in (('robotstxt/verdict_cache', self.robots.hits, self.robots.misses),
+                                   ('urls/origin_cache', origins.hits, origins.misses)):
+            stats.set_value(name + '/hits', hits)
+            stats.set_value(name + '/misses', misses)
+            if hits + misses:
+                stats.set_value(name + '/hit_rate', round(hits / (hits + misses), 4))
+
+    def checkpoint(self):
+        """
+        Saves the link graph and PageRank scores in JOBDIR.
+        """
+        self.pagerank.checkpoint(self.graph_dir)
+        self.last_checkpoint = time.time()
+        self.crawler.stats.inc_value('graph/checkpoints')
+
+    def record_memory_stats(self, log=False):
+        """
+        Adds process memory and link graph spilling to Scrapy stats, logs them with `log`.
+        """
+        stats = self.crawler.stats
+        rss, peak = memory_usage()
+        if rss is not None:
+            stats.set_value('memory/rss', rss)
+            stats.max_value('memory/peak_rss', peak)
+        if log:
+            self.last_memory_stats = time.time()
+            if rss is not None:
+                self.logger.info("Memory: {:.0f} MB (peak {:.0f} MB), link graph: {} urls, {:.0f} MB of links in "
+                                 "memory, {} spilled".format(rss / 2 ** 20, peak / 2 ** 20, self.graph.node_count(),
+                                                             self.graph.nbytes() / 2 ** 20, self.graph.spilled))
+        self.spilled_segments = len(self.graph.segments)
+        stats.set_value('graph/edges', len(self.graph))
+        stats.set_value('graph/memory_bytes', self.graph.nbytes())
+        if self.graph.segments:
+            stats.set_value('graph/spilled_edges', self.graph.spilled)
+            stats.set_value('graph/segments', len(self.graph.segments))
+
     def closed(self, reason):
+        if self.extraction_pool is not None:
+            self.extraction_pool.close()
+        if self.replay is not None:
+            self.replay.close()
+        # Exact PageRank over the full graph
+        if self.pagerank_mode != 'merged':
+            self.pagerank.compute()
+        if self.graph_dir is not None:
+            self.checkpoint()
+        if self.fingerprints is not None and self.fingerprints_path is not None:
+            self.fingerprints.save(self.fingerprints_path)
+        self.record_cache_stats()
+        self.record_memory_stats(log=True)
+        self.logger.info("PageRank computed for {} urls ({} links)".format(self.graph.node_count(), len(self.graph)))
         self.logger.info("Output: {}".format(self.settings.get('OUTPUT_NAME')))
         self.logger.info("Spider closed")
-
-    def calculate_page_rank(self):
-        # Creation of graph with links and weights
-        g = Graph.TupleList(edges=self.graph_edges, directed=True, weights=True)
-        page_rank = g.pagerank(weights=g.es["weight"])
-
-        # Update global dictionary with new PageRanks
-        self.pageranks.update(dict(zip(g.vs["name"], page_rank)))
@@ -0,0 +1,291 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.misc import load_object
+
+SEGMENT_SIZE = 256 * 1024 * 1024  # Segments roll over above 256 MiB
+COMPRESSION_LEVEL = 6
+RECORD_HEADER = struct.Struct('>QI')  # url hash, compressed length
+INDEX_ENTRY = struct.Struct('>QHQIBH')  # url hash, segment, offset, length, robots.txt ?, url length
+META_LENGTH = struct.Struct('>I')
+
+
+def url_hash(url):
+    """
+    Returns a 64 bits hash of a URL, used as index key.
+    """
+    return int.from_bytes(hashlib.sha1(url.encode('utf-8')).digest()[:8], 'big')
+
+
+def encode_headers(headers):
+    # Header bytes are kept as is, latin-1 maps each byte to a character
+    return [[k.decode('latin-1'), [v.decode('latin-1') for v in values]] for k, values in headers.items()]
+
+
+def decode_headers(headers):
+    return Headers({k.encode('latin-1'): [v.encode('latin-1') for v in values] for k, values in headers})
+
+
+class ResponseStore:
+    """
+    Append-only store of compressed responses, for offline re-extraction (`--replay`).
+    Records are appended to numbered segment files; an index maps URL hashes to
+    `(segment, offset, length)` and keeps URLs, so listing them doesn't read records.
+    A URL is stored once, like the spider parses it once: later responses (a start URL
+    linked again) are not written.
+
+    Arguments:
+    - path: store directory
+    - segment_size: size above which a new segment is started, in bytes
+    """
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self.index = dict()  # url hash -> (segment, offset, length, robots.txt ?, url), insertion ordered
+        self.writer = None
+        self.index_file = None
+        self.segment = None
+        self.segment_files = dict()  # Segments opened for reading
+        if os.path.isdir(path):
+            self.load_index()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, 'segment-{:05d}.dat'.format(segment))
+
+    def segments(self):
+        names = [n for n in os.listdir(self.path) if n.startswith('segment-') and n.endswith('.dat')]
+        return sorted(int(n[8:13]) for n in names)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return url_hash(url) in self.index
+
+    def load_index(self):
+        """
+        Reads the index, or rebuilds it from the segments if it is missing.
+        """
+        index_path = os.path.join(self.path, 'index')
+        if not os.path.exists(index_path):
+            self.scan()
+            return
+        with open(index_path, 'rb') as f:
+            while True:
+                entry = f.read(INDEX_ENTRY.size)
+                if len(entry) < INDEX_ENTRY.size:
+                    break
+                key, segment, offset, length, robots, url_length = INDEX_ENTRY.unpack(entry)
+                url = f.read(url_length)
+                if len(url) < url_length:  # Truncated by an interrupted crawl
+                    break
+                self.index.setdefault(key, (segment, offset, length, bool(robots), url.decode('utf-8')))
+
+    def scan(self):
+        """
+        Rebuilds the index by reading every record of every segment.
+        """
+        for segment in self.segments():
+            with open(self.segment_path(segment), 'rb') as f:
+                offset = 0
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    key, length = RECORD_HEADER.unpack(header)
+                    if key not in self.index:
+                        meta, _ = self.read((segment, offset, length))
+                        self.index[key] = (segment, offset, length, meta.get('robots', False), meta['url'])
+                    offset += RECORD_HEADER.size + length
+                    f.seek(offset)
+
+    # Writing
+
+    def open_segment(self):
+        os.makedirs(self.path, exist_ok=True)
+        existing = self.segments()
+        self.segment = existing[-1] + 1 if existing else 0  # Never appends to an older segment
+        self.writer = open(self.segment_path(self.segment), 'ab')
+        if self.index_file is None:
+            self.index_file = open(os.path.join(self.path, 'index'), 'ab')
+
+    def put(self, meta, body):
+        """
+        Appends a record, unless the URL is already stored.
+        Returns the number of bytes written.
+
+        Arguments:
+        - meta: JSON-serializable dict, with at least a `url` key
+        - body: response body, bytes
+        """
+        key = url_hash(meta['url'])
+        if key in self.index:
+            return 0
+        if self.writer is None or self.writer.tell() >= self.segment_size:
+            if self.writer is not None:
+                self.writer.close()
+            self.open_segment()
+        url = meta['url']
+        robots = bool(meta.get('robots'))
+        meta = json.dumps(meta).encode('utf-8')
+        payload = zlib.compress(META_LENGTH.pack(len(meta)) + meta + body, COMPRESSION_LEVEL)
+        offset = self.writer.tell()
+        self.writer.write(RECORD_HEADER.pack(key, len(payload)))
+        self.writer.write(payload)
+        encoded_url = url.encode('utf-8')[:65535]
+        self.index_file.write(INDEX_ENTRY.pack(key, self.segment, offset, len(payload), robots, len(encoded_url)))
+        self.index_file.write(encoded_url)
+        self.index[key] = (self.segment, offset, len(payload), robots, url)
+        return RECORD_HEADER.size + len(payload)
+
+    def put_response(self, response, request):
+        """
+        Appends a Scrapy response and the request state needed to parse it again.
+        Returns the number of bytes written.
+        """
+        meta = {
+            'url': response.url,
+            'status': response.status,
+            'headers': encode_headers(response.headers),
+            'class': '{}.{}'.format(response.__class__.__module__, response.__class__.__name__),
+            'encoding': getattr(response, 'encoding', None),
+            'request_headers': encode_headers(request.headers),
+            'depth': request.meta.get('depth', 0),
+            'download_latency': request.meta.get('download_latency'),
+            'robots': bool(request.meta.get('dont_obey_robotstxt')),  # Fetched by `CrowlRobotsMiddleware`
+            'sitemap': bool(request.meta.get('sitemap')),  # Page only found in a sitemap
+            'sitemap_file': bool(request.meta.get('sitemap_file')),
+        }
+        return self.put(meta, response.body)
+
+    # Reading
+
+    def read(self, location):
+        segment, offset, length = location[:3]
+        f = self.segment_files.get(segment)
+        if f is None:
+            f = self.segment_files[segment] = open(self.segment_path(segment), 'rb')
+        f.seek(offset + RECORD_HEADER.size)
+        payload = zlib.decompress(f.read(length))
+        meta_length = META_LENGTH.unpack_from(payload)[0]
+        start = META_LENGTH.size
+        meta = json.loads(payload[start:start + meta_length].decode('utf-8'))
+        return meta, payload[start + meta_length:]
+
+    def get(self, url):
+        """
+        Returns `(meta, body)` of a URL, None if not stored.
+        """
+        location = self.index.get(url_hash(url))
+        if location is None:
+            return None
+        if self.writer is not None:
+            self.writer.flush()
+        meta, body = self.read(location)
+        if meta['url'] != url:  # Hash collision
+            return None
+        return meta, body
+
+    def urls(self, robots=False):
+        """
+        Yields stored URLs in crawl order, without robots.txt fetched for rules unless `robots` is set.
+        """
+        for location in list(self.index.values()):
+            if robots or not location[3]:
+                yield location[4]
+
+    def response(self, url, request=None):
+        """
+        Rebuilds a stored response, None if not stored.
+        """
+        record = self.get(url)
+        if record is None:
+            return None
+        meta, body = record
+        try:
+            cls = load_object(meta['class'])
+        except (ImportError, NameError, ValueError):
+            cls = responsetypes.from_args(headers=decode_headers(meta['headers']), url=url, body=body)
+        kwargs = dict(url=url, status=meta['status'], headers=decode_headers(meta['headers']), body=body,
+                      request=request)
+        if meta.get('encoding'):
+            kwargs['encoding'] = meta['encoding']
+        response = cls(**kwargs)
+        return response, meta
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+        for f in self.segment_files.values():
+            f.close()
+        self.segment_files = dict()
+
+
+class CrowlResponseStoreExtension:
+    """
+    Stores every response the spider receives ([CRAWLER] STORE_RESPONSES), so the
+    crawl can be extracted again offline with `--replay`.
+    """
+    def __init__(self, crawler, path, segment_size):
+        self.stats = crawler.stats
+        self.store = ResponseStore(path, segment_size=segment_size)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('STORE_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(crawler, path, crawler.settings.getint('STORE_SEGMENT_SIZE', SEGMENT_SIZE))
+
+    def response_received(self, response, request, spider):
+        size = self.store.put_response(response, request)
+        if size:
+            self.stats.inc_value('store/records')
+            self.stats.inc_value('store/bytes', size)
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+class CrowlReplayMiddleware:
+    """
+    Serves responses from the spider's `ResponseStore` instead of the network (`--replay`).
+    Requests restore the state of the original crawl: depth, latency, request headers
+    and sitemap flags.
+    Runs after `CrowlRobotsMiddleware`, stored robots.txt are replayed too.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_request(self, request, spider):
+        stored = spider.replay.response(request.url, request=request)
+        if stored is None:
+            self.stats.inc_value('replay/missing')
+            raise IgnoreRequest("Not in response store: {}".format(request.url))
+        response, meta = stored
+        if not request.meta.get('dont_obey_robotstxt'):
+            request.meta['depth'] = meta.get('depth', 0)
+            request.meta['download_latency'] = meta.get('download_latency')
+            request.headers.clear()
+            request.headers.update(decode_headers(meta['request_headers']))
+            for key in ('sitemap', 'sitemap_file'):
+                if meta.get(key):
+                    request.meta[key] = True
+        self.stats.inc_value('replay/responses')
+        return response
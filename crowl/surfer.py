@@ -0,0 +1,121 @@
+import re
+from collections import Counter
+from lxml import etree
+
+NO_LENGTH = 9999999999  # Sorts first: links without a measured anchor length
+CLEAN_REGEX = re.compile(r"[^a-zA-Z0-9'?! ]+", re.MULTILINE)
+ANCHOR_TEXT = etree.XPath(".//text()")
+
+
+def clean_text(array):
+    """
+    Strips anchor texts down to alphanumerics, drops empty results.
+    """
+    clean_arr = []
+    for string in array:
+        string = string.replace('\t', '').replace('\r', '').replace('\n', '')
+        result = CLEAN_REGEX.sub("", string)
+        if result:
+            clean_arr.append(result)
+    return clean_arr
+
+
+def links_density_real(text, chars_count):
+    text_length = len(text)
+    if text_length == 0:
+        return 0
+    return chars_count / text_length
+
+
+class DomAnchors:
+    """
+    Anchors found under one paragraph DOM path, evaluated once per page.
+    """
+    def __init__(self, tree, dom):
+        anchors = tree.xpath("//" + dom + "/a")
+        self.count = len(anchors)
+        self.hrefs = [a.get('href') for a in anchors if a.get('href') is not None]
+        self.texts = [text for a in anchors for text in ANCHOR_TEXT(a)]
+        self._clean_count = None
+
+    @property
+    def clean_count(self):
+        if self._clean_count is None:
+            self._clean_count = len(clean_text(self.texts))
+        return self._clean_count
+
+
+def link_weights(tree, paragraphs, stoplist):
+    """
+    Reasonable surfer: weights each link of a page from the justext paragraph it
+    belongs to (link density, stopwords density, position in the page).
+    Returns a dict of href -> weight, from the link position only on pages without paragraphs.
+
+    Arguments:
+    - tree: lxml tree of the page
+    - paragraphs: justext paragraphs of the page
+    - stoplist: stopwords used to segment the page
+    """
+    links_info = []
+    max = len(paragraphs)
+    c = 0
+
+    all_hrefs = list(dict.fromkeys(tree.xpath("//a/@href")))  # Document order: set order varies across processes
+    if not paragraphs:
+        # No text justext could segment (image-only navigation...): link position only
+        return {href: 1 - c / len(all_hrefs) for c, href in enumerate(all_hrefs)}
+
+    doms = [paragraph.dom_path.replace('.', '/') for paragraph in paragraphs]
+    dom_total = Counter(doms)  # Number of paragraphs sharing a DOM path
+    dom_seen = Counter()  # Number of link paragraphs already seen for a DOM path
+    dom_anchors = dict()
+    links_url = set()
+
+    for paragraph, dom in zip(paragraphs, doms):
+        c += 1
+        anchors = dom_anchors.get(dom)
+        if anchors is None:
+            anchors = dom_anchors[dom] = DomAnchors(tree, dom)
+        if anchors.count == 0:
+            continue
+
+        stopwords_density = paragraph.stopwords_density(stoplist)
+        weight_pos = 1 - c / max
+        count = dom_seen[dom]
+        dom_seen[dom] += 1
+        url = anchors.hrefs
+        url_text = anchors.texts
+
+        len_links = NO_LENGTH
+        weight = (paragraph.links_density() - stopwords_density) - weight_pos
+        if weight == 1.0 and count < len(url_text):
+            len_links = len(url_text[count])
+
+        if count < len(url):
+            count_real = dom_total[dom]
+            if url[count] not in links_url:
+                links_info.append([weight, url[count], len_links])
+            elif count_real < len(url) and count_real < anchors.clean_count:
+                weight_real = links_density_real(paragraph.text,
+                                                 paragraph.chars_count_in_links) - stopwords_density - weight_pos
+                links_info.append([weight_real, url[count_real], NO_LENGTH])
+            links_url.add(url[count])
+
+    # Links outside of any paragraph are weighted by position only
+    weighted = set(info[1] for info in links_info)
+    for link in all_hrefs:
+        if link not in weighted:
+            c += 1
+            weight_pos = 1 - c / max
+            links_info.append([weight_pos, link, NO_LENGTH])
+
+    links_sorted = sorted(links_info, key=lambda d: d[0], reverse=False)
+    links_len_sorted = sorted(links_sorted, key=lambda d: d[2], reverse=True)
+
+    weights = {}
+    c = 0
+    for reason in links_len_sorted:
+        weights[reason[1]] = 1 - c / max
+        c += 1
+
+    return weights
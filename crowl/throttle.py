@@ -0,0 +1,171 @@
+import time
+import logging
+
+HISTORY_SIZE = 200  # Decisions kept in stats
+BASELINE_WEIGHT = 0.2  # Weight of the last window in the usual latency of a host
+BACKOFF_STATUSES = (429, 503)
+
+logger = logging.getLogger(__name__)
+
+
+class SlotWindow:
+    """
+    Responses of a download slot (a host) since its last adjustment.
+    Server errors (5xx but backoff statuses) and download errors only count in
+    `errors`, the error rate is `errors / (responses + errors)`.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.responses = 0  # Responses but server errors, backoffs included
+        self.errors = 0
+        self.backoffs = 0
+        self.latency = 0.0
+        self.retry_after = 0.0
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.responses / elapsed if elapsed > 0 else 0.0
+
+
+class CrowlAdaptiveThrottle:
+    """
+    Adjusts concurrency and delay of each host from what the crawl observes
+    ([CRAWLER] ADAPTIVE_THROTTLE), within configured bounds.
+
+    Every `window` responses of a host:
+    - 429 / 503 responses or an error rate above `max_error_rate`: concurrency is
+      halved and delay doubled (or set from `Retry-After`)
+    - mean latency above `latency_factor` times the usual latency of the host:
+      one request less, or a longer delay once at `min_concurrency`
+    - otherwise: delay halved, or one request more once at `min_delay`
+
+    Decisions are recorded in stats under `adaptive/`.
+    """
+    def __init__(self, crawler, min_concurrency=1, max_concurrency=16, min_delay=0.0, max_delay=10.0,
+                 window=20, latency_factor=2.0, max_error_rate=0.1):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.windows = dict()  # slot -> SlotWindow
+        self.baselines = dict()  # slot -> moving average of latency
+        self.history = list()
+        self.started = time.time()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        return cls(crawler,
+                   min_concurrency=s.getint('ADAPTIVE_MIN_CONCURRENCY', 1),
+                   max_concurrency=s.getint('ADAPTIVE_MAX_CONCURRENCY', 16),
+                   min_delay=s.getfloat('ADAPTIVE_MIN_DELAY', 0.0),
+                   max_delay=s.getfloat('ADAPTIVE_MAX_DELAY', 10.0),
+                   window=s.getint('ADAPTIVE_WINDOW', 20),
+                   latency_factor=s.getfloat('ADAPTIVE_LATENCY_FACTOR', 2.0),
+                   max_error_rate=s.getfloat('ADAPTIVE_MAX_ERROR_RATE', 0.1))
+
+    def get_slot(self, request):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        return key, slot
+
+    def get_window(self, key):
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = SlotWindow()
+        return window
+
+    def process_response(self, request, response, spider):
+        key, slot = self.get_slot(request)
+        if slot is None:
+            return response
+        window = self.get_window(key)
+        if response.status >= 500 and response.status not in BACKOFF_STATUSES:
+            window.errors += 1
+        else:
+            window.responses += 1
+            window.latency += request.meta.get('download_latency') or 0.0
+            if response.status in BACKOFF_STATUSES:
+                window.backoffs += 1
+                window.retry_after = max(window.retry_after, retry_after(response))
+        if window.responses + window.errors >= self.window:
+            self.adjust(key, slot, window)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key, slot = self.get_slot(request)
+        if slot is not None:
+            window = self.get_window(key)
+            window.errors += 1
+            if window.responses + window.errors >= self.window:
+                self.adjust(key, slot, window)
+        return None
+
+    def adjust(self, key, slot, window):
+        """
+        Sets concurrency and delay of a slot from its last window.
+        """
+        total = window.responses + window.errors
+        latency = window.latency / window.responses if window.responses else None
+        baseline = self.baselines.get(key, latency)
+        concurrency, delay = slot.concurrency, slot.delay
+
+        if window.backoffs or window.errors / total > self.max_error_rate:
+            decision = 'backoff'
+            concurrency = concurrency // 2
+            delay = max(delay * 2, window.retry_after, 0.5)
+        elif latency is not None and latency > baseline * self.latency_factor:
+            decision = 'decrease'
+            if concurrency > self.min_concurrency:
+                concurrency -= 1
+            else:
+                delay = delay * 1.5 if delay else 0.1
+        else:
+            decision = 'increase'
+            if delay > self.min_delay:
+                delay = delay / 2 if delay >= 0.05 else 0.0
+            else:
+                concurrency += 1
+        if latency is not None:
+            # Slow windows weigh in too: a host that is always slow is not overloaded
+            self.baselines[key] = baseline + BASELINE_WEIGHT * (latency - baseline)
+
+        slot.concurrency = min(max(concurrency, self.min_concurrency), self.max_concurrency)
+        slot.delay = min(max(delay, self.min_delay), self.max_delay)
+
+        rate = window.rate()
+        self.stats.inc_value('adaptive/{}'.format(decision))
+        self.stats.set_value('adaptive/{}/concurrency'.format(key), slot.concurrency)
+        self.stats.set_value('adaptive/{}/delay'.format(key), round(slot.delay, 3))
+        self.stats.set_value('adaptive/{}/pages_per_second'.format(key), round(rate, 2))
+        self.history.append({
+            'elapsed': round(time.time() - self.started, 1),
+            'slot': key,
+            'decision': decision,
+            'concurrency': slot.concurrency,
+            'delay': round(slot.delay, 3),
+            'latency': round(latency, 3) if latency is not None else None,
+            'errors': window.errors + window.backoffs,
+            'pages_per_second': round(rate, 2),
+        })
+        del self.history[:-HISTORY_SIZE]
+        self.stats.set_value('adaptive/history', self.history)
+        logger.debug("Adaptive throttle %s %s: concurrency %d, delay %.2fs, %.1f pages/s",
+                     key, decision, slot.concurrency, slot.delay, rate)
+        self.windows[key] = SlotWindow()
+
+
+def retry_after(response):
+    """
+    Returns the `Retry-After` delay of a response in seconds, 0 if missing or a date.
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
@@ -1,8 +1,13 @@
+import re
+import sys
+import functools
 from urllib.parse import urlparse, urljoin
 from scrapy.settings import Settings
 import time
 import pymysql.cursors
 
+from sitemaps import inlinks, linked_levels
+
 def validate_url(url):
     """
     Checks if a valid HTTP or HTTPS URL has been provided: does it have a protocol and netloc?  
@@ -25,11 +30,71 @@ def is_internal(url,start_url):
     - url: URL to check  
     - start_url: reference URL to compare to  
     """
+    return url_origin(url) == url_origin(start_url)
+
+@functools.lru_cache(maxsize=65536)
+def url_origin(url):
+    """
+    Returns the scheme and netloc of a URL.  
+    Cached: the same targets are linked from thousands of pages.  
+    """
     u = urlparse(url)
-    s = urlparse(start_url)
-    if (u.scheme == s.scheme and u.netloc == s.netloc):
-        return True
-    return False
+    return (u.scheme, u.netloc)
+
+def parse_start_urls(value):
+    """
+    Parses [PROJECT] START_URLS: one start URL per line, optionally followed by
+    the depth limit of its site (`https://www.example.com/ 3`).
+    Returns a list of `(url, depth)` tuples, depth is None when not given.
+    Raises ValueError on an invalid URL or depth.
+
+    Arguments:
+    - value: START_URLS config value
+    """
+    seeds = list()
+    for line in value.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) > 2 or not validate_url(fields[0]):
+            raise ValueError("not a valid HTTP or HTTPS URL: {}".format(line.strip()))
+        depth = None
+        if len(fields) == 2:
+            if not fields[1].isdigit():
+                raise ValueError("not a valid depth: {}".format(line.strip()))
+            depth = int(fields[1])
+        seeds.append((fields[0], depth))
+    if not seeds:
+        raise ValueError("no start URL")
+    return seeds
+
+def partition_name(output_name, site):
+    """
+    Returns the output name of a site in a multi-site crawl, `output_name` itself
+    when output is not partitioned (site is None).
+    """
+    if site is None:
+        return output_name
+    return '{}_{}'.format(output_name, re.sub(r'[^\w.-]', '_', site))
+
+def memory_usage():
+    """
+    Returns the resident set size of the process and its peak, in bytes.
+    Returns `(None, None)` where the `resource` module is not available.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':  # Kilobytes, except on macOS
+        peak *= 1024
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:  # No procfs, the peak is the best estimate
+        rss = peak
+    return rss, peak
 
 def get_dbname(basename):
     """
@@ -114,6 +179,11 @@ def create_urls_table(basename,host,port,user,password):
                 `request_headers` text DEFAULT NULL,
                 `response_headers` text DEFAULT NULL,
                 `redirect` varchar(4096) DEFAULT NULL,
+                `pagerank` double DEFAULT '0',
+                `etag` varchar(256) DEFAULT NULL,
+                `last_modified` varchar(128) DEFAULT NULL,
+                `orphan` tinyint(1) DEFAULT NULL,
+                `duplicate_of` varchar(4096) DEFAULT NULL,
                 PRIMARY KEY (id)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_bin AUTO_INCREMENT=1;
             """
@@ -156,6 +226,98 @@ def create_links_table(basename,host,port,user,password):
     finally:
         connection.close()
 
+def update_pageranks(cursor, table, pageranks, batch_size=1000):
+    """
+    Bulk updates the pagerank column of a urls table through a temporary table.
+
+    Arguments:
+    - cursor: pymysql cursor, or adbapi transaction
+    - table: urls table name
+    - pageranks: iterable of `(url, pagerank)` pairs
+    """
+    cursor.execute(
+        "CREATE TEMPORARY TABLE `tmp_pageranks` ("
+        "`url` varchar(4096) NOT NULL, `pagerank` double NOT NULL, KEY (`url`(255))"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_bin"
+    )
+    sql = "INSERT INTO `tmp_pageranks` (`url`, `pagerank`) VALUES (%s, %s)"
+    batch = list()
+    for row in pageranks:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            batch = list()
+    if batch:
+        cursor.executemany(sql, batch)
+    cursor.execute(
+        "UPDATE `{}` u JOIN `tmp_pageranks` p ON u.`url` = p.`url` SET u.`pagerank` = p.`pagerank`".format(table)
+    )
+    cursor.execute("DROP TEMPORARY TABLE `tmp_pageranks`")
+
+def update_orphans(cursor, table, graph, batch_size=1000):
+    """
+    Decides orphans of a urls table once the crawl is over: pages crawled from sitemaps
+    stay orphans if no crawled page links to them, the others get the level of their links.
+
+    Arguments:
+    - cursor: pymysql cursor (DictCursor), or adbapi transaction
+    - table: urls table name
+    - graph: `LinkGraph` of the crawl
+    """
+    cursor.execute("SELECT `url` FROM `{}` WHERE `orphan` = 1".format(table))
+    linked = inlinks(graph, [row['url'] for row in cursor.fetchall()])
+    if not linked:
+        return
+    sources = list(set().union(*linked.values()))
+    levels = dict()
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        cursor.execute("SELECT `url`, `level` FROM `{}` WHERE `url` IN ({})".format(
+            table, ', '.join(['%s'] * len(batch))), batch)
+        levels.update((row['url'], row['level']) for row in cursor.fetchall())
+    levels = list(linked_levels(linked, levels).items())
+    sql = "UPDATE `{}` SET `orphan` = NULL, `level` = %s WHERE `url` = %s".format(table)
+    for start in range(0, len(levels), batch_size):
+        cursor.executemany(sql, [(level, url) for url, level in levels[start:start + batch_size]])
+
+def store_pageranks(basename,host,port,user,password,pageranks):
+    """
+    Writes the PageRank of a crawl to its urls table, once the crawl is over.
+    """
+    connection = pymysql.connect(host=host,
+        port=int(port),
+        db=basename,
+        user=user,
+        password=password,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor)
+    try:
+        with connection.cursor() as cursor:
+            update_pageranks(cursor, 'urls', pageranks)
+        connection.commit()
+
+    finally:
+        connection.close()
+
+def store_orphans(basename,host,port,user,password,graph):
+    """
+    Decides orphans of a crawl in its urls table, once the crawl is over.
+    """
+    connection = pymysql.connect(host=host,
+        port=int(port),
+        db=basename,
+        user=user,
+        password=password,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor)
+    try:
+        with connection.cursor() as cursor:
+            update_orphans(cursor, 'urls', graph)
+        connection.commit()
+
+    finally:
+        connection.close()
+
 def get_settings():
     """
     Creates Scrapy Settings object and sets basic values.
@@ -164,7 +326,7 @@ def get_settings():
     settings = Settings({
         # Crawling URLs from the same level before going deeper
         'DEPTH_PRIORITY': 1, # Don't touch
-        'SCHEDULER_DISK_QUEUE': 'scrapy.squeues.PickleFifoDiskQueue', # Don't touch
+        'SCHEDULER_DISK_QUEUE': 'crowl.CrowlDiskQueue', # Don't touch
         'SCHEDULER_MEMORY_QUEUE': 'scrapy.squeues.FifoMemoryQueue', # Don't touch
 
         # Internal Scrapy stuff
@@ -0,0 +1,209 @@
+import os
+import gzip
+import uuid
+import queue
+import base64
+import hashlib
+import logging
+import datetime
+import threading
+from http.client import responses as REASONS
+from urllib.parse import urlparse
+
+MAX_SIZE = 1000 * 1024 * 1024  # Files roll over above 1 GB, as usual for WARC
+QUEUE_SIZE = 500  # Responses waiting for the writer thread
+LOW_WATER = 100  # Queued responses below which a full writer accepts responses again
+# Scrapy gives decoded bodies: these headers would not describe the stored payload
+DECODED_HEADERS = (b'Transfer-Encoding', b'Content-Encoding', b'Content-Length')
+
+logger = logging.getLogger(__name__)
+
+
+def warc_date():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def record_id():
+    return '<urn:uuid:{}>'.format(uuid.uuid4())
+
+
+def digest(data):
+    return 'sha1:' + base64.b32encode(hashlib.sha1(data).digest()).decode('ascii')
+
+
+def warc_record(warc_type, headers, block, payload=None):
+    """
+    Builds a gzipped WARC/1.0 record.
+    Returns bytes: each record is its own gzip member, files can be read from any record.
+
+    Arguments:
+    - warc_type: `warcinfo`, `request` or `response`
+    - headers: list of `(name, value)` WARC headers, besides type, date, digests and length
+    - block: record content, bytes
+    - payload: payload of an HTTP record, for `WARC-Payload-Digest`
+    """
+    lines = ['WARC/1.0', 'WARC-Type: {}'.format(warc_type)]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    lines.append('WARC-Block-Digest: {}'.format(digest(block)))
+    if payload is not None:
+        lines.append('WARC-Payload-Digest: {}'.format(digest(payload)))
+    lines.append('Content-Length: {}'.format(len(block)))
+    head = ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+    return gzip.compress(head + block + b'\r\n\r\n', compresslevel=6)
+
+
+def http_headers(headers, skip=()):
+    lines = list()
+    for name, values in headers.items():
+        if name in skip:
+            continue
+        for value in values:
+            lines.append(name + b': ' + value)
+    return lines
+
+
+def request_block(request):
+    url = urlparse(request.url)
+    target = url.path or '/'
+    if url.query:
+        target += '?' + url.query
+    lines = ['{} {} HTTP/1.1'.format(request.method, target).encode('utf-8')]
+    if b'Host' not in request.headers:  # Added by the download handler
+        lines.append(b'Host: ' + url.netloc.encode('utf-8'))
+    lines.extend(http_headers(request.headers))
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + (request.body or b'')
+
+
+def response_block(response):
+    status = 'HTTP/1.1 {} {}'.format(response.status, REASONS.get(response.status, '')).strip()
+    lines = [status.encode('utf-8')]
+    lines.extend(http_headers(response.headers, skip=DECODED_HEADERS))
+    lines.append('Content-Length: {}'.format(len(response.body)).encode('utf-8'))
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + response.body
+
+
+class WarcWriter:
+    """
+    Writes request/response records to gzipped WARC files from a background thread,
+    the reactor only queues responses. Files roll over above `max_size`.
+    `write()` never blocks: when the writer falls behind, it refuses responses and
+    calls `on_drained`, from the writer thread, once the queue is down to `low_water`.
+
+    Arguments:
+    - directory: where WARC files are written
+    - prefix: file name prefix, `<prefix>-00000.warc.gz`
+    - max_size: size above which a new file is started, in bytes
+    - queue_size: responses waiting to be written
+    - low_water: queued responses below which `on_drained` is called
+    - on_drained: called without arguments when a full queue has drained
+    """
+    def __init__(self, directory, prefix, max_size=MAX_SIZE, queue_size=QUEUE_SIZE, low_water=LOW_WATER,
+                 on_drained=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.low_water = low_water
+        self.on_drained = on_drained
+        self.full = False  # A response was refused, `on_drained` is due
+        self.lock = threading.Lock()
+        self.file = None
+        self.filename = None
+        self.records = 0
+        self.bytes = 0
+        self.files = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name='WarcWriter', daemon=True)
+        self.thread.start()
+
+    def write(self, request, response):
+        """
+        Queues a response and its request, without blocking.
+        Returns False if the queue is full, the response isn't queued.
+        """
+        try:
+            self.queue.put_nowait((request, response))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.full = True
+            # The writer may have drained the queue before `full` was set
+            self.check_drained()
+            return False
+
+    def check_drained(self):
+        with self.lock:
+            drained = self.full and self.queue.qsize() <= self.low_water
+            if drained:
+                self.full = False
+        if drained and self.on_drained is not None:
+            self.on_drained()
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            try:
+                self.write_records(*entry)
+            except Exception:
+                self.errors += 1
+                logger.exception("Could not write WARC records for %s", entry[0].url)
+            self.check_drained()
+        if self.file is not None:
+            self.file.close()
+
+    def next_file(self):
+        if self.file is not None:
+            self.file.close()
+        index = self.files
+        while True:  # Resumed crawls keep the files already written
+            self.filename = '{}-{:05d}.warc.gz'.format(self.prefix, index)
+            path = os.path.join(self.directory, self.filename)
+            if not os.path.exists(path):
+                break
+            index += 1
+        self.file = open(path, 'wb')
+        self.files += 1
+        info = 'software: Crowl\r\nformat: WARC File Format 1.0\r\n'.encode('utf-8')
+        self.append(warc_record('warcinfo', [
+            ('WARC-Date', warc_date()),
+            ('WARC-Record-ID', record_id()),
+            ('WARC-Filename', self.filename),
+            ('Content-Type', 'application/warc-fields'),
+        ], info))
+
+    def append(self, record):
+        self.file.write(record)
+        self.bytes += len(record)
+
+    def write_records(self, request, response):
+        if self.file is None or self.file.tell() >= self.max_size:
+            self.next_file()
+        date = warc_date()
+        response_id = record_id()
+        self.append(warc_record('response', [
+            ('WARC-Date', date),
+            ('WARC-Record-ID', response_id),
+            ('WARC-Target-URI', response.url),
+            ('Content-Type', 'application/http; msgtype=response'),
+        ], response_block(response), payload=response.body))
+        self.append(warc_record('request', [
+            ('WARC-Date', date),
+            ('WARC-Record-ID', record_id()),
+            ('WARC-Target-URI', request.url),
+            ('WARC-Concurrent-To', response_id),
+            ('Content-Type', 'application/http; msgtype=request'),
+        ], request_block(request), payload=request.body or b''))
+        self.records += 2
+
+    def close(self, pending=()):
+        """
+        Writes queued responses, then `pending` ones, and closes the current file.
+        Blocks until done.
+        """
+        for entry in pending:
+            self.queue.put(entry)
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,176 @@
+import re
+from lxml import etree
+
+# Same extensions as Scrapy selectors
+NAMESPACES = {'re': 'http://exslt.org/regular-expressions'}
+EMPTY_DOCUMENT = etree.fromstring('<html/>')  # Custom extractors are evaluated once against it
+
+# Built-in fields, compiled once per process
+BUILTIN = {
+    'title': '//title',
+    'title_text': '//title/text()',
+    'meta_description': '//meta[@name=\'description\']/@content',
+    'meta_viewport': '//meta[@name=\'viewport\']/@content',
+    'meta_keywords': '//meta[@name=\'keywords\']/@content',
+    'meta_robots_tags': '//meta[@name=\'robots\']',
+    'meta_robots': '//meta[@name=\'robots\']/@content',
+    'meta_robots_nofollow': '//meta[@name="robots"]/@content[contains(., "nofollow")]',
+    'h1': '//h1',
+    'h1_text': '//h1[1]//text()',
+    'h2': '//h2',
+    'canonical': '//link[@rel=\'canonical\']/@href',
+    'prev': '//link[@rel="prev"]/@href',
+    'next': '//link[@rel="next"]/@href',
+    'html_lang': '//html/@lang',
+    'hreflangs': '//link[@hreflang]',
+}
+
+EXTRACTOR_TYPES = ('xpath',)
+
+# XPath 1.0 functions, functions of NAMESPACES are checked by their prefix only
+FUNCTIONS = {
+    'last', 'position', 'count', 'id', 'local-name', 'namespace-uri', 'name', 'string', 'concat',
+    'starts-with', 'contains', 'substring-before', 'substring-after', 'substring', 'string-length',
+    'normalize-space', 'translate', 'boolean', 'not', 'true', 'false', 'lang', 'number', 'sum',
+    'floor', 'ceiling', 'round',
+}
+NODE_TYPES = {'node', 'text', 'comment', 'processing-instruction'}
+NAME = r'[^\W\d][\w.-]*'
+TOKEN = re.compile(r'''\s*(?:
+    (?P<literal>"[^"]*"|'[^']*')
+  | (?P<number>\d+(?:\.\d*)?|\.\d+)
+  | (?P<variable>\$(?:{0}:)?{0})
+  | (?P<name>(?:{0}:)?(?:{0}|\*))
+  | (?P<other>::|\.\.|//|!=|<=|>=|\S)
+)'''.format(NAME), re.VERBOSE)
+# Tokens after which a name is a location step or a function, not an operator (and, or, div, mod)
+STEP_BEFORE = {'@', '::', '(', '[', ',', 'and', 'or', 'div', 'mod', '/', '//', '|', '+', '-', '=', '!=',
+               '<', '<=', '>', '>=', '*'}
+
+
+def compile_xpath(pattern):
+    """
+    Compiles an XPath expression.
+    Raises ValueError if the expression is invalid.
+    """
+    try:
+        return etree.XPath(pattern, namespaces=NAMESPACES)
+    except (etree.XPathSyntaxError, TypeError) as e:
+        raise ValueError("Invalid XPath '{}': {}".format(pattern, e))
+
+
+def check_names(pattern):
+    """
+    Checks the functions, namespace prefixes and variables of an XPath expression.
+    lxml only resolves them when they are evaluated: in a predicate, once a node
+    matches, the empty document of `validate_extractors` can't catch them.
+    Raises ValueError for an unknown one.
+    """
+    tokens = list()
+    for match in TOKEN.finditer(pattern):
+        kind = match.lastgroup
+        if kind is not None:
+            tokens.append((kind, match.group(kind)))
+    previous = None  # Previous token, None at the start
+    for c, (kind, value) in enumerate(tokens):
+        if kind == 'variable':
+            raise ValueError("Invalid XPath '{}': undefined variable {}".format(pattern, value))
+        operator = kind == 'name' and previous is not None and previous not in STEP_BEFORE
+        if kind == 'name' and not operator:
+            prefix, _, name = value.rpartition(':')
+            if prefix and prefix not in NAMESPACES:
+                raise ValueError("Invalid XPath '{}': undefined namespace prefix {}".format(pattern, prefix))
+            function = c + 1 < len(tokens) and tokens[c + 1][1] == '('
+            if function and not prefix and name not in FUNCTIONS | NODE_TYPES:
+                raise ValueError("Invalid XPath '{}': unknown function {}()".format(pattern, name))
+        previous = value if kind == 'other' or operator else kind
+
+
+def validate_extractors(extractors):
+    """
+    Checks custom extractors from the config file and compiles their patterns.
+    Returns a list of `(name, compiled_xpath)` tuples.
+    Raises ValueError on the first invalid extractor.
+
+    Arguments:
+    - extractors: list of dicts with `name`, `type` and `pattern` keys
+    """
+    compiled = list()
+    for ext in extractors or []:
+        if not isinstance(ext, dict) or not {'name', 'type', 'pattern'} <= set(ext):
+            raise ValueError("Extractor {} needs 'name', 'type' and 'pattern' keys.".format(ext))
+        if ext['type'] not in EXTRACTOR_TYPES:
+            raise ValueError("Extractor '{}': type '{}' not supported.".format(ext['name'], ext['type']))
+        xpath = compile_xpath(ext['pattern'])
+        check_names(ext['pattern'])
+        try:
+            xpath(EMPTY_DOCUMENT)
+        except etree.XPathError as e:
+            raise ValueError("Invalid XPath '{}': {}".format(ext['pattern'], e))
+        compiled.append((ext['name'], xpath))
+    return compiled
+
+
+def to_text(value):
+    """
+    Serializes an XPath result the way Scrapy selectors `extract()` do.
+    """
+    if isinstance(value, str):
+        return str(value)
+    if value is True:
+        return '1'
+    if value is False:
+        return '0'
+    try:
+        return etree.tostring(value, method='html', encoding='unicode', with_tail=False)
+    except TypeError:
+        return str(value)
+
+
+class XPathRegistry:
+    """
+    Precompiled XPath expressions for built-in fields and custom extractors.
+    Every expression is evaluated against the page's lxml tree.
+
+    Arguments:
+    - extractors: custom extractors from the config file
+    """
+    def __init__(self, extractors=None):
+        self.builtin = {name: compile_xpath(pattern) for name, pattern in BUILTIN.items()}
+        self.extractors = validate_extractors(extractors)
+
+    def all(self, name, tree):
+        result = self.builtin[name](tree)
+        if not isinstance(result, list):  # count(), string(), boolean() ...
+            result = [result]
+        return result
+
+    def first(self, name, tree, default='None'):
+        """
+        Returns the first result as text, stripped, `default` if nothing matched.
+        """
+        return first_text(self.all(name, tree), default)
+
+    def count(self, name, tree):
+        return len(self.all(name, tree))
+
+    def extract(self, tree):
+        """
+        Runs custom extractors. Returns a list of `{'name': ..., 'data': ...}` dicts.
+        """
+        extracted = list()
+        for name, xpath in self.extractors:
+            result = xpath(tree)
+            if not isinstance(result, list):
+                result = [result]
+            extracted.append({
+                'name': name,
+                'data': first_text(result, 'None')
+            })
+        return extracted
+
+
+def first_text(result, default):
+    if not result:
+        return default
+    return to_text(result[0]).strip()
@@ -131,10 +131,11 @@ def run_all():
         depth = st.sidebar.slider('Maximum depth', 0, 100, 5)
         lang = st.sidebar.checkbox("Detect Language")
         surfer = st.sidebar.radio("Choose a surfer model", ('basic', 'advanced'))
+        adaptive = st.sidebar.checkbox("Adaptive crawl speed")
 
         link_unique = st.sidebar.checkbox("Link unique for Visualization", key="disabled")
 
-        dataConfig = [text_url, values, depth, lang, surfer]
+        dataConfig = [text_url, values, depth, lang, surfer, adaptive]
 
         st.markdown("""
             <style>
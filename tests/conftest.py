@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Crowl modules import each other by name, as when running crowl/crowl.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crowl'))
@@ -0,0 +1,124 @@
+"""
+Writes `expected.json`, the link weights of the fixture pages computed by the quadratic
+reasonable surfer of the baseline (`Crowler.process_links`, commit aad0c09), which
+`surfer.link_weights` must reproduce. Language detection and an unreachable branch are
+left out: pages are English. Links outside paragraphs are taken in document order: the
+baseline took them in set order, which changes with PYTHONHASHSEED. Pages without
+paragraphs, where the baseline raised ZeroDivisionError, get position weights.
+
+    python tests/fixtures/surfer/make_expected.py
+"""
+import os
+import re
+import json
+
+import justext
+import lxml.html
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+LANGUAGE = 'English'
+
+
+def baseline_link_weights(content):
+    tree = lxml.html.fromstring(content)
+
+    def search_count(search_list, dom_html):
+        return sum(1 for search in search_list if search.dom_path.replace('.', '/') == dom_html)
+
+    def links_density_real(text, chars_count):
+        text_length = len(text)
+        if text_length == 0:
+            return 0
+        return chars_count / text_length
+
+    def clean_text(array):
+        clean_arr = []
+        regex = r"[^a-zA-Z0-9'?! ]+"
+        subst = ""
+        for string in array:
+            string = string.replace('\t', '').replace('\r', '').replace('\n', '')
+            result = re.sub(regex, subst, string, 0, re.MULTILINE)
+            if result:
+                clean_arr.append(result)
+        return clean_arr
+
+    language_name = LANGUAGE
+    paragraphs = justext.justext(content, justext.get_stoplist(language_name))
+    links_info = []
+    dom_arr = []
+    links_url = []
+    max = len(paragraphs)
+    c = 0
+
+    all_hrefs = []
+    for href in tree.xpath("//a/@href"):
+        all_hrefs.append(href)
+    all_hrefs = list(dict.fromkeys(all_hrefs))  # Baseline: list(set(all_hrefs)), in hash order
+    if max == 0:  # Baseline: ZeroDivisionError, pages without paragraphs get position weights
+        return {href: 1 - c / len(all_hrefs) for c, href in enumerate(all_hrefs)}
+
+    for paragraph in paragraphs:
+        c += 1
+        dom = paragraph.dom_path.replace('.', '/')
+        text1 = tree.xpath("//" + dom + "/a")
+        if len(text1) > 0:
+            density = paragraph.links_density()
+
+            def link_chars():
+                return paragraph.chars_count_in_links
+
+            stopwords_density = paragraph.stopwords_density(justext.get_stoplist(language_name))
+            weight_pos = 1 - c / max
+
+            dom = paragraph.dom_path.replace('.', '/')
+            count = dom_arr.count(dom)
+            dom_arr.append(dom)
+            url = tree.xpath("//" + dom + "/a/@href")
+
+            url_text = tree.xpath("//" + dom + "/a//text()")
+            len_links = 9999999999
+
+            weight = (density - stopwords_density) - weight_pos
+            if weight == 1.0 and count < len(url_text):
+                len_links = len(url_text[count])
+
+            if count < len(url):
+                count_real = search_count(paragraphs, dom)
+                count_url = links_url.count(url[count])
+
+                if count_url == 0:
+                    links_info.append([weight, url[count], len_links])
+                elif count_real < len(url) and count_real < len(clean_text(url_text)):
+                    weight_real = links_density_real(paragraph.text,
+                                                     link_chars()) - stopwords_density - weight_pos
+                    links_info.append([weight_real, url[count_real], 9999999999])
+                links_url.append(url[count])
+
+    missing_links = [href for href in all_hrefs if href not in [info[1] for info in links_info]]
+
+    for link in missing_links:
+        c += 1
+        weight_pos = 1 - c / max
+        links_info.append([weight_pos, link, 9999999999])
+
+    links_sorted = sorted(links_info, key=lambda d: d[0], reverse=False)
+    links_len_sorted = sorted(links_sorted, key=lambda d: d[2], reverse=True)
+
+    link_weights = {}
+    c = 0
+    for reason in links_len_sorted:
+        link_weights[reason[1]] = 1 - c / max
+        c += 1
+
+    return link_weights
+
+
+if __name__ == '__main__':
+    expected = dict()
+    for name in sorted(os.listdir(FIXTURES)):
+        if name.endswith('.html'):
+            with open(os.path.join(FIXTURES, name), 'rb') as f:
+                expected[name] = baseline_link_weights(f.read())
+    with open(os.path.join(FIXTURES, 'expected.json'), 'w') as f:
+        json.dump(expected, f, indent=2, sort_keys=True)
+        f.write('\n')
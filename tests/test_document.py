@@ -0,0 +1,21 @@
+from scrapy.http import HtmlResponse
+
+import document
+from document import ParsedDocument
+
+PAGE = """<html><head><title>Product</title>
+<script type="application/ld+json">{"@context": "http://schema.org", "@type": "Store", "name": "Garden"}</script>
+</head><body>
+<div itemscope itemtype="http://schema.org/Product">
+<span itemprop="name">Garden chair</span>
+<a itemprop="url" href="chair.html">Details</a>
+</div>
+</body></html>"""
+
+
+def test_microdata_without_private_helper(monkeypatch):
+    response = HtmlResponse('http://a.example/shop/page.html', body=PAGE.encode('utf-8'), encoding='utf-8')
+    expected = ParsedDocument(response).microdata()
+    assert expected['microdata'][0]['url'] == 'http://a.example/shop/chair.html'
+    monkeypatch.setattr(document, '_umicrodata_microformat', None)
+    assert ParsedDocument(response).microdata() == expected
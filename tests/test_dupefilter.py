@@ -0,0 +1,39 @@
+import os
+
+import pytest
+from scrapy.http import Request
+from scrapy.utils.request import request_fingerprint
+
+from dupefilter import CrowlDupeFilter, CrowlBloomDupeFilter
+
+
+def requests(start, stop):
+    return [Request('http://example.com/{}.html'.format(c)) for c in range(start, stop)]
+
+
+@pytest.mark.parametrize('cls', [CrowlDupeFilter, CrowlBloomDupeFilter])
+def test_reopen(tmp_path, cls):
+    path = str(tmp_path)
+    dupefilter = cls(path, capacity=16)  # Grows, or adds slices, several times
+    assert not any([dupefilter.request_seen(request) for request in requests(0, 200)])
+    assert all(dupefilter.request_seen(request) for request in requests(0, 200))
+    dupefilter.close('shutdown')
+
+    dupefilter = cls(path, capacity=16)
+    assert len(dupefilter.fingerprints) == 200
+    assert all(dupefilter.request_seen(request) for request in requests(0, 200))
+    assert sum(dupefilter.request_seen(request) for request in requests(200, 400)) <= 1  # Bloom false positives
+    dupefilter.close('finished')
+
+
+def test_import_scrapy_seen(tmp_path):
+    path = str(tmp_path)
+    with open(os.path.join(path, 'requests.seen'), 'w') as f:  # Left by Scrapy's dupefilter
+        for request in requests(0, 10):
+            f.write(request_fingerprint(request) + '\n')
+
+    dupefilter = CrowlDupeFilter(path)
+    assert len(dupefilter.fingerprints) == 10
+    assert dupefilter.request_seen(requests(5, 6)[0])
+    assert not dupefilter.request_seen(requests(10, 11)[0])
+    dupefilter.close('finished')
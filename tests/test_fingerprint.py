@@ -0,0 +1,68 @@
+import json
+
+from scrapy.http import HtmlResponse
+
+import fingerprint
+from fingerprint import ContentFingerprints, content_hash
+from extraction import PageExtractor
+from plan import ExtractionPlan
+
+PAGE = """<html><head><title>Product</title></head><body>
+<div itemscope itemtype="http://schema.org/Product">
+<span itemprop="name">Garden chair</span>
+<a itemprop="url" href="chair.html">Details</a>
+</div>
+<p>A <a href="related.html">related product</a> and the <a href="/">home page</a>.</p>
+</body></html>"""
+
+
+def response(url, body=PAGE):
+    return HtmlResponse(url, body=body.encode('utf-8'), encoding='utf-8')
+
+
+def test_simhash_only_for_new_bodies(monkeypatch):
+    calls = list()
+
+    def simhash(html):
+        calls.append(html)
+        return 1
+
+    monkeypatch.setattr(fingerprint, 'simhash', simhash)
+    fingerprints = ContentFingerprints()
+    digest = content_hash(PAGE.encode('utf-8'))
+    assert fingerprints.add('http://a.example/page.html', digest, PAGE) == (None, False)
+    assert fingerprints.add('http://b.example/copy.html', digest, PAGE) == ('http://a.example/page.html', True)
+    assert len(calls) == 1
+
+
+def test_near_duplicate():
+    fingerprints = ContentFingerprints()
+    words = ' '.join('word{}'.format(c) for c in range(300))
+    first, second = '<p>{} one</p>'.format(words), '<p>{} two</p>'.format(words)
+    assert fingerprints.add('http://a.example/1.html', content_hash(first.encode('utf-8')), first) == (None, False)
+    assert fingerprints.add('http://a.example/2.html', content_hash(second.encode('utf-8')), second) \
+        == ('http://a.example/1.html', False)
+
+
+def test_relocate_resolves_urls_against_duplicate():
+    extractor = PageExtractor(ExtractionPlan(links=True, microdata=True))
+    fields = extractor.extract(response('http://a.example/shop/page.html'))
+    assert 'http://a.example/shop/chair.html' in fields['microdata']
+    fingerprints = ContentFingerprints()
+    fingerprints.store(b'digest', fields)
+
+    copy = extractor.relocate(response('http://b.example/garden/copy.html'), fingerprints.fields(b'digest'))
+    microdata = json.loads(copy['microdata'])['microdata']
+    assert microdata[0]['url'] == 'http://b.example/garden/chair.html'
+    assert [link['target'] for link in copy['outlinks']] == \
+        ['http://b.example/garden/chair.html', 'http://b.example/garden/related.html', 'http://b.example/']
+    assert {link['source'] for link in copy['outlinks']} == {'http://b.example/garden/copy.html'}
+    assert copy['title'] == fields['title']
+
+
+def test_relocate_without_microdata():
+    extractor = PageExtractor(ExtractionPlan(links=True, microdata=True))
+    body = '<html><body><p>Text</p></body></html>'
+    fields = extractor.extract(response('http://a.example/page.html', body))
+    assert 'microdata' not in fields
+    assert 'microdata' not in extractor.relocate(response('http://b.example/copy.html', body), dict(fields))
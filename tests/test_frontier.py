@@ -0,0 +1,104 @@
+import os
+import pickle
+
+from queuelib import FifoDiskQueue
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+import frontier
+from frontier import CrowlDiskQueue, CrowlFrontierScheduler, RECORD, encode_request, decode_request
+
+
+def request(url, **meta):
+    """
+    Returns a request dict as built by Scrapy's `request_to_dict`.
+    """
+    return {'url': url, 'callback': '_callback', 'errback': None, 'method': 'GET',
+            'headers': {b'Referer': [b'http://example.com/']}, 'body': b'', 'cookies': {},
+            'meta': dict(depth=2, rule=0, link_weight=0.25, **meta), '_encoding': 'utf-8',
+            'priority': -3, 'dont_filter': False, 'flags': []}
+
+
+def decode(record):
+    return decode_request(RECORD.unpack(record[:RECORD.size]), record[RECORD.size:])
+
+
+def scheduler(crawler):
+    scheduler = CrowlFrontierScheduler.from_crawler(crawler)
+    scheduler.open(Spider.from_crawler(crawler, name='test'))
+    return scheduler
+
+
+def test_round_trip():
+    d = request('http://example.com/page.html', sitemap=True, custom={'key': [1, 2]})
+    assert decode(encode_request(d)) == d
+
+    d = request('http://example.com/post.html', link_text='Post')
+    d.update(method='POST', body=b'a=1', dont_filter=True)
+    d['headers'][b'Accept'] = [b'text/html']
+    d['meta']['depth'] = -1  # Doesn't fit its field, kept in the pickled extra fields
+    expected = dict(d, meta=dict(d['meta']))
+    del expected['meta']['link_text']  # Dropped once the link is extracted
+    assert decode(encode_request(d)) == expected
+
+
+def test_chunks_and_reopen(tmp_path, monkeypatch):
+    monkeypatch.setattr(frontier, 'CHUNK_SIZE', 500)  # A few records per chunk
+    path = str(tmp_path / 'queue')
+    urls = ['http://example.com/{}.html'.format(c) for c in range(50)]
+
+    queue = CrowlDiskQueue(path)
+    for url in urls[:30]:
+        queue.push(request(url))
+    assert [queue.pop()['url'] for _ in range(10)] == urls[:10]
+    queue.close()
+    assert len(os.listdir(path)) > 2  # Chunks left to read, and the state
+
+    queue = CrowlDiskQueue(path)
+    assert len(queue) == 20
+    for url in urls[30:]:
+        queue.push(request(url))
+    popped = list()
+    while len(queue):
+        popped.append(queue.pop())
+    assert [d['url'] for d in popped] == urls[10:]
+    assert popped[-1] == request(urls[-1])
+    assert queue.pop() is None
+    queue.close()
+    assert not os.path.exists(path)
+
+
+def test_legacy_queue_read_first(tmp_path):
+    path = str(tmp_path / 'queue')
+    legacy = FifoDiskQueue(path)  # Left by `PickleFifoDiskQueue`
+    legacy.push(pickle.dumps(request('http://example.com/old.html'), protocol=2))
+    legacy.close()
+
+    queue = CrowlDiskQueue(path)
+    queue.push(request('http://example.com/new.html'))
+    assert len(queue) == 2
+    assert [queue.pop()['url'], queue.pop()['url']] == ['http://example.com/old.html', 'http://example.com/new.html']
+    queue.close()
+    assert not os.path.exists(path)
+
+
+def test_requeue_at_lower_depth(tmp_path):
+    crawler = get_crawler(settings_dict={'JOBDIR': str(tmp_path), 'SCHEDULER_DISK_QUEUE': 'frontier.CrowlDiskQueue',
+                                         'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.ScrapyPriorityQueue'})
+    frontier_scheduler = scheduler(crawler)
+    url = 'http://example.com/page.html'
+    assert frontier_scheduler.enqueue_request(Request(url, meta={'rule': 0, 'depth': 3}, priority=-3))
+    assert frontier_scheduler.enqueue_request(Request(url, meta={'rule': 0, 'depth': 1}, priority=-1))
+    assert not frontier_scheduler.enqueue_request(Request(url, meta={'rule': 0, 'depth': 2}, priority=-2))
+    frontier_scheduler.close('shutdown')
+
+    frontier_scheduler = scheduler(crawler)  # Queued URLs are read back from JOBDIR
+    assert frontier_scheduler.pending.get(url) == [0, -1, 2, 1]
+    request = frontier_scheduler.next_request()
+    assert (request.url, request.meta['depth']) == (url, 1)
+    assert frontier_scheduler.next_request() is None  # The deeper copy is dropped
+    assert len(frontier_scheduler.pending) == 0
+    frontier_scheduler.close('finished')
+    stats = crawler.stats.get_stats()
+    assert (stats['frontier/requeued'], stats['frontier/skipped']) == (1, 1)
@@ -0,0 +1,60 @@
+import os
+
+from linkgraph import LinkGraph, EDGE_BYTES, URLS_FILE, EDGES_FILE
+from pagerank import IncrementalPageRank
+
+MAX_BYTES = 2 * EDGE_BYTES * 4  # Spills every 4 edges
+
+
+def add_edges(graph, start, stop):
+    for c in range(start, stop):
+        graph.add_edge('http://example.com/{}.html'.format(c % 7), 'http://example.com/{}.html'.format(c), c / 10)
+
+
+def test_checkpoint_restore_after_spill(tmp_path):
+    path = str(tmp_path / 'graph')
+    graph = LinkGraph(path, MAX_BYTES)
+    add_edges(graph, 0, 10)
+    assert graph.segments
+    graph.checkpoint(path, pages=10)
+    add_edges(graph, 10, 23)  # Appended by the next checkpoint
+    graph.checkpoint(path, pages=23)
+
+    restored, saved = LinkGraph.restore(path, path, MAX_BYTES)
+    assert saved['pages'] == 23
+    assert restored.urls == graph.urls
+    assert restored.get_id('http://example.com/22.html') == graph.get_id('http://example.com/22.html')
+    assert len(restored) == len(graph) == 23
+    assert list(restored.edges()) == list(graph.edges())
+
+
+def test_interrupted_checkpoint(tmp_path):
+    path = str(tmp_path / 'graph')
+    graph = LinkGraph(path, MAX_BYTES)
+    add_edges(graph, 0, 10)
+    graph.checkpoint(path)
+    expected = list(graph.edges())
+    # Files written after the last checkpoint, which didn't record their sizes
+    for name in (URLS_FILE, EDGES_FILE):
+        with open(os.path.join(path, name), 'ab') as f:
+            f.write(b'partial')
+
+    restored, _ = LinkGraph.restore(path, path, MAX_BYTES)
+    assert list(restored.edges()) == expected
+    add_edges(restored, 10, 12)
+    restored.checkpoint(path)  # Cuts the files back before appending
+    again, _ = LinkGraph.restore(path)
+    assert list(again.edges()) == list(restored.edges())
+    assert again.urls == restored.urls
+
+
+def test_pagerank_restore(tmp_path):
+    path = str(tmp_path / 'graph')
+    pagerank = IncrementalPageRank(LinkGraph(path, MAX_BYTES))
+    add_edges(pagerank.graph, 0, 15)
+    pagerank.compute()
+    pagerank.checkpoint(path)
+
+    restored = IncrementalPageRank.restore(path, path, MAX_BYTES)
+    assert list(restored.items()) == list(pagerank.items())
+    assert restored.computed_edges == 15
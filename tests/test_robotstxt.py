@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from scrapy.http import Response
+from scrapy.settings import Settings
+from scrapy.signalmanager import SignalManager
+from scrapy.statscollectors import MemoryStatsCollector
+from twisted.internet import defer
+
+from robotstxt import CrowlRobotsMiddleware, RobotsCache, MAX_REDIRECTS
+
+ROBOTS = b'User-agent: *\nDisallow: /private/\nSitemap: https://www.example.com/sitemap.xml\n'
+
+
+def middleware(responses):
+    """
+    Returns a robots.txt middleware downloading from `responses` (URL -> (status, headers, body)),
+    and the URLs it requested.
+    """
+    requested = list()
+
+    def download(request, spider):
+        requested.append(request.url)
+        status, headers, body = responses[request.url]
+        return defer.succeed(Response(request.url, status=status, headers=headers, body=body, request=request))
+
+    crawler = SimpleNamespace(settings=Settings({'ROBOTSTXT_OBEY': True}), signals=SignalManager(),
+                              engine=SimpleNamespace(download=download))
+    crawler.stats = MemoryStatsCollector(crawler)
+    return CrowlRobotsMiddleware(crawler), requested
+
+
+def test_redirected_robots_txt():
+    responses = {
+        'http://example.com/robots.txt': (301, {'Location': 'https://example.com/robots.txt'}, b''),
+        'https://example.com/robots.txt': (302, {'Location': '//www.example.com/robots.txt'}, b''),
+        'https://www.example.com/robots.txt': (200, {}, ROBOTS),
+    }
+    robots_middleware, requested = middleware(responses)
+    spider = SimpleNamespace(robots=RobotsCache())
+    robots_middleware.fetch('http://example.com', spider)
+
+    assert requested == list(responses)
+    assert spider.robots.allowed('http://example.com/private/page.html') is False
+    assert spider.robots.allowed('http://example.com/page.html') is True
+    assert spider.robots.sitemaps('http://example.com') == ['https://www.example.com/sitemap.xml']
+
+
+def test_redirect_loop_allows_everything():
+    responses = {'http://example.com/robots.txt': (301, {'Location': '/robots.txt'}, b'')}
+    robots_middleware, requested = middleware(responses)
+    spider = SimpleNamespace(robots=RobotsCache())
+    robots_middleware.fetch('http://example.com', spider)
+
+    assert len(requested) == MAX_REDIRECTS + 1
+    assert spider.robots.allowed('http://example.com/private/page.html') is True
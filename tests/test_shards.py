@@ -0,0 +1,124 @@
+import heapq
+import itertools
+from types import SimpleNamespace
+
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.signalmanager import SignalManager
+from scrapy.statscollectors import MemoryStatsCollector
+
+from shards import CrowlShardMiddleware, SharedFrontier, shard_of
+
+WORKERS = 2
+
+
+def url(name, shard):
+    """
+    Returns a URL named after `name` crawled by the worker `shard`.
+    """
+    for c in itertools.count():
+        candidate = 'http://example.com/{}-{}.html'.format(name, c)
+        if shard_of(candidate, WORKERS) == shard:
+            return candidate
+
+
+A, B = 0, 1
+R, A1, A2, A3, A5 = (url(name, A) for name in ('r', 'a1', 'a2', 'a3', 'a5'))
+B1, B2, B3, B4, B5, B6, B7 = (url(name, B) for name in ('b1', 'b2', 'b3', 'b4', 'b5', 'b6', 'b7'))
+X, X1 = url('x', B), url('x1', B)
+
+# Worker A finds X at depth 4 through its own pages, then at depth 3 through A5, which
+# it only gets from worker B after that. B is busy with its chain until then.
+GRAPH = {
+    R: [A1, B1],
+    A1: [A2], A2: [A3], A3: [X],
+    B1: [B2, A5], B2: [B3], B3: [B4], B4: [B5], B5: [B6], B6: [B7], B7: [],
+    A5: [X],
+    X: [X1], X1: [],
+}
+
+
+class Worker:
+    """
+    A worker crawling `GRAPH` level by level, like `CrowlFrontierScheduler`: a queued URL
+    found at a lower depth is requeued, a crawled one is dropped.
+    """
+    def __init__(self, shard, workers, path, levels):
+        self.levels = levels
+        self.queue = list()  # (depth, order, url)
+        self.order = itertools.count()
+        self.pending = dict()  # Queued URL -> depth
+        self.crawled = set()
+        self.spider = Spider('test')
+        settings = Settings({'SHARD_INDEX': shard, 'SHARD_COUNT': workers, 'SHARD_FRONTIER': path})
+        crawler = SimpleNamespace(settings=settings, signals=SignalManager(),
+                                  engine=SimpleNamespace(crawl=lambda request, spider: self.enqueue(request)))
+        crawler.stats = MemoryStatsCollector(crawler)
+        self.middleware = CrowlShardMiddleware(crawler)
+        self.middleware.spider = self.spider
+
+    def enqueue(self, request):
+        depth = request.meta['depth']
+        if request.url in self.crawled or self.pending.get(request.url, depth + 1) <= depth:
+            return
+        self.pending[request.url] = depth
+        heapq.heappush(self.queue, (depth, next(self.order), request.url))
+
+    def step(self):
+        """
+        Crawls a page, takes URLs sent by other workers when there is none left.
+        Returns False if the worker had nothing to do.
+        """
+        if not self.queue:
+            self.middleware.receive()
+        while self.queue:
+            depth, _, page = heapq.heappop(self.queue)
+            if self.pending.get(page) != depth:  # Copy left behind by a requeue
+                continue
+            del self.pending[page]
+            self.crawled.add(page)
+            self.levels[page] = depth
+            requests = [Request(link, meta={'depth': depth + 1, 'rule': 0}) for link in GRAPH[page]]
+            for request in self.middleware.process_spider_output(None, requests, self.spider):
+                self.enqueue(request)
+            return True
+        return False
+
+
+def crawl(tmp_path, workers):
+    """
+    Returns the level of each page of `GRAPH` crawled by `workers` workers taking turns.
+    """
+    path = str(tmp_path / 'frontier_{}.sqlite'.format(workers))
+    SharedFrontier.create(path, workers).close()
+    levels = dict()
+    crawlers = [Worker(shard, workers, path, levels) for shard in range(workers)]
+    for worker in crawlers:
+        for request in worker.middleware.process_start_requests([Request(R, meta={'depth': 0})], worker.spider):
+            worker.enqueue(request)
+    while any([worker.step() for worker in crawlers]):
+        pass
+    return levels, crawlers
+
+
+def test_levels_match_single_worker(tmp_path):
+    single, _ = crawl(tmp_path, 1)
+    sharded, crawlers = crawl(tmp_path, WORKERS)
+    assert single[X] == 3
+    assert sharded == single
+    assert crawlers[A].middleware.stats.get_value('shard/resent') == 1
+
+
+def test_deeper_or_same_depth_not_sent_again(tmp_path):
+    path = str(tmp_path / 'frontier.sqlite')
+    SharedFrontier.create(path, WORKERS).close()
+    worker = Worker(A, WORKERS, path, dict())
+    for depth in (2, 3, 2):
+        list(worker.middleware.process_spider_output(None, [Request(X, meta={'depth': depth})], worker.spider))
+    assert worker.middleware.stats.get_value('shard/sent') == 1
+    list(worker.middleware.process_spider_output(None, [Request(X, meta={'depth': 1})], worker.spider))
+    assert worker.middleware.stats.get_value('shard/sent') == 2
+    frontier = SharedFrontier(path, B)
+    requests, _ = frontier.claim()
+    assert [(d['url'], d['meta']['depth']) for d in requests] == [(X, 1)]
@@ -0,0 +1,62 @@
+import csv
+import gzip
+
+from linkgraph import LinkGraph
+from pipelines import decide_orphans, csv_rows
+from sitemaps import iter_sitemap
+
+HOME, PAGE = 'http://example.com/', 'http://example.com/page.html'
+LATE, NEXT = 'http://example.com/late.html', 'http://example.com/next.html'
+ALONE, CHAINED = 'http://example.com/alone.html', 'http://example.com/chained.html'
+
+IMAGE_SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url>
+    <loc>https://ex.com/page.html</loc>
+    <image:image><image:loc>https://ex.com/img.jpg</image:loc></image:image>
+  </url>
+  <url>
+    <image:image><image:loc>https://ex.com/first.jpg</image:loc></image:image>
+    <loc>https://ex.com/gallery.html</loc>
+    <image:image><image:loc>https://ex.com/second.jpg</image:loc></image:image>
+  </url>
+</urlset>"""
+
+INDEX = b"""<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://ex.com/pages.xml.gz</loc><lastmod>2024-01-01</lastmod></sitemap>
+</sitemapindex>"""
+
+
+def test_image_locations_are_not_pages():
+    assert list(iter_sitemap(IMAGE_SITEMAP)) == [('url', 'https://ex.com/page.html'),
+                                                  ('url', 'https://ex.com/gallery.html')]
+    assert list(iter_sitemap(gzip.compress(IMAGE_SITEMAP))) == list(iter_sitemap(IMAGE_SITEMAP))
+
+
+def test_sitemap_index_and_no_namespace():
+    assert list(iter_sitemap(INDEX)) == [('sitemap', 'https://ex.com/pages.xml.gz')]
+    body = b'<urlset><url><loc> https://ex.com/a.html </loc></url><url><loc>https://ex.com/b.html</loc></url></urlset>'
+    assert list(iter_sitemap(body, max_urls=1)) == [('url', 'https://ex.com/a.html')]
+
+
+def test_orphans_decided_from_link_graph(tmp_path):
+    graph = LinkGraph()
+    graph.add_edge(HOME, PAGE, 1.0)
+    graph.add_edge(PAGE, LATE, 1.0)  # Found once LATE was crawled from the sitemap
+    graph.add_edge(LATE, NEXT, 1.0)
+    graph.add_edge(ALONE, ALONE, 1.0)
+    graph.add_edge(ALONE, CHAINED, 1.0)  # Only an orphan links to it
+
+    path = str(tmp_path / 'test_urls.csv')
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['url', 'level', 'orphan'])
+        writer.writerows([[HOME, 0, ''], [PAGE, 1, ''], [LATE, -1, True], [NEXT, -1, True],
+                          [ALONE, -1, True], [CHAINED, -1, True]])
+    decide_orphans([path], graph)
+
+    assert {row['url']: (row['level'], row['orphan']) for row in csv_rows(path)} == {
+        HOME: ('0', ''), PAGE: ('1', ''), LATE: ('2', ''), NEXT: ('3', ''),
+        ALONE: ('-1', 'True'), CHAINED: ('-1', ''),
+    }
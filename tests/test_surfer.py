@@ -0,0 +1,22 @@
+import os
+import json
+
+import justext
+import lxml.html
+import pytest
+
+import surfer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'surfer')
+
+with open(os.path.join(FIXTURES, 'expected.json')) as f:
+    EXPECTED = json.load(f)
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_link_weights_match_baseline(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        content = f.read()
+    stoplist = justext.get_stoplist('English')
+    paragraphs = justext.justext(content, stoplist)
+    assert surfer.link_weights(lxml.html.fromstring(content), paragraphs, stoplist) == EXPECTED[name]
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+from throttle import CrowlAdaptiveThrottle
+
+SLOT = 'localhost'
+WINDOW = 20
+
+
+def throttle(concurrency=4, delay=1.0):
+    """
+    Returns an adaptive throttle over a single download slot, and the slot.
+    """
+    slot = SimpleNamespace(concurrency=concurrency, delay=delay)
+    crawler = SimpleNamespace(settings=Settings(), engine=SimpleNamespace(downloader=SimpleNamespace(slots={SLOT: slot})))
+    crawler.stats = MemoryStatsCollector(crawler)
+    return CrowlAdaptiveThrottle(crawler, min_concurrency=1, max_concurrency=16, min_delay=0.0, max_delay=10.0,
+                                 window=WINDOW, max_error_rate=0.1), slot
+
+
+def receive(middleware, statuses):
+    """
+    Sends responses with `statuses` through the throttle, same latency for all.
+    """
+    for c, status in enumerate(statuses):
+        url = 'http://localhost/{}.html'.format(c)
+        request = Request(url, meta={'download_slot': SLOT, 'download_latency': 0.1})
+        middleware.process_response(request, Response(url, status=status, request=request), None)
+
+
+def decisions(middleware):
+    return [entry['decision'] for entry in middleware.history]
+
+
+def test_window_counts_each_response_once():
+    middleware, _ = throttle()
+    receive(middleware, [200] * (WINDOW - 3) + [500, 500])
+    assert decisions(middleware) == []  # 19 responses, the window isn't full
+    receive(middleware, [500])
+    assert decisions(middleware) == ['backoff']
+    assert middleware.history[-1]['errors'] == 3
+
+
+def test_delay_follows_error_rate():
+    middleware, slot = throttle(concurrency=4, delay=1.0)
+
+    receive(middleware, [200] * WINDOW)
+    assert decisions(middleware) == ['increase']
+    assert (slot.concurrency, slot.delay) == (4, 0.5)
+
+    # 2 errors out of 20: exactly the maximum rate, not above
+    receive(middleware, [200] * (WINDOW - 2) + [500, 502])
+    assert decisions(middleware)[-1] == 'increase'
+    assert (slot.concurrency, slot.delay) == (4, 0.25)
+
+    # 3 errors out of 20: above the maximum rate
+    receive(middleware, [200] * (WINDOW - 3) + [500, 502, 504])
+    assert decisions(middleware)[-1] == 'backoff'
+    assert (slot.concurrency, slot.delay) == (2, 0.5)
+
+    receive(middleware, [200] * WINDOW)
+    assert decisions(middleware)[-1] == 'increase'
+    assert (slot.concurrency, slot.delay) == (2, 0.25)
+
+
+def test_backoff_status_is_not_an_error():
+    middleware, slot = throttle(concurrency=4, delay=1.0)
+    receive(middleware, [200] * (WINDOW - 1) + [503])
+    assert decisions(middleware) == ['backoff']
+    assert middleware.history[-1]['errors'] == 1
+    assert (slot.concurrency, slot.delay) == (2, 2.0)
@@ -0,0 +1,35 @@
+import pytest
+
+from lxml import etree
+
+from xpaths import XPathRegistry, validate_extractors
+
+VALID = [
+    '//title/text()',
+    'count(//p)',
+    '//a[re:test(@href, "^/blog/")]/@href',
+    '//div[@id and (@class or @role)]//p[position() mod 2 = 1]',
+    '//*[local-name() = "and"]/following-sibling::node()[1]',
+]
+INVALID = ['//p[', '//p[foo:bar()]', '//p[$x]', '//p[nosuchfn()]', '//x:p', 'nosuchfn()']
+
+
+def extractor(pattern):
+    return [{'name': 'test', 'type': 'xpath', 'pattern': pattern}]
+
+
+@pytest.mark.parametrize('pattern', VALID)
+def test_valid_extractor(pattern):
+    assert [name for name, _ in validate_extractors(extractor(pattern))] == ['test']
+
+
+@pytest.mark.parametrize('pattern', INVALID)
+def test_invalid_extractor_fails_at_startup(pattern):
+    with pytest.raises(ValueError):
+        validate_extractors(extractor(pattern))
+
+
+def test_extract():
+    tree = etree.fromstring('<html><body><a href="/blog/post.html">Post</a></body></html>')
+    registry = XPathRegistry(extractor(VALID[2]))
+    assert registry.extract(tree) == [{'name': 'test', 'data': '/blog/post.html'}]